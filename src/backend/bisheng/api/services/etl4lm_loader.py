@@ -3,7 +3,10 @@
 import base64
 import logging
 import os
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 import cv2
@@ -17,6 +20,9 @@ from bisheng.utils.minio_client import minio_client
 
 logger = logging.getLogger(__name__)
 
+# PyMuPDF 不是线程安全的，并发切分pdf时串行执行
+_fitz_lock = threading.Lock()
+
 
 def get_image_tag(results, part):
     element_id = part.get("element_id", None)
@@ -168,10 +174,21 @@ class Etl4lmLoader(BasePDFLoader):
             knowledge_id: int = None,
             start: int = 0,
             n: int = None,
+            shard_pages: int = None,
+            shard_workers: int = 4,
+            max_retries: int = 2,
             verbose: bool = False,
+            allow_partial: bool = False,
             kwargs: dict = {},
     ) -> None:
-        """Initialize with a file path."""
+        """Initialize with a file path.
+
+        shard_pages: pdf页数超过该值时按页切分为多个分片并发解析，为空或0时不切分
+        shard_workers: 分片解析的最大并发数
+        max_retries: 单个分片解析失败后的重试次数
+        allow_partial: 部分分片重试后仍失败时是否保留其他分片的结果，失败的页码记录在failed_pages中；
+            为False时抛出异常，避免文件缺少部分页面却解析成功
+        """
         self.unstructured_api_url = unstructured_api_url
         self.unstructured_api_key = unstructured_api_key
         self.force_ocr = force_ocr
@@ -183,16 +200,19 @@ class Etl4lmLoader(BasePDFLoader):
         self.timemout = timeout
         self.start = start
         self.n = n
+        self.shard_pages = shard_pages
+        self.shard_workers = shard_workers
+        self.max_retries = max_retries
+        self.allow_partial = allow_partial
         self.extra_kwargs = kwargs
         self.partitions = None
+        # 重试后仍解析失败的页码范围 [(start, end)]，左闭右开
+        self.failed_pages: List[Tuple[int, int]] = []
         self.knowledge_id = knowledge_id
         super().__init__(file_path)
 
-    def load(self) -> List[Document]:
-        """Load given path as pages."""
-        b64_data = base64.b64encode(open(self.file_path, "rb").read()).decode()
-        parameters = {"start": self.start, "n": self.n}
-        parameters.update(self.extra_kwargs)
+    def _partition(self, b64_data: str, parameters: dict) -> dict:
+        """ 调用etl4lm解析文件，返回解析结果 """
         # TODO: add filter_page_header_footer into payload when elt4llm is ready.
         payload = dict(
             filename=os.path.basename(self.file_name),
@@ -228,6 +248,108 @@ class Etl4lmLoader(BasePDFLoader):
             raise Exception(
                 f"file partition error {os.path.basename(self.file_name)} error resp={resp}"
             )
+        return resp
+
+    def _shard_ranges(self) -> Optional[List[Tuple[int, int]]]:
+        """ 需要分片解析时返回每个分片的页码范围，左闭右开 """
+        if not self.shard_pages or self.shard_pages <= 0:
+            return None
+        if not self.file_name.lower().endswith(".pdf") or self.start or self.n:
+            return None
+        with _fitz_lock:
+            with fitz.open(self.file_path) as pdf_document:
+                page_count = pdf_document.page_count
+        if page_count <= self.shard_pages:
+            return None
+        return [(one, min(one + self.shard_pages, page_count)) for one in range(0, page_count, self.shard_pages)]
+
+    def _shard_b64(self, start: int, end: int) -> str:
+        with _fitz_lock:
+            with fitz.open(self.file_path) as src, fitz.open() as dst:
+                dst.insert_pdf(src, from_page=start, to_page=end - 1)
+                return base64.b64encode(dst.tobytes()).decode()
+
+    def _partition_shard(self, start: int, end: int) -> dict:
+        """ 解析单个分片，失败后重试 """
+        b64_data = self._shard_b64(start, end)
+        parameters = {"start": 0, "n": None}
+        parameters.update(self.extra_kwargs)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._partition(b64_data, parameters)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise e
+                logger.warning(f"etl4lm shard pages=[{start}, {end}) retry={attempt + 1} error={e}")
+                time.sleep(min(2 ** attempt, 10))
+
+    @staticmethod
+    def _shard_partitions(resp: dict, start: int) -> List[Dict]:
+        """ 分片内的页码从0开始，加上分片的起始页得到在原文件中的页码 """
+        partitions = resp.get("partitions") or []
+        if not partitions and resp.get("text"):
+            partitions = [{
+                "type": "NarrativeText",
+                "text": resp["text"],
+                "metadata": {"extra_data": {"bboxes": [], "pages": [], "indexes": [], "types": []}},
+            }]
+        for part in partitions:
+            extra_data = part["metadata"]["extra_data"]
+            extra_data["pages"] = [one + start for one in extra_data["pages"]]
+        return partitions
+
+    def _load_shards(self, ranges: List[Tuple[int, int]]) -> dict:
+        """ 并发解析所有分片，按页码顺序拼接结果；allow_partial时部分分片失败保留其他分片的结果 """
+        logger.info(f"etl4lm partition file={os.path.basename(self.file_name)} shards={len(ranges)}")
+        results: List[Optional[dict]] = [None] * len(ranges)
+        last_error = None
+        with ThreadPoolExecutor(max_workers=max(1, min(self.shard_workers, len(ranges)))) as executor:
+            futures = [executor.submit(self._partition_shard, start, end) for start, end in ranges]
+            for index, future in enumerate(futures):
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    last_error = e
+                    self.failed_pages.append(ranges[index])
+                    logger.error(f"etl4lm shard pages=[{ranges[index][0]}, {ranges[index][1]}) failed: {e}")
+        if all(one is None for one in results):
+            raise last_error
+        if self.failed_pages and not self.allow_partial:
+            pages = ", ".join(f"{start + 1}-{end}" for start, end in self.failed_pages)
+            raise Exception(f"etl4lm failed to parse pages {pages}: {last_error}")
+
+        partitions = []
+        for (start, _), one in zip(ranges, results):
+            if one is not None:
+                partitions.extend(self._shard_partitions(one, start))
+        resp = {"status_code": 200, "partitions": partitions}
+        if any(one and one.get("b64_pdf") for one in results):
+            resp["b64_pdf"] = self._merge_shard_pdf(ranges, results)
+        return resp
+
+    def _merge_shard_pdf(self, ranges: List[Tuple[int, int]], results: List[Optional[dict]]) -> str:
+        """ 拼接各分片返回的pdf，没有返回pdf的分片使用原文件的页 """
+        with _fitz_lock:
+            with fitz.open(self.file_path) as src, fitz.open() as dst:
+                for (start, end), one in zip(ranges, results):
+                    if one and one.get("b64_pdf"):
+                        with fitz.open(stream=base64.b64decode(one["b64_pdf"]), filetype="pdf") as shard:
+                            dst.insert_pdf(shard)
+                    else:
+                        dst.insert_pdf(src, from_page=start, to_page=end - 1)
+                return base64.b64encode(dst.tobytes()).decode()
+
+    def load(self) -> List[Document]:
+        """Load given path as pages."""
+        ranges = self._shard_ranges()
+        if ranges:
+            resp = self._load_shards(ranges)
+        else:
+            b64_data = base64.b64encode(open(self.file_path, "rb").read()).decode()
+            parameters = {"start": self.start, "n": self.n}
+            parameters.update(self.extra_kwargs)
+            resp = self._partition(b64_data, parameters)
+
         partitions = resp["partitions"]
         if partitions:
             logger.info(f"content_from_partitions")
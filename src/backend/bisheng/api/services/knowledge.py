@@ -1,11 +1,13 @@
+import base64
 import io
 import json
 import math
 import os
 import time
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from elasticsearch import NotFoundError as EsNotFoundError
 from fastapi import BackgroundTasks, Request
 from loguru import logger
 from pymilvus import Collection
@@ -25,7 +27,7 @@ from bisheng.api.services.knowledge_imp import (
     read_chunk_text,
 )
 from bisheng.api.services.user_service import UserPayload
-from bisheng.api.utils import get_request_ip
+from bisheng.api.utils import get_request_ip, md5_hash
 from bisheng.api.v1.schema.knowledge import KnowledgeFileResp
 from bisheng.api.v1.schemas import (
     FileChunk,
@@ -61,6 +63,7 @@ from bisheng.database.models.user import UserDao
 from bisheng.database.models.user_group import UserGroupDao
 from bisheng.database.models.user_role import UserRoleDao
 from bisheng.interface.embeddings.custom import FakeEmbedding
+from bisheng.interface.vector_store.registry import vector_store_registry
 from bisheng.settings import settings
 from bisheng.utils import generate_uuid
 from bisheng.utils.embedding import decide_embeddings
@@ -320,11 +323,13 @@ class KnowledgeService(KnowledgeUtils):
                 # 判断milvus 是否还有entity
                 if vector_client.col.is_empty:
                     vector_client.col.drop()
+            vector_store_registry.evict_milvus(knowledge.collection_name)
 
         # 处理 es
         index_name = knowledge.index_name or knowledge.collection_name  # 兼容老版本
         es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
         res = es_client.client.indices.delete(index=index_name, ignore=[400, 404])
+        vector_store_registry.evict_es(index_name)
         logger.info(f"act=delete_es index={index_name} res={res}")
 
     @classmethod
@@ -842,6 +847,56 @@ class KnowledgeService(KnowledgeUtils):
             login_user, get_request_ip(request), knowledge_id, file_name
         )
 
+    @classmethod
+    def _build_chunk_query(cls, file_ids: List[int] = None, keyword: str = None) -> Dict:
+        """ 分块浏览的查询条件，文件过滤放到filter里，可以同时用于search和count """
+        query = {"bool": {}}
+        if file_ids:
+            query["bool"]["filter"] = [{"terms": {"metadata.file_id": file_ids}}]
+        if keyword:
+            query["bool"]["must"] = [{"match_phrase": {"text": keyword}}]
+        return query
+
+    @classmethod
+    def _get_chunk_total(cls, es_client, index_name: str, knowledge_id: int, query: Dict, expiration: int) -> int:
+        """ 分块总数单独用count查询并缓存，翻页时不再每次精确计算命中数 """
+        query_hash = md5_hash(json.dumps(query, sort_keys=True, ensure_ascii=False))
+        cache_key = f"knowledge:chunk_total:{knowledge_id}:{query_hash}"
+        total = redis_client.get(cache_key)
+        if total is not None:
+            return total
+        total = es_client.client.count(index=index_name, body={"query": query})["count"]
+        redis_client.set(cache_key, total, expiration=expiration)
+        return total
+
+    @staticmethod
+    def _encode_chunk_cursor(data: Dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("utf-8")
+
+    @staticmethod
+    def _decode_chunk_cursor(cursor: str) -> Optional[Dict]:
+        try:
+            return json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        except Exception as e:
+            logger.warning(f"act=decode_chunk_cursor error={str(e)}")
+            return None
+
+    @classmethod
+    def _get_chunk_pit(cls, es_client, index_name: str, knowledge_id: int, pit_key: Optional[str],
+                       keep_alive: str) -> (str, str):
+        """
+        获取翻页使用的point in time，返回 (pit_key, pit_id)
+        pit_id 只存在redis中，游标里只带随机的pit_key，避免通过游标访问其他知识库的索引
+        """
+        if pit_key:
+            pit_id = redis_client.get(f"knowledge:chunk_pit:{knowledge_id}:{pit_key}")
+            if pit_id:
+                return pit_key, pit_id
+        pit_key = generate_uuid()
+        pit_id = es_client.client.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+        redis_client.set(f"knowledge:chunk_pit:{knowledge_id}:{pit_key}", pit_id, expiration=3600)
+        return pit_key, pit_id
+
     @classmethod
     def get_knowledge_chunks(
             cls,
@@ -852,7 +907,12 @@ class KnowledgeService(KnowledgeUtils):
             keyword: str = None,
             page: int = None,
             limit: int = None,
-    ) -> (List[FileChunk], int):
+            cursor: str = None,
+    ) -> (List[FileChunk], int, Optional[str]):
+        """
+        分页获取知识库的分块，返回 (分块列表, 总数, 下一页的游标)
+        传了cursor时使用search_after翻页，不受max_result_window限制，否则按page使用from翻页
+        """
         db_knowledge = KnowledgeDao.query_by_id(knowledge_id)
         if not db_knowledge:
             raise NotFoundError.http_exception()
@@ -869,10 +929,19 @@ class KnowledgeService(KnowledgeUtils):
         )
         embeddings = FakeEmbedding()
         es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
+        browse_conf = settings.get_knowledge_chunk_browse_conf()
+
+        query = cls._build_chunk_query(file_ids, keyword)
+        query_hash = md5_hash(json.dumps(query, sort_keys=True, ensure_ascii=False))
+        cursor_data = cls._decode_chunk_cursor(cursor) if cursor else None
+        if cursor_data and cursor_data.get("q") != query_hash:
+            # 查询条件变了，游标失效，从第一页开始
+            cursor_data = None
 
         search_data = {
-            "from": (page - 1) * limit,
             "size": limit,
+            "query": query,
+            "track_total_hits": False,
             "sort": [
                 {
                     "metadata.file_id": {
@@ -890,12 +959,38 @@ class KnowledgeService(KnowledgeUtils):
                 },
             ],
         }
-        if file_ids:
-            search_data["post_filter"] = {"terms": {"metadata.file_id": file_ids}}
-        if keyword:
-            search_data["query"] = {"match_phrase": {"text": keyword}}
+        if cursor_data:
+            search_data["search_after"] = cursor_data["after"]
+            # 游标里的排序值和生成它的查询方式一致：point in time的排序值带有隐式的_shard_doc，不能混用
+            use_pit = bool(cursor_data.get("pit"))
+        else:
+            # 游标无效时从第一页开始
+            search_data["from"] = 0 if cursor else (page - 1) * limit
+            # 从第一页开始翻页时打开point in time，后续的游标都基于它
+            use_pit = browse_conf.use_pit and search_data["from"] == 0
         try:
-            res = es_client.client.search(index=index_name, body=search_data)
+            if cursor_data:
+                total = cursor_data["total"]
+            else:
+                total = cls._get_chunk_total(es_client, index_name, knowledge_id, query,
+                                             browse_conf.total_cache_expiration)
+            pit_key = None
+            if use_pit:
+                pit_key, pit_id = cls._get_chunk_pit(es_client, index_name, knowledge_id,
+                                                     cursor_data.get("pit") if cursor_data else None,
+                                                     browse_conf.pit_keep_alive)
+                search_data["pit"] = {"id": pit_id, "keep_alive": browse_conf.pit_keep_alive}
+                try:
+                    res = es_client.client.search(body=search_data)
+                except EsNotFoundError as e:
+                    # point in time过期了，重新打开一个
+                    logger.info(f"act=get_knowledge_chunks pit expired={str(e)}")
+                    pit_key, pit_id = cls._get_chunk_pit(es_client, index_name, knowledge_id, None,
+                                                         browse_conf.pit_keep_alive)
+                    search_data["pit"]["id"] = pit_id
+                    res = es_client.client.search(body=search_data)
+            else:
+                res = es_client.client.search(index=index_name, body=search_data)
         except Exception as e:
             logger.warning(f"act=get_knowledge_chunks error={str(e)}")
             raise KnowledgeChunkError.http_exception()
@@ -903,13 +998,14 @@ class KnowledgeService(KnowledgeUtils):
         # 查询下分块对应的文件信息
         file_ids = set()
         result = []
-        for one in res["hits"]["hits"]:
+        hits = res["hits"]["hits"]
+        for one in hits:
             file_ids.add(one["_source"]["metadata"]["file_id"])
         file_map = {}
         if file_ids:
             file_list = KnowledgeFileDao.get_file_by_ids(list(file_ids))
             file_map = {one.id: one for one in file_list}
-        for one in res["hits"]["hits"]:
+        for one in hits:
             file_id = one["_source"]["metadata"]["file_id"]
             file_info = file_map.get(file_id, None)
             # 过滤文件名和总结的文档摘要内容
@@ -920,7 +1016,17 @@ class KnowledgeService(KnowledgeUtils):
                     parse_type=file_info.parse_type if file_info else None,
                 )
             )
-        return result, res["hits"]["total"]["value"]
+
+        next_cursor = None
+        # 开启point in time后，按页码跳转的请求没有使用point in time，不返回游标，避免后续翻页混用两种排序值
+        if hits and len(hits) >= limit and (use_pit or cursor_data or not browse_conf.use_pit):
+            next_cursor = cls._encode_chunk_cursor({
+                "after": hits[-1]["sort"],
+                "total": total,
+                "q": query_hash,
+                "pit": pit_key,
+            })
+        return result, total, next_cursor
 
     @classmethod
     def update_knowledge_chunk(
@@ -2,7 +2,8 @@ import json
 import os
 import re
 import time
-from typing import Any, Dict, List, Optional, BinaryIO, Union
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, BinaryIO, Tuple, Union
 
 import requests
 from bisheng_langchain.rag.extract_info import extract_title
@@ -35,7 +36,7 @@ from bisheng.api.services.llm import LLMService
 from bisheng.api.services.md_from_pdf import is_pdf_damaged
 from bisheng.api.services.patch_130 import (
     convert_file_to_md,
-    combine_multiple_md_files_to_raw_texts,
+    table_file_to_raw_texts,
 )
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import ExcelRule
@@ -56,9 +57,11 @@ from bisheng.database.models.knowledge_file import (
 from bisheng.interface.embeddings.custom import FakeEmbedding
 from bisheng.interface.importing.utils import import_vectorstore
 from bisheng.interface.initialize.loading import instantiate_vectorstore
+from bisheng.interface.vector_store.registry import vector_store_registry
 from bisheng.settings import settings
 from bisheng.utils.embedding import decide_embeddings
 from bisheng.utils.minio_client import minio_client
+from bisheng.utils.pipeline import PipelineStage, StagePipeline
 
 filetype_load_map = {
     "txt": TextLoader,
@@ -263,7 +266,6 @@ def delete_vector_files(file_ids: List[int], knowledge: Knowledge) -> bool:
     embeddings = FakeEmbedding()
     vector_client = decide_vectorstores(knowledge.collection_name, "Milvus", embeddings)
     vector_client.col.delete(expr=f"file_id in {file_ids}", timeout=10)
-    vector_client.close_connection(vector_client.alias)
     logger.info(f"delete_milvus file_ids={file_ids}")
 
     es_client = decide_vectorstores(
@@ -343,9 +345,17 @@ def decide_vectorstores(
     else:
         raise RuntimeError("unknown vector store type")
 
-    param.update(vector_config)
     class_obj = import_vectorstore(vector_store)
-    return instantiate_vectorstore(vector_store, class_object=class_obj, params=param)
+    # 复用进程内共享的客户端和collection状态，避免每次都重新建立连接和加载collection
+    if vector_store == "ElasticKeywordsSearch":
+        return vector_store_registry.get_es_store(class_obj, collection_name, embedding, vector_config)
+    if vectorstore := vector_store_registry.get_milvus_store(class_obj, collection_name, embedding, vector_config):
+        return vectorstore
+
+    param.update(vector_config)
+    vectorstore = instantiate_vectorstore(vector_store, class_object=class_obj, params=param)
+    vector_store_registry.put_milvus_store(vectorstore, vector_config)
+    return vectorstore
 
 
 def decide_knowledge_llm() -> Any:
@@ -362,6 +372,17 @@ def decide_knowledge_llm() -> Any:
     )
 
 
+@dataclass
+class IngestFileTask:
+    """ 入库流水线中单个文件的处理上下文 """
+    db_file: KnowledgeFile
+    preview_cache_key: Optional[str] = None
+    filepath: Optional[str] = None
+    texts: List[str] = field(default_factory=list)
+    metadatas: List[dict] = field(default_factory=list)
+    vectors: Optional[List[List[float]]] = None
+
+
 def addEmbedding(
         collection_name: str,
         index_name: str,
@@ -380,7 +401,9 @@ def addEmbedding(
         force_ocr: int = 0,
         filter_page_header_footer: int = 0,
 ):
-    """将文件加入到向量和es库内"""
+    """将文件加入到向量和es库内
+    解析、向量化、写入向量库三个阶段以流水线的方式执行，不同文件的不同阶段可以并行
+    """
 
     logger.info("start process files")
     embeddings = decide_embeddings(model)
@@ -391,6 +414,55 @@ def addEmbedding(
     logger.info("start init ElasticKeywordsSearch")
     es_client = decide_vectorstores(index_name, "ElasticKeywordsSearch", embeddings)
 
+    def parse_stage(task: IngestFileTask) -> IngestFileTask:
+        db_file = task.db_file
+        logger.info(
+            f"process_file_begin file_id={db_file.id} file_name={db_file.file_name}"
+        )
+        task.filepath, task.texts, task.metadatas = parse_file_chunks(
+            vector_client,
+            es_client,
+            minio_client,
+            db_file,
+            separator,
+            separator_rule,
+            chunk_size,
+            chunk_overlap,
+            extra_meta=extra_meta,
+            preview_cache_key=task.preview_cache_key,
+            retain_images=retain_images,
+            knowledge_id=knowledge_id,
+            enable_formula=enable_formula,
+            force_ocr=force_ocr,
+            filter_page_header_footer=filter_page_header_footer,
+        )
+        return task
+
+    ingest_conf = settings.get_knowledge_ingest_conf()
+
+    def embed_stage(task: IngestFileTask) -> IngestFileTask:
+        # chunk数较多的文件在写入阶段边向量化边写入，避免一次性持有所有向量
+        if len(task.texts) > ingest_conf.stream_threshold:
+            return task
+        logger.info(f"embed_texts file={task.db_file.id} file_name={task.db_file.file_name}")
+        task.vectors = embeddings.embed_documents(task.texts)
+        return task
+
+    def insert_stage(task: IngestFileTask) -> IngestFileTask:
+        add_text_into_vector(
+            vector_client,
+            es_client,
+            task.db_file,
+            task.texts,
+            task.metadatas,
+            vectors=task.vectors,
+            embed_batch_size=ingest_conf.embed_batch_size,
+        )
+        logger.info(f"add_complete file={task.db_file.id} file_name={task.db_file.file_name}")
+        finish_file_embedding(minio_client, task.db_file, task.filepath, task.preview_cache_key)
+        return task
+
+    tasks = []
     for index, db_file in enumerate(knowledge_files):
         # 尝试从缓存中获取文件的分块
         preview_cache_key = None
@@ -398,49 +470,42 @@ def addEmbedding(
             preview_cache_key = (
                 preview_cache_keys[index] if index < len(preview_cache_keys) else None
             )
-        try:
-            logger.info(
-                f"process_file_begin file_id={db_file.id} file_name={db_file.file_name}"
-            )
-            # TODO:TJU: 多list里面取值
-            add_file_embedding(
-                vector_client,
-                es_client,
-                minio_client,
-                db_file,
-                separator,
-                separator_rule,
-                chunk_size,
-                chunk_overlap,
-                extra_meta=extra_meta,
-                preview_cache_key=preview_cache_key,
-                # 增加的参数
-                retain_images=retain_images,
-                knowledge_id=knowledge_id,
-                enable_formula=enable_formula,
-                force_ocr=force_ocr,
-                filter_page_header_footer=filter_page_header_footer,
-            )
+        tasks.append(IngestFileTask(db_file=db_file, preview_cache_key=preview_cache_key))
+
+    pipeline = StagePipeline(
+        [
+            PipelineStage(name="parse", handler=parse_stage, workers=ingest_conf.parse_workers),
+            PipelineStage(name="embed", handler=embed_stage, workers=ingest_conf.embed_workers),
+            PipelineStage(name="insert", handler=insert_stage, workers=ingest_conf.insert_workers),
+        ],
+        queue_size=ingest_conf.queue_size,
+        name=f"ingest-{knowledge_id}",
+    )
+    for result in pipeline.run(tasks):
+        db_file = result.item.db_file
+        if result.error is None:
             db_file.status = KnowledgeFileStatus.SUCCESS.value
-        except Exception as e:
-            logger.exception(
-                f"process_file_fail file_id={db_file.id} file_name={db_file.file_name}"
+        else:
+            logger.error(
+                f"process_file_fail file_id={db_file.id} file_name={db_file.file_name} stage={result.failed_stage}"
             )
             db_file.status = KnowledgeFileStatus.FAILED.value
-            db_file.remark = str(e)[:500]
-        finally:
-            logger.info(
-                f"process_file_end file_id={db_file.id} file_name={db_file.file_name}"
-            )
-            KnowledgeFileDao.update(db_file)
-            if callback:
-                inp = {
-                    "file_name": db_file.file_name,
-                    "file_status": db_file.status,
-                    "file_id": db_file.id,
-                    "error_msg": db_file.remark,
-                }
+            db_file.remark = str(result.error)[:500]
+        logger.info(
+            f"process_file_end file_id={db_file.id} file_name={db_file.file_name}"
+        )
+        KnowledgeFileDao.update(db_file)
+        if callback:
+            inp = {
+                "file_name": db_file.file_name,
+                "file_status": db_file.status,
+                "file_id": db_file.id,
+                "error_msg": db_file.remark,
+            }
+            try:
                 requests.post(url=callback, json=inp, timeout=3)
+            except Exception as e:
+                logger.error(f"file_callback_error file_id={db_file.id} error={e}")
 
 
 def add_file_embedding(
@@ -460,6 +525,49 @@ def add_file_embedding(
         force_ocr: int = 0,
         filter_page_header_footer: int = 0,
 ):
+    filepath, texts, metadatas = parse_file_chunks(
+        vector_client,
+        es_client,
+        minio_client,
+        db_file,
+        separator,
+        separator_rule,
+        chunk_size,
+        chunk_overlap,
+        extra_meta=extra_meta,
+        preview_cache_key=preview_cache_key,
+        knowledge_id=knowledge_id,
+        retain_images=retain_images,
+        enable_formula=enable_formula,
+        force_ocr=force_ocr,
+        filter_page_header_footer=filter_page_header_footer,
+    )
+
+    add_text_into_vector(vector_client, es_client, db_file, texts, metadatas)
+
+    logger.info(f"add_complete file={db_file.id} file_name={db_file.file_name}")
+
+    finish_file_embedding(minio_client, db_file, filepath, preview_cache_key)
+
+
+def parse_file_chunks(
+        vector_client,
+        es_client,
+        minio_client,
+        db_file: KnowledgeFile,
+        separator: List[str],
+        separator_rule: List[str],
+        chunk_size: int,
+        chunk_overlap: int,
+        extra_meta: str = None,
+        preview_cache_key: str = None,
+        knowledge_id: int = None,
+        retain_images: int = 1,
+        enable_formula: int = 1,
+        force_ocr: int = 0,
+        filter_page_header_footer: int = 0,
+) -> Tuple[str, List[str], List[dict]]:
+    """ 下载并解析文件，返回本地文件路径、待入库的chunk和对应的metadata """
     # download original file
     logger.info(
         f"start download original file={db_file.id} file_name={db_file.file_name}"
@@ -480,6 +588,7 @@ def add_file_embedding(
         if "excel_rule" in split_rule:
             excel_rule = ExcelRule(**split_rule["excel_rule"])
     # # extract text from file
+    failed_pages = []
     texts, metadatas, parse_type, partitions = read_chunk_text(
         filepath,
         db_file.file_name,
@@ -493,9 +602,15 @@ def add_file_embedding(
         force_ocr=force_ocr,
         filter_page_header_footer=filter_page_header_footer,
         excel_rule=excel_rule,
+        failed_pages=failed_pages,
     )
     if len(texts) == 0:
         raise ValueError("文件解析为空")
+    if failed_pages:
+        # 部分分片重试后仍解析失败，保留已解析的内容入库，失败的页码记录到文件备注中
+        pages = ", ".join(f"{start + 1}-{end}" for start, end in failed_pages)
+        logger.warning(f"parse_file_partial file={db_file.id} file_name={db_file.file_name} failed_pages={pages}")
+        db_file.remark = f"部分页面解析失败，已跳过：{pages}"[:500]
     # 缓存中有数据则用缓存中的数据去入库，因为是用户在界面编辑过的
     if preview_cache_key:
         all_chunk_info = KnowledgeUtils.get_preview_cache(preview_cache_key)
@@ -541,16 +656,11 @@ def add_file_embedding(
             }
         )
 
-    logger.info(f"add_vectordb file={db_file.id} file_name={db_file.file_name}")
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
-
-    logger.info(f"add_es file={db_file.id} file_name={db_file.file_name}")
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+    return filepath, texts, metadatas
 
-    logger.info(f"add_complete file={db_file.id} file_name={db_file.file_name}")
 
+def finish_file_embedding(minio_client, db_file: KnowledgeFile, filepath: str, preview_cache_key: str = None):
+    """ 文件入库成功后清理预览缓存，并把预览文件转存到正式bucket """
     if preview_cache_key:
         KnowledgeUtils.delete_preview_cache(preview_cache_key)
 
@@ -581,10 +691,26 @@ def add_text_into_vector(
         db_file: KnowledgeFile,
         texts: List[str],
         metadatas: List[dict],
+        vectors: Optional[List[List[float]]] = None,
+        embed_batch_size: Optional[int] = None,
 ):
     logger.info(f"add_vectordb file={db_file.id} file_name={db_file.file_name}")
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
+    # 存入milvus, 已经提前向量化的直接写入
+    if vectors is not None:
+        vector_client.add_texts(texts=texts, metadatas=metadatas, embeddings=vectors)
+    elif embed_batch_size:
+        # 分批向量化，每批向量化完成后立即写入
+        def log_progress(inserted: int, total: int):
+            logger.info(f"add_vectordb_progress file={db_file.id} inserted={inserted} total={total}")
+
+        vector_client.add_texts(
+            texts=texts,
+            metadatas=metadatas,
+            embed_batch_size=embed_batch_size,
+            progress_callback=log_progress,
+        )
+    else:
+        vector_client.add_texts(texts=texts, metadatas=metadatas)
 
     logger.info(f"add_es file={db_file.id} file_name={db_file.file_name}")
     # 存入es
@@ -657,6 +783,7 @@ def read_chunk_text(
         filter_page_header_footer: int = 0,
         excel_rule: ExcelRule = None,
         no_summary: bool = False,
+        failed_pages: Optional[List[Tuple[int, int]]] = None,
 
 ) -> (List[str], List[dict], str, Any):  # type: ignore
     """
@@ -664,6 +791,7 @@ def read_chunk_text(
     1：chunks metadata
     2：parse_type: etl4lm or un_etl4lm
     3: ocr bbox data: maybe None
+    failed_pages: 传入列表时etl4lm分片解析允许部分分片失败，失败的页码范围（左闭右开）追加到列表中
     """
     # 获取文档总结标题的llm
     llm = None
@@ -698,9 +826,8 @@ def read_chunk_text(
         if not excel_rule:
             excel_rule = ExcelRule()
 
-        # convert excel contents to markdown
-        md_files_path, local_image_dir, doc_id = convert_file_to_md(
-            file_name=file_name,
+        # convert excel contents to markdown chunks, skip following processes and return splited values.
+        texts, documents = table_file_to_raw_texts(
             input_file_name=input_file,
             header_rows=[
                 excel_rule.header_start_row - 1,  # convert to 0-based index
@@ -708,12 +835,8 @@ def read_chunk_text(
             ],
             data_rows=excel_rule.slice_length,
             append_header=excel_rule.append_header,
-            retain_images=bool(retain_images),
         )
 
-        # skip following processes and return splited values.
-        texts, documents = combine_multiple_md_files_to_raw_texts(path=md_files_path)
-
     elif file_extension_name in ["doc", "docx", "html", "mhtml", "ppt", "pptx"]:
 
         if file_extension_name == "doc":
@@ -775,8 +898,14 @@ def read_chunk_text(
                 timeout=etl4lm_settings.get("timeout", 60),
                 filter_page_header_footer=bool(filter_page_header_footer),
                 knowledge_id=knowledge_id,
+                shard_pages=etl4lm_settings.get("shard_pages", 50),
+                shard_workers=etl4lm_settings.get("shard_workers", 4),
+                max_retries=etl4lm_settings.get("max_retries", 2),
+                allow_partial=failed_pages is not None,
             )
             documents = loader.load()
+            if failed_pages is not None:
+                failed_pages.extend(loader.failed_pages)
             parse_type = ParseType.ETL4LM.value
             partitions = loader.partitions
             partitions = parse_partitions(partitions)
@@ -932,6 +1061,7 @@ def delete_vector(collection_name: str, partition_key: str):
                 pass
             else:
                 res = vectore_client.col.drop(timeout=1)
+                vector_store_registry.evict_milvus(collection_name)
                 logger.info('act=delete_milvus col={} res={}', collection_name, res)
     except Exception as e:
         # 处理集合不存在或其他错误的情况
@@ -946,6 +1076,7 @@ def delete_es(index_name: str):
 
         if esvectore_client:
             res = esvectore_client.client.indices.delete(index=index_name, ignore=[400, 404])
+            vector_store_registry.evict_es(index_name)
             logger.info(f'act=delete_es index={index_name} res={res}')
     except Exception as e:
         # 处理索引不存在或其他错误的情况
@@ -1138,7 +1269,8 @@ def delete_vector_data(knowledge: Knowledge, file_ids: List[int]):
     except Exception:
         # 重试一次
         logger.error("timeout_except")
-        vectore_client.close_connection(vectore_client.alias)
+        # 连接是共享的，不能关闭，只清理缓存的collection状态后重新初始化
+        vector_store_registry.evict_milvus(collection_name, broadcast=False)
         vectore_client = decide_vectorstores(collection_name, "Milvus", embeddings)
         pk = vectore_client.col.query(
             expr=f"file_id in {file_ids}", output_fields=["pk"], timeout=10
@@ -1147,7 +1279,6 @@ def delete_vector_data(knowledge: Knowledge, file_ids: List[int]):
     if pk:
         res = vectore_client.col.delete(f"pk in {[p['pk'] for p in pk]}", timeout=10)
         logger.info(f"act=delete_vector file_id={file_ids} res={res}")
-    vectore_client.close_connection(vectore_client.alias)
 
     # elastic
     index_name = knowledge.index_name or collection_name
@@ -24,6 +24,7 @@ from bisheng.database.models.llm_server import LLMDao, LLMModelType
 from bisheng.database.models.user import UserDao
 from bisheng.interface.embeddings.custom import FakeEmbedding
 from bisheng.interface.llms.custom import BishengLLM
+from bisheng.interface.vector_store.registry import vector_store_registry
 from bisheng.settings import settings
 from bisheng.utils import util
 from bisheng.utils.embedding import decide_embeddings
@@ -552,6 +553,7 @@ class SOPManageService:
                     vector_client.col.drop()
                     vector_client.col = None
                     vector_client.fields = []
+                    vector_store_registry.evict_milvus(SOPManageService.collection_name)
 
                 metadatas = [{"vector_store_id": sop.vector_store_id} for sop in sops]
                 contents = [sop.content for sop in sops]
@@ -28,7 +28,7 @@ from bisheng.database.models import LinsightSessionVersion
 from bisheng.database.models.flow import FlowType
 from bisheng.database.models.gpts_tools import GptsToolsDao
 from bisheng.database.models.knowledge import KnowledgeRead, KnowledgeTypeEnum
-from bisheng.database.models.linsight_execute_task import LinsightExecuteTaskDao
+from bisheng.database.models.linsight_execute_task import LinsightExecuteTaskDao, LinsightExecuteTaskStepDao
 from bisheng.database.models.linsight_session_version import LinsightSessionVersionDao, SessionVersionStatusEnum
 from bisheng.database.models.linsight_sop import LinsightSOPRecord
 from bisheng.database.models.session import MessageSessionDao, MessageSession
@@ -549,6 +549,9 @@ class LinsightWorkbenchImpl:
         if not execute_tasks:
             return []
 
+        # 执行中的任务的步骤记录还没有合并到history字段
+        await LinsightExecuteTaskStepDao.fill_history(execute_tasks)
+
         # 1. 获取一级任务 parent_task_id 是 None 的任务
         root_tasks = [task for task in execute_tasks if task.parent_task_id is None]
 
@@ -15,6 +15,7 @@ from bisheng.database.models.config import ConfigDao, ConfigKeyEnum, Config
 from bisheng.database.models.llm_server import LLMDao, LLMServer, LLMModel, LLMModelType
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm, instantiate_embedding
+from bisheng.interface.model_registry import model_client_registry
 from bisheng.utils.embedding import decide_embeddings
 
 
@@ -109,6 +110,7 @@ class LLMService:
     def delete_llm_server(cls, request: Request, login_user: UserPayload, server_id: int) -> bool:
         """ 删除一个服务提供方 """
         LLMDao.delete_server_by_id(server_id)
+        model_client_registry.invalidate()
         return True
 
     @classmethod
@@ -223,6 +225,8 @@ class LLMService:
         exist_server.config = server.config
 
         db_server = LLMDao.update_server_with_models(exist_server, list(model_dict.values()))
+        # 模型配置变化后，已缓存的模型客户端需要重新初始化
+        model_client_registry.invalidate()
         new_server_info = cls.get_one_llm(request, login_user, db_server.id)
 
         # 判断是否需要重新判断模型状态
@@ -242,6 +246,7 @@ class LLMService:
             raise NotFoundError.http_exception()
         exist_model.online = online
         LLMDao.update_model_online(exist_model.id, online)
+        model_client_registry.invalidate()
         return LLMModelInfo(**exist_model.dict())
 
     @classmethod
@@ -425,7 +430,7 @@ class LLMService:
             config_old_obj = WorkbenchModelConfig(**json.loads(config.value)) if config else WorkbenchModelConfig()
             if (config_obj.embedding_model.id and config_old_obj.embedding_model is None or
                     config_obj.embedding_model.id != config_old_obj.embedding_model.id):
-                embeddings = decide_embeddings(config_obj.embedding_model.id)
+                embeddings = decide_embeddings(config_obj.embedding_model.id, cache=False)
                 try:
                     await embeddings.aembed_query("test")
                 except Exception as e:
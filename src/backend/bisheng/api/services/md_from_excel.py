@@ -1,11 +1,13 @@
-import math
+import csv
 import os
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 from uuid import uuid4
+from xml.etree.ElementTree import iterparse
 
 import openpyxl
 import pandas as pd
 from loguru import logger
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
 
 
 def xls_to_xlsx(xls_path):
@@ -56,48 +58,108 @@ def remove_characters(s, chars_to_remove=["\n", "\r"]):
     return s.strip()
 
 
-def unmerge_and_read_sheet(sheet_obj):
+def _cell_has_value(elem) -> bool:
+    for child in elem:
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "v" and child.text:
+            return True
+        if tag == "is" and "".join(child.itertext()):
+            return True
+    return False
+
+
+def read_sheet_layout(sheet_obj) -> Tuple[List[Tuple[int, int, int, int]], int]:
+    """
+    获取工作表的合并单元格区域 (min_col, min_row, max_col, max_row) 和整个工作表的列数。
+    只读模式下工作表不解析合并单元格，直接流式扫描工作表的xml获取；
+    列数按有内容的单元格和合并区域计算，不使用格式导致的虚大的表格范围。
+    """
+    merged_cells = getattr(sheet_obj, "merged_cells", None)
+    if merged_cells is not None:
+        return [one.bounds for one in merged_cells.ranges], sheet_obj.max_column or 0
+
+    ranges = []
+    num_columns = 0
+    with sheet_obj._get_source() as src:
+        for _, elem in iterparse(src):
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if tag == "c":
+                ref = elem.get("r")
+                if ref and _cell_has_value(elem):
+                    num_columns = max(num_columns, column_index_from_string(ref.rstrip("0123456789")))
+            elif tag == "mergeCell":
+                bounds = range_boundaries(elem.get("ref"))
+                ranges.append(bounds)
+                num_columns = max(num_columns, bounds[2])
+            elif tag == "row":
+                # 已经扫描过的行及时释放
+                elem.clear()
+    return ranges, num_columns
+
+
+class MergedCellIndex:
     """
-    读取 openpyxl 工作表对象，通过将合并区域左上角的值填充到该区域的所有单元格中来取消合并单元格，
-    并以列表的列表形式返回数据。
+    按起始行索引合并单元格区域，逐行读取时用合并区域左上角的值填充区域内的单元格，
+    只保留覆盖当前行的区域，不需要把整个工作表读入内存。
     """
-    if sheet_obj.max_row == 0 or sheet_obj.max_column == 0:
-        return []
-    max_row = sheet_obj.max_row
-    max_column = sheet_obj.max_column
-    data_grid = [
-        [None for _ in range(max_column)] for _ in range(max_row)
-    ]
-
-    # 连续50行空行停止读取内容
-    empty_row_num = 0
-    max_empty_rows = 50
-    empty_row_end = 0
-    for r_idx, row in enumerate(sheet_obj.iter_rows()):
-        if empty_row_num > max_empty_rows:
-            break
-        row_empty = True
-        for c_idx, cell in enumerate(row):
-            data_grid[r_idx][c_idx] = cell.value
-            if cell.value:
-                row_empty = False
-        if row_empty:
-            empty_row_num += 1
-            empty_row_end = r_idx
-        else:
-            empty_row_num = 0
-            empty_row_end = 0
-
-    merged_cell_ranges = list(sheet_obj.merged_cells.ranges)
-    for merged_range in merged_cell_ranges:
-        min_col, min_row, max_col, max_row = merged_range.bounds
-        top_left_cell_value = sheet_obj.cell(row=min_row, column=min_col).value
-        for r in range(min_row, max_row + 1):
-            for c in range(min_col, max_col + 1):
-                data_grid[r - 1][c - 1] = top_left_cell_value
-    if empty_row_end and empty_row_end - max_empty_rows > 0:
-        data_grid = data_grid[:empty_row_end - max_empty_rows]
-    return data_grid
+
+    def __init__(self, ranges: List[Tuple[int, int, int, int]]):
+        # min_row: [(min_col, max_col, max_row)]
+        self._by_start_row: Dict[int, List[Tuple[int, int, int]]] = {}
+        for min_col, min_row, max_col, max_row in ranges:
+            self._by_start_row.setdefault(min_row, []).append((min_col, max_col, max_row))
+        # 覆盖当前行的区域 (min_col, max_col, max_row, 左上角的值)
+        self._active: List[Tuple[int, int, int, Any]] = []
+
+    def apply(self, row_idx: int, row: List) -> List:
+        """ row_idx 从1开始，返回填充后的行 """
+        if self._active:
+            self._active = [one for one in self._active if one[2] >= row_idx]
+        for min_col, max_col, max_row in self._by_start_row.pop(row_idx, []):
+            value = row[min_col - 1] if len(row) >= min_col else None
+            self._active.append((min_col, max_col, max_row, value))
+        if not self._active:
+            return row
+
+        width = max(one[1] for one in self._active)
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        for min_col, max_col, _, value in self._active:
+            row[min_col - 1:max_col] = [value] * (max_col - min_col + 1)
+        return row
+
+
+def is_empty_cell(value) -> bool:
+    return value is None or str(value).strip() == ""
+
+
+def iter_sheet_rows(sheet_obj, merged_ranges: List[Tuple[int, int, int, int]] = None,
+                    max_empty_rows: int = 50) -> Iterator[List]:
+    """
+    逐行读取只读模式的工作表，填充合并单元格并去掉行尾的空单元格。
+    连续超过 max_empty_rows 行空行时停止读取，末尾的空行不返回。
+    """
+    # 格式导致的虚大的表格范围不可信，按每行实际的单元格读取
+    if hasattr(sheet_obj, "reset_dimensions"):
+        sheet_obj.reset_dimensions()
+    if merged_ranges is None:
+        merged_ranges, _ = read_sheet_layout(sheet_obj)
+    merged_index = MergedCellIndex(merged_ranges)
+
+    empty_rows = []
+    for row_idx, values in enumerate(sheet_obj.iter_rows(values_only=True), start=1):
+        row = merged_index.apply(row_idx, list(values))
+        while row and is_empty_cell(row[-1]):
+            row.pop()
+        if not row:
+            empty_rows.append(row)
+            if len(empty_rows) > max_empty_rows:
+                return
+            continue
+        if empty_rows:
+            yield from empty_rows
+            empty_rows = []
+        yield row
 
 
 def generate_markdown_table_string(
@@ -153,253 +215,172 @@ def generate_markdown_table_string(
     return "\n".join(md_lines)
 
 
-def process_dataframe_to_markdown_files(
-        df,
-        sheet_index: str,
+def iter_markdown_tables(
+        rows: Iterable[List],
         num_header_rows,
         rows_per_markdown,
-        output_dir,
         append_header=True,
-):
+        num_columns: int = 0,
+) -> Iterator[str]:
     """
-    - append_header=True: 按 num_header_rows 分离表头和数据。
-    - append_header=False: 全部内容视为数据，表头为空，忽略 num_header_rows。
+    将按行读取的数据切分为多个Markdown表格，逐个返回，只缓存当前分片的数据行。
+    - append_header=True: 按 num_header_rows 分离表头和数据，每个分片都带上表头。
+    - append_header=False: 全部内容视为数据，用每个分片的第一行生成分隔符，忽略 num_header_rows。
+    num_columns 是整个工作表的列数，同一个工作表的所有分片使用相同的列数；为0时按分片内最长的行计算。
     """
-    if df.empty:
-        logger.warning(f"  源 '{sheet_index}' 的数据DataFrame为空，跳过Markdown生成。")
-        return
-
-    num_columns = df.shape[1]
-    rows = df.shape[0]
-
-    if rows == 0 or num_columns == 0:
-        return
-
-    header_block_df = pd.DataFrame()
     start_header_idx, end_header_idx = num_header_rows[0], num_header_rows[1]
-    if start_header_idx >= rows:
-        append_header = False
-
-    # --- 核心逻辑修改：根据 append_header 决定如何切分数据 ---
-    if append_header:
-        # 根据用户规则处理表头索引越界问题
-        if start_header_idx >= rows:
-            logger.warning(f"  表头起始行 {start_header_idx} 超出总行数 {rows}。将使用第一行作为表头。")
-            start_header_idx, end_header_idx = 0, 0
-        elif end_header_idx >= rows:
-            logger.warning(f"  表头结束行 {end_header_idx} 超出总行数 {rows}。将截断至最后一行。")
-            end_header_idx = rows - 1
-
-        # 确保索引合法
-        if start_header_idx < 0: start_header_idx = 0
-        if end_header_idx < start_header_idx: end_header_idx = start_header_idx
-
-        try:
-            header_slice = slice(start_header_idx, end_header_idx + 1)
-            header_block_df = df.iloc[header_slice]
-            data_block_df = df.drop(df.index[header_slice]).reset_index(drop=True)
-            header_rows_as_lists = header_block_df.values.tolist()
-        except Exception as e:
-            logger.error(
-                f"  在源 '{sheet_index}' 中根据表头索引 [{start_header_idx}, {end_header_idx}] 切分数据时出错: {e}。跳过。")
-            return
-    else:
-        # 当 append_header 为 False 时，所有内容都视为数据，表头列表为空
-        header_rows_as_lists = []
-        data_block_df = df.reset_index(drop=True)
-
-    # --- 后续分页逻辑 ---
-    if data_block_df.empty:
-        if append_header and not header_block_df.empty:
-            markdown_content = generate_markdown_table_string(
-                header_rows_as_lists, [], num_columns
-            )
-            # BUG FIX: Use zfill for proper padding. This is file '000' for the sheet.
-            file_name = f"{str(sheet_index).zfill(2)}000.md"
-            file_path = os.path.join(output_dir, file_name)
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(markdown_content)
-                logger.debug(f"  已保存仅含表头的文件：'{file_path}'")
-            except Exception as e:
-                logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
-        return
-
-    num_data_rows_total = len(data_block_df)
-    num_files_to_create = math.ceil(num_data_rows_total / rows_per_markdown) if rows_per_markdown > 0 else (
-        1 if num_data_rows_total > 0 else 0)
-
-    for i in range(num_files_to_create):
-        start_idx = i * rows_per_markdown
-        end_idx = min(start_idx + rows_per_markdown, num_data_rows_total)
-        current_data_chunk_as_lists = data_block_df.iloc[start_idx:end_idx].values.tolist()
-
-        final_header_for_chunk = header_rows_as_lists
-        final_data_for_chunk = current_data_chunk_as_lists
-
-        # 如果不附加真实表头，并且当前数据块不为空，则将数据的第一行用作“伪表头”以生成分隔符
-        if not append_header and current_data_chunk_as_lists:
-            final_header_for_chunk = [current_data_chunk_as_lists[0]]
-            final_data_for_chunk = current_data_chunk_as_lists[1:]
-
-        markdown_content = generate_markdown_table_string(
-            final_header_for_chunk, final_data_for_chunk, num_columns
+    if start_header_idx < 0:
+        start_header_idx = 0
+    if end_header_idx < start_header_idx:
+        end_header_idx = start_header_idx
+    rows_per_markdown = rows_per_markdown if rows_per_markdown > 0 else 0
+
+    def build_table(header_rows, data_rows) -> str:
+        if not append_header and data_rows:
+            header_rows, data_rows = [data_rows[0]], data_rows[1:]
+        width = max([num_columns] + [len(one) for one in header_rows + data_rows])
+        return generate_markdown_table_string(
+            [pad_row(one, width) for one in header_rows],
+            [pad_row(one, width) for one in data_rows],
+            width,
         )
 
-        # BUG FIX: Use zfill for proper 2-digit sheet and 3-digit file padding.
-        file_name = f"{str(sheet_index).zfill(2)}{str(i).zfill(3)}.md"
-        file_path = os.path.join(output_dir, file_name)
-
-        try:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(markdown_content)
-            logger.debug(
-                f"  已保存：'{file_path}' (含 {len(current_data_chunk_as_lists)} 行原始数据)"
-            )
-        except Exception as e:
-            logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
-
-
-def is_list_of_lists_empty(data_list):
-    """
-    判断一个二维列表是否为空或只包含空值 (None, '')。
-    """
-    if not data_list:
-        return True
-    # 使用 any() 和生成器表达式，高效判断
-    # any(row) 检查是否存在非空行
-    # any(cell is not None and cell != '' for cell in row) 检查行内是否有非空单元格
-    return not any(any(cell is not None and str(cell).strip() != '' for cell in row) for row in data_list)
-
-
-def excel_file_to_markdown(
-        excel_path, num_header_rows, rows_per_markdown, output_dir, append_header=True
-):
+    rows = iter(rows)
+    header_rows = []
+    data_rows = []
+    if append_header:
+        # 表头之前的行作为数据行
+        total = 0
+        for row in rows:
+            if total < start_header_idx:
+                data_rows.append(row)
+            else:
+                header_rows.append(row)
+            total += 1
+            if total > end_header_idx:
+                break
+        if total <= start_header_idx:
+            # 表头起始行超出总行数，全部内容视为数据
+            append_header = False
+            header_rows = []
+        elif total <= end_header_idx:
+            logger.warning(f"  表头结束行 {end_header_idx} 超出总行数 {total}。将截断至最后一行。")
+
+    has_data = False
+    # 表头之前的行读取表头后才能输出，超过分片大小的部分按分片输出
+    while rows_per_markdown and len(data_rows) >= rows_per_markdown:
+        yield build_table(header_rows, data_rows[:rows_per_markdown])
+        has_data = True
+        data_rows = data_rows[rows_per_markdown:]
+    for row in rows:
+        data_rows.append(row)
+        if rows_per_markdown and len(data_rows) >= rows_per_markdown:
+            yield build_table(header_rows, data_rows)
+            has_data = True
+            data_rows = []
+    if data_rows:
+        yield build_table(header_rows, data_rows)
+    elif not has_data and header_rows:
+        # 只有表头没有数据
+        yield build_table(header_rows, [])
+
+
+def pad_row(row: List, num_columns: int) -> List:
+    if len(row) >= num_columns:
+        return row
+    return list(row) + [None] * (num_columns - len(row))
+
+
+def iter_excel_markdown(
+        excel_path, num_header_rows, rows_per_markdown, append_header=True
+) -> Iterator[str]:
+    """ 以只读模式流式读取Excel文件的每个工作表，逐个返回Markdown表格 """
     logger.debug(f"\n开始处理Excel文件：'{excel_path}'")
     try:
-        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=False)
+        workbook = openpyxl.load_workbook(excel_path, data_only=True, read_only=True)
     except Exception as e:
         logger.debug(f"错误：无法加载Excel文件 '{excel_path}'。原因: {e}")
         return
 
-    sheet_index = 0
-    for sheet_name in workbook.sheetnames:
-        logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
-        sheet_obj = workbook[sheet_name]
-        unmerged_data_list_of_lists = unmerge_and_read_sheet(sheet_obj)
-        logger.debug(f"\n  <read all data>Excel<UNK>'{sheet_name}'...{len(unmerged_data_list_of_lists)}")
-
-        # 使用新的判断函数
-        if is_list_of_lists_empty(unmerged_data_list_of_lists):
-            logger.debug(f"  工作表 '{sheet_name}' 为空或无有效数据，跳过。")
-            continue
-
-        df = pd.DataFrame(unmerged_data_list_of_lists)
-        df.fillna("", inplace=True)
-        if df.empty:
-            logger.debug(f"  工作表 '{sheet_name}' 处理后为空DataFrame，跳过。")
-            continue
-
-        process_dataframe_to_markdown_files(
-            df,
-            str(sheet_index),
-            num_header_rows,
-            rows_per_markdown,
-            output_dir,
-            append_header=append_header,
-        )
-        sheet_index += 1
-
-    if workbook:
+    try:
+        for sheet_name in workbook.sheetnames:
+            logger.debug(f"\n  正在处理Excel工作表：'{sheet_name}'...")
+            sheet_obj = workbook[sheet_name]
+            merged_ranges, num_columns = read_sheet_layout(sheet_obj)
+            yield from iter_markdown_tables(
+                iter_sheet_rows(sheet_obj, merged_ranges),
+                num_header_rows,
+                rows_per_markdown,
+                append_header=append_header,
+                num_columns=num_columns,
+            )
+    finally:
         workbook.close()
     logger.debug(f"\nExcel文件 '{excel_path}' 处理完成。")
 
 
-def csv_file_to_markdown(
+def iter_csv_markdown(
         csv_path,
         num_header_rows,
         rows_per_markdown,
-        output_dir,
         csv_encoding="utf-8",
         csv_delimiter=",",
         append_header=True,
-):
+) -> Iterator[str]:
+    """ 逐行读取CSV文件，逐个返回Markdown表格 """
     logger.debug(f"\n开始处理CSV文件：'{csv_path}'")
     try:
-        df = pd.read_csv(
-            csv_path,
-            header=None,
-            dtype=str,
-            encoding=csv_encoding,
-            sep=csv_delimiter,
-            keep_default_na=False,
-        )
-        df.fillna("", inplace=True)
-
-    except pd.errors.EmptyDataError:
-        logger.debug(f"错误：CSV文件 '{csv_path}' 为空。")
-        return
+        with open(csv_path, "r", encoding=csv_encoding, newline="") as f:
+            # 先扫描一遍得到整个文件的列数，所有分片使用相同的列数
+            num_columns = max((len(row) for row in csv.reader(f, delimiter=csv_delimiter)), default=0)
+            f.seek(0)
+            # 跳过空行
+            rows = (row for row in csv.reader(f, delimiter=csv_delimiter) if row)
+            yield from iter_markdown_tables(rows, num_header_rows, rows_per_markdown, append_header,
+                                            num_columns=num_columns)
     except FileNotFoundError:
         logger.debug(f"错误：CSV文件 '{csv_path}' 未找到。")
         return
     except Exception as e:
         logger.debug(f"错误：无法读取CSV文件 '{csv_path}'。原因: {e}")
         return
-
-    if df.empty:
-        logger.debug(f"CSV文件 '{csv_path}' 为空或处理后为空，跳过。")
-        return
-
-    process_dataframe_to_markdown_files(
-        df,
-        "0",
-        num_header_rows,
-        rows_per_markdown,
-        output_dir,
-        append_header,
-    )
     logger.debug(f"\nCSV文件 '{csv_path}' 处理完成。")
 
 
-def convert_file_to_markdown(
+def iter_file_markdown(
         input_file_path,
         num_header_rows,
         rows_per_markdown,
-        base_output_dir="output_markdown_files",
         csv_encoding="utf-8",
         csv_delimiter=",",
         append_header=True,
-):
+) -> Iterator[str]:
     """
-    将 Excel 或 CSV 文件转换为多个 Markdown 文件。
+    将 Excel 或 CSV 文件流式转换为多个 Markdown 表格，不产生中间文件。
     """
     if not os.path.exists(input_file_path):
         logger.debug(f"错误：输入文件 '{input_file_path}' 未找到。")
         return
 
-    if not os.path.exists(base_output_dir):
-        os.makedirs(base_output_dir)
-        logger.debug(f"创建输出目录：'{base_output_dir}'")
-
     _, file_extension = os.path.splitext(input_file_path)
     file_extension = file_extension.lower()
     if file_extension == ".xls":
         input_file_path = xls_to_xlsx(input_file_path)
+        if not input_file_path:
+            return
 
     if file_extension in [".xlsx", ".xls"]:
-        excel_file_to_markdown(
+        yield from iter_excel_markdown(
             input_file_path,
             num_header_rows,
             rows_per_markdown,
-            base_output_dir,
             append_header,
         )
     elif file_extension == ".csv":
-        csv_file_to_markdown(
+        yield from iter_csv_markdown(
             input_file_path,
             num_header_rows,
             rows_per_markdown,
-            base_output_dir,
             csv_encoding,
             csv_delimiter,
             append_header,
@@ -410,6 +391,39 @@ def convert_file_to_markdown(
         )
 
 
+def convert_file_to_markdown(
+        input_file_path,
+        num_header_rows,
+        rows_per_markdown,
+        base_output_dir="output_markdown_files",
+        csv_encoding="utf-8",
+        csv_delimiter=",",
+        append_header=True,
+):
+    """
+    将 Excel 或 CSV 文件转换为多个 Markdown 文件。
+    """
+    if not os.path.exists(base_output_dir):
+        os.makedirs(base_output_dir)
+        logger.debug(f"创建输出目录：'{base_output_dir}'")
+
+    tables = iter_file_markdown(
+        input_file_path,
+        num_header_rows,
+        rows_per_markdown,
+        csv_encoding,
+        csv_delimiter,
+        append_header,
+    )
+    for index, markdown_content in enumerate(tables):
+        file_path = os.path.join(base_output_dir, f"{str(index).zfill(8)}.md")
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(markdown_content)
+        except Exception as e:
+            logger.debug(f"  保存文件 '{file_path}' 时出错: {e}")
+
+
 def handler(
         cache_dir,
         file_name: str,
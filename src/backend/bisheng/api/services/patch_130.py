@@ -4,6 +4,7 @@ from langchain_core.documents import Document
 
 from bisheng.api.services.md_from_docx import handler as docx_handler
 from bisheng.api.services.md_from_excel import handler as excel_handler
+from bisheng.api.services.md_from_excel import iter_file_markdown
 from bisheng.api.services.md_from_html import handler as html_handler
 from bisheng.api.services.md_from_pdf import handler as pdf_handler
 from bisheng.api.services.md_from_pptx import handler as pptx_handler
@@ -39,6 +40,31 @@ def combine_multiple_md_files_to_raw_texts(
     return raw_texts, documents
 
 
+def table_file_to_raw_texts(
+        input_file_name,
+        header_rows=[0, 1],
+        data_rows=10,
+        append_header=True,
+) -> tuple[list[Document], list[Document]]:
+    """
+    stream excel/csv rows into markdown table chunks without temp md files.
+    Returns:
+        0: split raw texts, each text is a Document object.
+        1: a single Document object containing all the texts combined.
+    """
+    raw_texts = [
+        Document(page_content=content, metadata={})
+        for content in iter_file_markdown(
+            input_file_name,
+            num_header_rows=header_rows,
+            rows_per_markdown=data_rows,
+            append_header=append_header,
+        )
+    ]
+    documents = [Document(page_content="".join(one.page_content for one in raw_texts), metadata={})]
+    return raw_texts, documents
+
+
 def convert_file_to_md(
         file_name,
         input_file_name,
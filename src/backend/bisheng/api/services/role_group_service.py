@@ -8,6 +8,7 @@ from fastapi import Request, HTTPException
 from bisheng.cache.redis import redis_client
 from bisheng.api.services.assistant import AssistantService
 from bisheng.api.services.audit_log import AuditLogService
+from bisheng.api.services.user_principal import user_principal_cache
 from bisheng.api.services.user_service import UserPayload
 from bisheng.api.errcode.user import UserGroupNotDeleteError
 from bisheng.api.utils import get_request_ip
@@ -125,10 +126,15 @@ class RoleGroupService():
         if need_move_resource:
             GroupResourceDao.update_group_resource(need_move_resource)
         GroupResourceDao.delete_group_resource_by_group_id(group_info.id)
+        # 受影响的用户：组下角色的用户和组管理员
+        group_role_ids = [one.id for one in RoleDao.get_role_by_groups([group_info.id], '', 0, 0)]
+        affected_user_ids = [one.user_id for one in UserRoleDao.get_roles_user(group_role_ids)]
+        affected_user_ids.extend([one.user_id for one in UserGroupDao.get_groups_admins([group_info.id])])
         # 删除用户组下的角色列表
         RoleDao.delete_role_by_group_id(group_info.id)
         # 删除用户组的管理员
         UserGroupDao.delete_group_all_admin(group_info.id)
+        user_principal_cache.invalidate_users(affected_user_ids)
         # 将删除事件发到redis队列中
         delete_message = json.dumps({"id": group_info.id})
         redis_client.rpush('delete_group', delete_message, expiration=86400)
@@ -152,7 +158,9 @@ class RoleGroupService():
         if user_groups and user_group.group_id in [ug.group_id for ug in user_groups]:
             raise ValueError('重复设置用户组')
 
-        return UserGroupDao.insert_user_group(user_group)
+        res = UserGroupDao.insert_user_group(user_group)
+        user_principal_cache.invalidate_users([user_group.user_id])
+        return res
 
     def replace_user_groups(self, request: Request, login_user: UserPayload, user_id: int, group_ids: List[int]):
         """ 覆盖用户的所在的用户组 """
@@ -186,6 +194,7 @@ class RoleGroupService():
             UserGroupDao.delete_user_groups(user_id, need_delete_group)
         if need_add_group:
             UserGroupDao.add_user_groups(user_id, need_add_group)
+        user_principal_cache.invalidate_users([user_id])
 
         # 记录审计日志
         group_infos = GroupDao.get_group_by_ids(old_group + group_ids)
@@ -231,6 +240,7 @@ class RoleGroupService():
                 res.append(UserGroupDao.insert_user_group_admin(user_id, group_id))
         if need_delete_admin:
             UserGroupDao.delete_group_admins(group_id, need_delete_admin)
+        user_principal_cache.invalidate_users(need_add_admin + need_delete_admin)
         # 修改用户组的最近修改人
         GroupDao.update_group_update_user(group_id, login_user.user_id)
 
@@ -0,0 +1,111 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from bisheng.cache.redis import redis_client
+from bisheng.database.models.role_access import AccessType, RoleAccess, RoleAccessDao
+from bisheng.database.models.user_group import UserGroup, UserGroupDao
+from bisheng.database.models.user_role import UserRole, UserRoleDao
+
+# 用户鉴权信息的缓存key和过期时间（秒），角色、用户组管理员、角色权限变更时会主动删除
+USER_PRINCIPAL_KEY = 'user:principal:{}'
+USER_PRINCIPAL_EXPIRE_TIME = 600
+
+
+class UserPrincipal(BaseModel):
+    """ 用户鉴权需要的信息，每个请求都会用到，所以整体缓存起来 """
+    user_id: Optional[int] = None
+    # 用户的角色列表
+    role_ids: List[int] = Field(default_factory=list)
+    # 用户是管理员的用户组
+    admin_group_ids: Set[int] = Field(default_factory=set)
+    # 角色拥有的资源权限 third_id: 权限位图，第 AccessType.value 位为1表示拥有此类型的权限
+    access_bitmap: Dict[str, int] = Field(default_factory=dict)
+
+    @classmethod
+    def build(cls, user_id: int, user_roles: List[UserRole], admin_groups: List[UserGroup],
+              role_access: List[RoleAccess]) -> 'UserPrincipal':
+        access_bitmap = {}
+        for one in role_access:
+            access_bitmap[one.third_id] = access_bitmap.get(one.third_id, 0) | (1 << one.type)
+        return cls(user_id=user_id,
+                   role_ids=[one.role_id for one in user_roles],
+                   admin_group_ids={one.group_id for one in admin_groups},
+                   access_bitmap=access_bitmap)
+
+    def has_access(self, third_id: str, access_type: AccessType) -> bool:
+        """ 用户的角色是否拥有资源的某个权限 """
+        return bool(self.access_bitmap.get(str(third_id), 0) >> access_type.value & 1)
+
+    def is_group_admin(self, group_id: int) -> bool:
+        return group_id in self.admin_group_ids
+
+
+class UserPrincipalCache:
+    """
+    用户鉴权信息缓存，存储在redis中，多个进程共享
+    角色、用户组管理员、角色权限变更后需要调用 invalidate_* 删除受影响用户的缓存
+    """
+
+    def __init__(self, expiration: int = USER_PRINCIPAL_EXPIRE_TIME):
+        self.expiration = expiration
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return USER_PRINCIPAL_KEY.format(user_id)
+
+    @staticmethod
+    def _load(user_id: int) -> UserPrincipal:
+        user_roles = UserRoleDao.get_user_roles(user_id)
+        admin_groups = UserGroupDao.get_user_admin_group(user_id)
+        role_ids = [one.role_id for one in user_roles]
+        role_access = RoleAccessDao.get_role_access(role_ids, None) if role_ids else []
+        return UserPrincipal.build(user_id, user_roles, admin_groups, role_access)
+
+    @staticmethod
+    async def _aload(user_id: int) -> UserPrincipal:
+        user_roles = await UserRoleDao.aget_user_roles(user_id)
+        admin_groups = await UserGroupDao.aget_user_admin_group(user_id)
+        role_ids = [one.role_id for one in user_roles]
+        role_access = await RoleAccessDao.aget_role_access(role_ids, None) if role_ids else []
+        return UserPrincipal.build(user_id, user_roles, admin_groups, role_access)
+
+    def get(self, user_id: int) -> UserPrincipal:
+        if user_id is None:
+            return UserPrincipal()
+        value = redis_client.get(self._key(user_id))
+        if value:
+            return UserPrincipal(**value)
+        principal = self._load(user_id)
+        redis_client.set(self._key(user_id), principal.model_dump(), expiration=self.expiration)
+        return principal
+
+    async def aget(self, user_id: int) -> UserPrincipal:
+        """ 异步获取，缓存未命中时使用异步session查询数据库，不会阻塞事件循环 """
+        if user_id is None:
+            return UserPrincipal()
+        value = await redis_client.aget(self._key(user_id))
+        if value:
+            return UserPrincipal(**value)
+        principal = await self._aload(user_id)
+        await redis_client.aset(self._key(user_id), principal.model_dump(), expiration=self.expiration)
+        return principal
+
+    def invalidate_users(self, user_ids: Iterable[int]):
+        for user_id in set(user_ids):
+            redis_client.delete(self._key(user_id))
+        logger.debug(f'invalidate user principal: {user_ids}')
+
+    def invalidate_roles(self, role_ids: List[int]):
+        """ 角色的权限变更，删除角色下所有用户的缓存 """
+        if not role_ids:
+            return
+        self.invalidate_users([one.user_id for one in UserRoleDao.get_roles_user(role_ids)])
+
+    def invalidate_group_admins(self, group_id: int):
+        """ 用户组的管理员变更，删除当前管理员的缓存 """
+        self.invalidate_users([one.user_id for one in UserGroupDao.get_groups_admins([group_id])])
+
+
+user_principal_cache = UserPrincipalCache()
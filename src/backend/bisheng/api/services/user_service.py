@@ -1,13 +1,14 @@
 import functools
 import json
 from base64 import b64decode
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import rsa
 from bisheng.api.errcode.base import UnAuthorizedError
 from bisheng.api.errcode.user import (UserLoginOfflineError, UserNameAlreadyExistError,
                                       UserNeedGroupAndRoleError)
 from bisheng.api.JWT import ACCESS_TOKEN_EXPIRE_TIME
+from bisheng.api.services.user_principal import UserPrincipal, user_principal_cache
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import CreateUserReq
 from bisheng.cache.redis import redis_client
@@ -32,11 +33,25 @@ class UserPayload:
         self.user_id = kwargs.get('user_id')
         self.user_role = kwargs.get('role')
         self.group_cache = {}
+        # 鉴权信息，包含角色列表、管理的用户组和资源权限，从缓存中获取
+        self._principal: Optional[UserPrincipal] = kwargs.get('principal')
         if self.user_role != 'admin':  # 非管理员用户，需要获取他的角色列表
-            roles = UserRoleDao.get_user_roles(self.user_id)
-            self.user_role = [one.role_id for one in roles]
+            self.user_role = list(self.principal.role_ids)
         self.user_name = kwargs.get('user_name')
 
+    @classmethod
+    async def ainit(cls, **kwargs) -> 'UserPayload':
+        """ 异步初始化，鉴权信息缓存未命中时异步查询数据库 """
+        if kwargs.get('role') != 'admin' and kwargs.get('principal') is None:
+            kwargs['principal'] = await user_principal_cache.aget(kwargs.get('user_id'))
+        return cls(**kwargs)
+
+    @property
+    def principal(self) -> UserPrincipal:
+        if self._principal is None:
+            self._principal = user_principal_cache.get(self.user_id)
+        return self._principal
+
     def is_admin(self):
         if self.user_role == 'admin':
             return True
@@ -70,7 +85,7 @@ class UserPayload:
         if self.user_id == owner_user_id:
             return True
         # 判断授权
-        if RoleAccessDao.judge_role_access(self.user_role, target_id, access_type):
+        if self.principal.has_access(target_id, access_type):
             return True
         return False
 
@@ -90,24 +105,14 @@ class UserPayload:
             检查用户是否是某个组的管理员
         """
         # 判断是否是用户组的管理员
-        user_group = UserGroupDao.get_user_admin_group(self.user_id)
-        if not user_group:
-            return False
-        for one in user_group:
-            if one.group_id == group_id:
-                return True
-        return False
+        return self.principal.is_group_admin(group_id)
 
     @wrapper_access_check
     def check_groups_admin(self, group_ids: List[int]) -> bool:
         """
         检查用户是否是用户组列表中的管理员，有一个就是true
         """
-        user_groups = UserGroupDao.get_user_admin_group(self.user_id)
-        for one in user_groups:
-            if one.is_group_admin and one.group_id in group_ids:
-                return True
-        return False
+        return any(self.principal.is_group_admin(one) for one in group_ids)
 
     def get_user_groups(self, user_id: int) -> List[Dict]:
         """ 查询用户的角色列表 """
@@ -293,12 +298,12 @@ async def get_login_user(authorize: AuthJWT = Depends()) -> UserPayload:
     authorize.jwt_required()
 
     current_user = json.loads(authorize.get_jwt_subject())
-    user = UserPayload(**current_user)
+    user = await UserPayload.ainit(**current_user)
 
     # 判断是否允许多点登录
     if not settings.get_system_login_method().allow_multi_login:
         # 获取access_token
-        current_token = redis_client.get(USER_CURRENT_SESSION.format(user.user_id))
+        current_token = await redis_client.aget(USER_CURRENT_SESSION.format(user.user_id))
         # 登录被挤下线了，http状态码是200, status_code是特殊code
         if current_token != authorize._token:
             raise UserLoginOfflineError.http_exception()
@@ -170,7 +170,7 @@ async def chat(*,
             Authorize.jwt_required(auth_from='websocket', websocket=websocket)
         payload = Authorize.get_jwt_subject()
         payload = json.loads(payload)
-        login_user = UserPayload(**payload)
+        login_user = await UserPayload.ainit(**payload)
         request = websocket
         await chat_manager.dispatch_client(request, assistant_id, chat_id, login_user,
                                            WorkType.GPTS, websocket)
@@ -217,7 +217,7 @@ async def compare_flow_node(*, item: FlowCompareReq, Authorize: AuthJWT = Depend
     """ 技能多版本对比 """
     Authorize.jwt_required()
     payload = json.loads(Authorize.get_jwt_subject())
-    user = UserPayload(**payload)
+    user = await UserPayload.ainit(**payload)
     return await FlowService.compare_flow_node(user, item)
 
 
@@ -228,7 +228,7 @@ async def compare_flow_node_stream(*,
     """ 技能多版本对比 """
     Authorize.jwt_required()
     payload = json.loads(Authorize.get_jwt_subject())
-    user = UserPayload(**payload)
+    user = await UserPayload.ainit(**payload)
     item = FlowCompareReq(**json.loads(data))
 
     async def event_stream(req: FlowCompareReq):
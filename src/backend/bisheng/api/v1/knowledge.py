@@ -276,14 +276,16 @@ async def get_knowledge_chunk(request: Request,
                               file_ids: List[int] = Query(default=[], description='文件ID'),
                               keyword: str = Query(default='', description='关键字'),
                               page: int = Query(default=1, description='页数'),
-                              limit: int = Query(default=10, description='每页条数条数')):
+                              limit: int = Query(default=10, description='每页条数条数'),
+                              cursor: Optional[str] = Query(default=None,
+                                                            description='下一页的游标，传了则忽略page参数')):
     """ 获取知识库分块内容 """
     # 为了解决keyword参数有时候没有进行urldecode的bug
     if keyword.startswith('%'):
         keyword = urllib.parse.unquote(keyword)
-    res, total = KnowledgeService.get_knowledge_chunks(request, login_user, knowledge_id, file_ids,
-                                                       keyword, page, limit)
-    return resp_200(data={'data': res, 'total': total})
+    res, total, next_cursor = KnowledgeService.get_knowledge_chunks(request, login_user, knowledge_id, file_ids,
+                                                                    keyword, page, limit, cursor)
+    return resp_200(data={'data': res, 'total': total, 'next_cursor': next_cursor})
 
 
 @router.put('/chunk', status_code=200)
@@ -531,7 +531,7 @@ async def task_message_stream(
         Authorize.jwt_required(auth_from='websocket', websocket=websocket)
         payload = Authorize.get_jwt_subject()
         payload = json.loads(payload)
-        login_user = UserPayload(**payload)
+        login_user = await UserPayload.ainit(**payload)
 
         message_handler = MessageStreamHandle(websocket=websocket, session_version_id=session_version_id)
 
@@ -23,6 +23,7 @@ from bisheng.api.JWT import ACCESS_TOKEN_EXPIRE_TIME
 from bisheng.api.utils import get_request_ip
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.captcha import verify_captcha
+from bisheng.api.services.user_principal import user_principal_cache
 from bisheng.api.services.user_service import (UserPayload, gen_user_jwt, gen_user_role, get_login_user,
                                                get_assistant_list_by_access, get_admin_user, UserService)
 from bisheng.api.v1.schemas import UnifiedResponseModel, resp_200, CreateUserReq
@@ -497,7 +498,9 @@ async def delete_role(*,
 
     # 删除role相关的数据
     try:
+        role_user_ids = [one.user_id for one in UserRoleDao.get_roles_user([role_id])]
         RoleDao.delete_role(role_id)
+        user_principal_cache.invalidate_users(role_user_ids)
     except Exception as e:
         logger.exception(e)
         raise HTTPException(status_code=500, detail='删除角色失败')
@@ -555,6 +558,7 @@ async def user_addrole(*,
     if need_delete_role:
         # 删除对应的角色列表
         UserRoleDao.delete_user_roles(user_role.user_id, need_delete_role)
+    user_principal_cache.invalidate_users([user_role.user_id])
     update_user_role_hook(request, login_user, user_role.user_id, old_roles, user_role.role_id)
     return resp_200()
 
@@ -630,6 +634,7 @@ async def access_refresh(*, request: Request, data: RoleRefresh, login_user: Use
             role_access = RoleAccess(role_id=role_id, third_id=str(third_id), type=access_type)
             session.add(role_access)
         session.commit()
+    user_principal_cache.invalidate_roles([role_id])
     update_role_hook(request, login_user, db_role)
     return resp_200()
 
@@ -30,7 +30,7 @@ async def get_all_group(Authorize: AuthJWT = Depends()):
     """
     Authorize.jwt_required()
     payload = json.loads(Authorize.get_jwt_subject())
-    login_user = UserPayload(**payload)
+    login_user = await UserPayload.ainit(**payload)
     if login_user.is_admin():
         groups = []
     else:
@@ -55,7 +55,7 @@ async def create_group(request: Request, group: GroupCreate, Authorize: AuthJWT
     """
     await check_permissions(Authorize, ['admin'])
     payload = json.loads(Authorize.get_jwt_subject())
-    login_user = UserPayload(**payload)
+    login_user = await UserPayload.ainit(**payload)
     return resp_200(RoleGroupService().create_group(request, login_user, group))
 
 
@@ -142,7 +142,7 @@ async def set_update_user(group_id: Annotated[int, Body(embed=True)],
     """
     # await check_permissions(Authorize, ['admin'])
     payload = json.loads(Authorize.get_jwt_subject())
-    login_user = UserPayload(**payload)
+    login_user = await UserPayload.ainit(**payload)
     return resp_200(RoleGroupService().set_group_update_user(login_user, group_id))
 
 
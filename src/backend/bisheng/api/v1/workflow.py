@@ -113,7 +113,7 @@ async def workflow_ws(*,
         Authorize.jwt_required(auth_from='websocket', websocket=websocket)
         payload = Authorize.get_jwt_subject()
         payload = json.loads(payload)
-        login_user = UserPayload(**payload)
+        login_user = await UserPayload.ainit(**payload)
         await chat_manager.dispatch_client(websocket, workflow_id, chat_id, login_user, WorkType.WORKFLOW, websocket)
     except WebSocketException as exc:
         logger.error(f'Websocket exception: {str(exc)}')
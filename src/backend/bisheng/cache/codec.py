@@ -0,0 +1,110 @@
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict
+
+import orjson
+
+# 编码后的格式: MAGIC(2字节) | 格式版本(1字节) | 序列化方式(1字节) | 标记位(1字节) | 数据
+# 旧版本直接pickle的值以0x80开头，和MAGIC区分开，可以直接读取
+CODEC_MAGIC = b'\xb5\xe1'
+CODEC_VERSION = 1
+CODEC_HEADER_SIZE = 5
+# 标记位：数据经过zlib压缩
+FLAG_ZLIB = 0x01
+
+
+class Serializer(ABC):
+    """ 序列化方式，id写入编码头，修改已有的id会导致无法读取redis中已有的数据 """
+    id: int = 0
+    name: str = ''
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def loads(self, data) -> Any:
+        raise NotImplementedError
+
+
+class PickleSerializer(Serializer):
+    """ 默认的序列化方式，支持任意python对象 """
+    id = 1
+    name = 'pickle'
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data) -> Any:
+        return pickle.loads(data)
+
+
+class JsonSerializer(Serializer):
+    """ orjson序列化，其他语言也可以读取；tuple会变成list，不支持的类型自动使用pickle """
+    id = 2
+    name = 'json'
+
+    def dumps(self, value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+    def loads(self, data) -> Any:
+        return orjson.loads(data)
+
+
+SERIALIZERS: Dict[int, Serializer] = {one.id: one for one in (PickleSerializer(), JsonSerializer())}
+SERIALIZER_NAMES: Dict[str, Serializer] = {one.name: one for one in SERIALIZERS.values()}
+
+
+class RedisCodec:
+    """
+    redis中缓存值的编解码
+    编码后的数据带有版本头，记录序列化方式和是否压缩，超过压缩阈值的数据使用zlib压缩，
+    读取时根据版本头解码，不受当前配置影响；没有版本头的数据按旧版本的pickle格式读取
+    enabled为False时按旧版本的pickle格式写入，滚动升级期间旧版本的进程也能读取
+    """
+
+    def __init__(self, enabled: bool = True, serializer: str = 'pickle', compress_threshold: int = 16384,
+                 compress_level: int = 1):
+        if serializer not in SERIALIZER_NAMES:
+            raise ValueError(f'unknown redis serializer: {serializer}')
+        self.enabled = enabled
+        self.serializer = SERIALIZER_NAMES[serializer]
+        self.fallback = SERIALIZER_NAMES['pickle']
+        # 小于等于0时不压缩
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, value: Any) -> bytes:
+        if not self.enabled:
+            return pickle.dumps(value)
+        serializer = self.serializer
+        try:
+            data = serializer.dumps(value)
+        except TypeError:
+            if serializer is self.fallback:
+                raise
+            serializer = self.fallback
+            data = serializer.dumps(value)
+
+        flags = 0
+        if 0 < self.compress_threshold <= len(data):
+            compressed = zlib.compress(data, self.compress_level)
+            # 压缩率太低时不压缩，节省读取时解压的开销
+            if len(compressed) < len(data) * 0.9:
+                data = compressed
+                flags |= FLAG_ZLIB
+        return CODEC_MAGIC + bytes((CODEC_VERSION, serializer.id, flags)) + data
+
+    @staticmethod
+    def decode(data: bytes) -> Any:
+        if data[:2] != CODEC_MAGIC:
+            # 旧版本直接pickle的值
+            return pickle.loads(data)
+        version, serializer_id, flags = data[2], data[3], data[4]
+        if version != CODEC_VERSION:
+            raise ValueError(f'unsupported redis codec version: {version}')
+        payload = memoryview(data)[CODEC_HEADER_SIZE:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return SERIALIZERS[serializer_id].loads(payload)
@@ -1,10 +1,10 @@
-import pickle
 import typing
 from typing import Dict, Optional, Any, Coroutine
 
 import redis
 from redis.asyncio.client import Pipeline
 
+from bisheng.cache.codec import RedisCodec
 from bisheng.settings import settings
 from loguru import logger
 from redis import ConnectionPool, RedisCluster
@@ -20,6 +20,8 @@ from redis.asyncio import Redis as AsyncRedis
 class RedisClient:
 
     def __init__(self, url, max_connections=100):
+        self.codec = RedisCodec(**settings.redis_codec.model_dump())
+        self._is_cluster = False
         # # 哨兵模式
         if isinstance(settings.redis_url, Dict):
             redis_conf = dict(settings.redis_url)
@@ -39,6 +41,8 @@ class RedisClient:
                                                         cluster_error_retry_attempts=1)
                 self.async_connection: typing.Union[AsyncRedisCluster, AsyncRedis] = AsyncRedisCluster.from_url(
                     cluster_url, **redis_conf, retry=Retry(ExponentialBackoff(), 6), cluster_error_retry_attempts=1)
+                self.async_block_connection = self.async_connection
+                self._is_cluster = True
                 return
             hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
             password = redis_conf.pop('sentinel_password')
@@ -48,6 +52,8 @@ class RedisClient:
             # 获取主节点的连接
             self.connection = sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
             self.async_connection: AsyncRedis = async_sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
+            # 阻塞命令（xread block等）使用的连接，不能设置过短的socket超时
+            self.async_block_connection: AsyncRedis = async_sentinel.master_for(master, **redis_conf)
 
         else:
             # 单机模式
@@ -55,84 +61,71 @@ class RedisClient:
             self.async_pool = redis.asyncio.ConnectionPool.from_url(url, max_connections=max_connections)
             self.connection = redis.StrictRedis(connection_pool=self.pool)
             self.async_connection: AsyncRedis = redis.asyncio.Redis.from_pool(self.async_pool)
+            self.async_block_connection: AsyncRedis = self.async_connection
 
     def set(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                self.cluster_nodes(key)
-                if expiration:
-                    result = self.connection.setex(key, expiration, pickled)
-                else:
-                    result = self.connection.set(key, pickled)
-                if not result:
-                    raise ValueError('RedisCache could not set the value.')
+            encoded = self.codec.encode(value)
+            self.cluster_nodes(key)
+            if expiration:
+                result = self.connection.setex(key, expiration, encoded)
             else:
-                logger.error('pickle error, value={}', value)
+                result = self.connection.set(key, encoded)
+            if not result:
+                raise ValueError('RedisCache could not set the value.')
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def aset(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                # await self.acluster_nodes(key)
-                if expiration:
-                    result = await self.async_connection.setex(name=key, value=pickled, time=expiration)
-                else:
-                    result = await self.async_connection.set(key, pickled)
-                if not result:
-                    raise ValueError('RedisCache could not set the value.')
+            encoded = self.codec.encode(value)
+            if expiration:
+                result = await self.async_connection.setex(name=key, value=encoded, time=expiration)
             else:
-                logger.error('pickle error, value={}', value)
+                result = await self.async_connection.set(key, encoded)
+            if not result:
+                raise ValueError('RedisCache could not set the value.')
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     def setNx(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                self.cluster_nodes(key)
-                result = self.connection.setnx(key, pickled)
-                self.connection.expire(key, expiration)
-                if not result:
-                    return False
-            return True
+            encoded = self.codec.encode(value)
+            self.cluster_nodes(key)
+            # SET NX EX 一条命令完成，key已存在时不会刷新过期时间
+            result = self.connection.set(key, encoded, nx=True, ex=expiration or None)
+            return bool(result)
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def asetNx(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                await self.acluster_nodes(key)
-                result = await self.async_connection.setnx(key, pickled)
-                await self.async_connection.expire(key, expiration)
-                if not result:
-                    return False
-            return True
+            encoded = self.codec.encode(value)
+            await self.acluster_nodes(key)
+            result = await self.async_connection.set(key, encoded, nx=True, ex=expiration or None)
+            return bool(result)
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     def setex(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                self.cluster_nodes(key)
-                result = self.connection.setex(key, expiration, pickled)
-                if not result:
-                    raise ValueError('RedisCache could not set the value.')
-            else:
-                logger.error('pickle error, value={}', value)
+            encoded = self.codec.encode(value)
+            self.cluster_nodes(key)
+            result = self.connection.setex(key, expiration, encoded)
+            if not result:
+                raise ValueError('RedisCache could not set the value.')
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def asetex(self, key, value, expiration=3600):
         try:
-            if pickled := pickle.dumps(value):
-                await self.acluster_nodes(key)
-                result = await self.async_connection.setex(key, expiration, pickled)
-                if not result:
-                    raise ValueError('RedisCache could not set the value.')
-            else:
-                logger.error('pickle error, value={}', value)
+            encoded = self.codec.encode(value)
+            await self.acluster_nodes(key)
+            result = await self.async_connection.setex(key, expiration, encoded)
+            if not result:
+                raise ValueError('RedisCache could not set the value.')
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     def mset(self, mapping: Dict[str, typing.Any], expiration: int = None) -> bool | None:
         """批量设置"""
@@ -140,19 +133,17 @@ class RedisClient:
             if not mapping:
                 return True
 
-            serialized_mapping = {k: pickle.dumps(v) for k, v in mapping.items() if v is not None}
-            result = self.connection.mset(serialized_mapping)
+            serialized_mapping = {k: self.codec.encode(v) for k, v in mapping.items() if v is not None}
+            if not expiration:
+                return bool(self.connection.mset(serialized_mapping))
 
-            if expiration:
-                # 使用pipeline批量设置过期时间
-                pipe = self.connection.pipeline()
-                for key in mapping.keys():
-                    pipe.expire(key, expiration)
-                pipe.execute()
-
-            return bool(result)
+            # 带过期时间的写入，一次请求内完成所有key的 SET EX
+            pipe = self.pipeline(transaction=False)
+            for key, value in serialized_mapping.items():
+                pipe.set(key, value, ex=expiration)
+            return all(pipe.execute())
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def amset(self, mapping: Dict[str, typing.Any], expiration: int = None) -> bool | None:
         """异步批量设置"""
@@ -160,19 +151,17 @@ class RedisClient:
             if not mapping:
                 return True
 
-            serialized_mapping = {k: pickle.dumps(v) for k, v in mapping.items() if v is not None}
-            result = await self.async_connection.mset(serialized_mapping)
-
-            if expiration:
-                # 使用pipeline批量设置过期时间
-                pipe: Pipeline = self.async_connection.pipeline()
-                for key in mapping.keys():
-                    await pipe.expire(key, expiration)
-                await pipe.execute()
+            serialized_mapping = {k: self.codec.encode(v) for k, v in mapping.items() if v is not None}
+            if not expiration:
+                return bool(await self.async_connection.mset(serialized_mapping))
 
-            return bool(result)
+            # 带过期时间的写入，一次请求内完成所有key的 SET EX
+            pipe = self.async_pipeline(transaction=False)
+            for key, value in serialized_mapping.items():
+                pipe.set(key, value, ex=expiration)
+            return all(await pipe.execute())
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     def mget(self, keys: typing.List[str]) -> typing.List[typing.Any] | None:
         """批量获取"""
@@ -181,9 +170,9 @@ class RedisClient:
                 return []
             values = self.connection.mget(keys)
 
-            return [pickle.loads(v) for v in values if v is not None]
+            return [self.codec.decode(v) for v in values if v is not None]
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def amget(self, keys: typing.List[str]) -> typing.List[typing.Any] | None:
         """异步批量获取"""
@@ -191,9 +180,9 @@ class RedisClient:
             if not keys:
                 return []
             values = await self.async_connection.mget(keys)
-            return [pickle.loads(v) for v in values if v is not None]
+            return [self.codec.decode(v) for v in values if v is not None]
         except TypeError as exc:
-            raise TypeError('RedisCache only accepts values that can be pickled. ') from exc
+            raise TypeError('RedisCache only accepts values that can be serialized. ') from exc
 
     async def akeys(self, pattern: str) -> typing.List[str]:
         """异步获取匹配模式的所有键"""
@@ -206,21 +195,19 @@ class RedisClient:
 
     def hsetkey(self, name, key, value, expiration=3600):
         try:
-            self.cluster_nodes(key)
-            r = self.connection.hset(name, key, value)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
+            self.cluster_nodes(name)
+            if not expiration:
+                return self.connection.hset(name, key, value)
+            return self._execute_with_expire(name, expiration, lambda pipe: pipe.hset(name, key, value))
         except Exception as e:
             raise e
 
     async def ahsetkey(self, name, key, value, expiration=3600):
         try:
-            await self.acluster_nodes(key)
-            r = await self.async_connection.hset(name, key, value)
-            if expiration:
-                await self.async_connection.expire(name, expiration)
-            return r
+            await self.acluster_nodes(name)
+            if not expiration:
+                return await self.async_connection.hset(name, key, value)
+            return await self._aexecute_with_expire(name, expiration, lambda pipe: pipe.hset(name, key, value))
         except Exception as e:
             raise e
 
@@ -232,10 +219,10 @@ class RedisClient:
              expiration: int = 3600):
         try:
             self.cluster_nodes(name)
-            r = self.connection.hset(name, key, value, mapping, items)
-            if expiration:
-                self.connection.expire(name, expiration)
-            return r
+            if not expiration:
+                return self.connection.hset(name, key, value, mapping, items)
+            return self._execute_with_expire(name, expiration,
+                                             lambda pipe: pipe.hset(name, key, value, mapping, items))
         except Exception as e:
             raise e
 
@@ -247,10 +234,10 @@ class RedisClient:
                     expiration: int = 3600):
         try:
             await self.acluster_nodes(name)
-            r = await self.async_connection.hset(name, key, value, mapping, items)
-            if expiration:
-                await self.async_connection.expire(name, expiration)
-            return r
+            if not expiration:
+                return await self.async_connection.hset(name, key, value, mapping, items)
+            return await self._aexecute_with_expire(name, expiration,
+                                                    lambda pipe: pipe.hset(name, key, value, mapping, items))
         except Exception as e:
             raise e
 
@@ -300,7 +287,7 @@ class RedisClient:
         try:
             self.cluster_nodes(key)
             value = self.connection.get(key)
-            return pickle.loads(value) if value else None
+            return self.codec.decode(value) if value else None
         except Exception as e:
             raise e
 
@@ -308,28 +295,25 @@ class RedisClient:
         try:
             await self.acluster_nodes(key)
             value = await self.async_connection.get(key)
-            return pickle.loads(value) if value else None
+            return self.codec.decode(value) if value else None
         except Exception as e:
-            # Handle the case where the value is None or not picklable
             raise e
 
     def incr(self, key, expiration=3600) -> int:
         try:
             self.cluster_nodes(key)
-            value = self.connection.incr(key)
-            if expiration:
-                self.connection.expire(key, expiration)
-            return value
+            if not expiration:
+                return self.connection.incr(key)
+            return self._execute_with_expire(key, expiration, lambda pipe: pipe.incr(key))
         except Exception as e:
             raise e
 
     async def aincr(self, key, expiration=3600) -> int:
         try:
             await self.acluster_nodes(key)
-            value = await self.async_connection.incr(key)
-            if expiration:
-                await self.async_connection.expire(key, expiration)
-            return value
+            if not expiration:
+                return await self.async_connection.incr(key)
+            return await self._aexecute_with_expire(key, expiration, lambda pipe: pipe.incr(key))
         except Exception as e:
             raise e
 
@@ -364,10 +348,9 @@ class RedisClient:
     async def alpush(self, key, value, expiration=3600):
         try:
             await self.acluster_nodes(key)
-            ret = await self.async_connection.lpush(key, value)
-            if expiration:
-                await self.aexpire_key(key, expiration)
-            return ret
+            if not expiration:
+                return await self.async_connection.lpush(key, value)
+            return await self._aexecute_with_expire(key, expiration, lambda pipe: pipe.lpush(key, value))
         except Exception as e:
             raise e
 
@@ -375,7 +358,7 @@ class RedisClient:
         try:
             await self.acluster_nodes(key)
             value = await self.async_connection.blpop(key, timeout)
-            return pickle.loads(value[1]) if value and value[1] else None
+            return self.codec.decode(value[1]) if value and value[1] else None
         except Exception as e:
             raise e
 
@@ -383,14 +366,14 @@ class RedisClient:
         try:
             await self.acluster_nodes(key)
             values = await self.async_connection.lrange(key, start, end)
-            return [pickle.loads(v) for v in values if v is not None]
+            return [self.codec.decode(v) for v in values if v is not None]
         except Exception as e:
             raise e
 
     async def alrem(self, key, value):
         try:
             await self.acluster_nodes(key)
-            value = pickle.dumps(value) if not isinstance(value, bytes) else value
+            value = self.codec.encode(value) if not isinstance(value, bytes) else value
             return await self.async_connection.lrem(key, 0, value)
         except Exception as e:
             raise e
@@ -398,21 +381,19 @@ class RedisClient:
     def rpush(self, key, value, expiration=3600):
         try:
             self.cluster_nodes(key)
-            ret = self.connection.rpush(key, value)
-            if expiration:
-                self.expire_key(key, expiration)
-            return ret
+            if not expiration:
+                return self.connection.rpush(key, value)
+            return self._execute_with_expire(key, expiration, lambda pipe: pipe.rpush(key, value))
         except Exception as e:
             raise e
 
     async def arpush(self, key, value, expiration=3600):
         try:
             await self.acluster_nodes(key)
-            value = pickle.dumps(value) if not isinstance(value, bytes) else value
-            ret = await self.async_connection.rpush(key, value)
-            if expiration:
-                await self.aexpire_key(key, expiration)
-            return ret
+            value = self.codec.encode(value) if not isinstance(value, bytes) else value
+            if not expiration:
+                return await self.async_connection.rpush(key, value)
+            return await self._aexecute_with_expire(key, expiration, lambda pipe: pipe.rpush(key, value))
         except Exception as e:
             raise e
 
@@ -458,6 +439,58 @@ class RedisClient:
         except Exception as e:
             raise e
 
+    # ==================== Stream支持 ====================
+
+    def xadd(self, key, fields: Dict[str, typing.Any], maxlen: int = None, expiration=3600):
+        try:
+            self.cluster_nodes(key)
+            if not expiration:
+                return self.connection.xadd(key, fields, maxlen=maxlen, approximate=True)
+            return self._execute_with_expire(key, expiration,
+                                             lambda pipe: pipe.xadd(key, fields, maxlen=maxlen, approximate=True))
+        except Exception as e:
+            raise e
+
+    async def axadd(self, key, fields: Dict[str, typing.Any], maxlen: int = None, expiration=3600):
+        try:
+            await self.acluster_nodes(key)
+            if not expiration:
+                return await self.async_connection.xadd(key, fields, maxlen=maxlen, approximate=True)
+            return await self._aexecute_with_expire(key, expiration,
+                                                    lambda pipe: pipe.xadd(key, fields, maxlen=maxlen, approximate=True))
+        except Exception as e:
+            raise e
+
+    async def axrange(self, key, start='-', end='+', count: int = None):
+        try:
+            await self.acluster_nodes(key)
+            return await self.async_connection.xrange(key, min=start, max=end, count=count)
+        except Exception as e:
+            raise e
+
+    async def axdel(self, key, *ids):
+        try:
+            await self.acluster_nodes(key)
+            return await self.async_connection.xdel(key, *ids)
+        except Exception as e:
+            raise e
+
+    async def axread(self, streams: Dict[str, str], count: int = None, block: int = None):
+        """ block 阻塞的毫秒数；集群模式下所有stream需要在同一个slot """
+        try:
+            await self.acluster_nodes(next(iter(streams)))
+            return await self.async_block_connection.xread(streams, count=count, block=block)
+        except Exception as e:
+            raise e
+
+    def eval(self, script: str, keys: typing.List[str], args: typing.List[typing.Any] = None):
+        """ 执行lua脚本；集群模式下所有key需要在同一个slot """
+        try:
+            self.cluster_nodes(keys[0])
+            return self.connection.eval(script, len(keys), *keys, *(args or []))
+        except Exception as e:
+            raise e
+
     def close(self):
         self.connection.close()
 
@@ -471,12 +504,25 @@ class RedisClient:
     # ==================== Pipeline支持 ====================
 
     def pipeline(self, transaction: bool = True) -> redis.client.Pipeline:
-        """获取pipeline对象"""
-        return self.connection.pipeline(transaction=transaction)
+        """获取pipeline对象，集群模式不支持事务"""
+        return self.connection.pipeline(transaction=transaction and not self._is_cluster)
 
     def async_pipeline(self, transaction: bool = True) -> Pipeline:
-        """获取异步pipeline对象"""
-        return self.async_connection.pipeline(transaction=transaction)
+        """获取异步pipeline对象，集群模式不支持事务"""
+        return self.async_connection.pipeline(transaction=transaction and not self._is_cluster)
+
+    def _execute_with_expire(self, key, expiration: int, command: typing.Callable):
+        """ 写入命令和设置过期时间在一次请求内完成，返回写入命令的结果 """
+        pipe = self.pipeline()
+        command(pipe)
+        pipe.expire(key, expiration)
+        return pipe.execute()[0]
+
+    async def _aexecute_with_expire(self, key, expiration: int, command: typing.Callable):
+        pipe = self.async_pipeline()
+        command(pipe)
+        pipe.expire(key, expiration)
+        return (await pipe.execute())[0]
 
     async def allen(self, key: str) -> int:
         """Check if the key is in the cache using the 'in' operator."""
@@ -504,14 +550,12 @@ class RedisClient:
         self.connection.delete(key)
 
     def cluster_nodes(self, key):
-        if isinstance(self.connection,
-                      RedisCluster) and self.connection.get_default_node() is None:
+        if self._is_cluster and self.connection.get_default_node() is None:
             target = self.connection.get_node_from_key(key)
             self.connection.set_default_node(target)
 
     async def acluster_nodes(self, key):
-        if isinstance(self.async_connection,
-                      AsyncRedisCluster) and self.async_connection.get_default_node() is None:
+        if self._is_cluster and self.async_connection.get_default_node() is None:
             target = self.async_connection.get_node_from_key(key)
             self.async_connection.set_default_node(target)
 
@@ -23,6 +23,7 @@ from bisheng.chat.clients.workflow_client import WorkflowClient
 from bisheng.chat.types import IgnoreException, WorkType
 from bisheng.chat.utils import process_node_data
 from bisheng.database.base import session_getter
+from bisheng.database.message_writer import chat_message_writer
 from bisheng.database.models.flow import Flow, FlowType, FlowDao
 from bisheng.database.models.message import ChatMessageDao
 from bisheng.database.models.session import MessageSession, MessageSessionDao
@@ -59,12 +60,10 @@ class ChatHistory(Subject):
             files = json.dumps(msg.files) if msg.files else ''
             msg.__dict__.pop('files')
             db_message = ChatMessage(files=files, **msg.__dict__)
+            # 异步批量写入数据库，消息id预先分配
+            chat_message_writer.add(db_message)
+            message.message_id = db_message.id
             logger.info(f'chat={db_message} time={time.time() - t1}')
-            with session_getter() as seesion:
-                seesion.add(db_message)
-                seesion.commit()
-                seesion.refresh(db_message)
-                message.message_id = db_message.id
 
         if not isinstance(message, FileResponse):
             self.notify()
@@ -0,0 +1,135 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from loguru import logger
+
+from bisheng.cache.redis import redis_client
+from bisheng.database.models.message import ChatMessage, ChatMessageDao
+
+# 消息id序列，存储在redis中由所有进程共享
+CHAT_MESSAGE_ID_KEY = 'chat_message:id_seq'
+# redis中的序列丢失后重新初始化时，在数据库最大id的基础上跳过的id数，避免和还未写入数据库的消息id冲突
+CHAT_MESSAGE_ID_GAP = 100000
+
+# 序列存在时直接自增；不存在时，传了初始值则初始化后再自增，否则返回nil
+_ALLOCATE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    if ARGV[2] == nil then
+        return nil
+    end
+    redis.call('set', KEYS[1], ARGV[2])
+end
+return redis.call('incrby', KEYS[1], ARGV[1])
+"""
+
+
+def allocate_message_ids(count: int = 1) -> List[int]:
+    """ 预先分配消息id，写入数据库前就能拿到消息id """
+    end = redis_client.eval(_ALLOCATE_SCRIPT, [CHAT_MESSAGE_ID_KEY], [count])
+    if end is None:
+        init_value = ChatMessageDao.get_max_id() + CHAT_MESSAGE_ID_GAP
+        logger.info(f'init chat message id sequence: {init_value}')
+        end = redis_client.eval(_ALLOCATE_SCRIPT, [CHAT_MESSAGE_ID_KEY], [count, init_value])
+    end = int(end)
+    return list(range(end - count + 1, end + 1))
+
+
+class ChatMessageWriter:
+    """
+    聊天消息的异步批量写入
+    消息id预先分配，消息放入队列后立即返回，由后台线程攒批后使用多行insert写入数据库；
+    进程退出前会把队列中剩余的消息全部写入
+    """
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 0.2, max_queue_size: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # celery等多进程场景下，fork出的子进程需要重新启动写入线程
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            if self._pid != os.getpid() or self._queue is None:
+                self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='chat_message_writer', daemon=True)
+            self._thread.start()
+
+    def add(self, message: ChatMessage) -> ChatMessage:
+        """ 分配消息id后放入写入队列，队列满时阻塞等待 """
+        if message.id is None:
+            message.id = allocate_message_ids(1)[0]
+        self._ensure_started()
+        self._queue.put(message)
+        return message
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                self._queue.task_done()
+                return
+            batch = [message]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    message = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if message is None:
+                    stop = True
+                    break
+                batch.append(message)
+            self._write(batch)
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    @staticmethod
+    def _write(batch: List[ChatMessage]):
+        try:
+            ChatMessageDao.insert_rows(batch)
+            return
+        except Exception as e:
+            logger.exception(f'batch insert chat message error, retry one by one: {e}')
+        # 批量写入失败时逐条写入，避免一条异常数据导致整批消息丢失
+        for one in batch:
+            try:
+                ChatMessageDao.insert_rows([one])
+            except Exception as e:
+                logger.error(f'insert chat message error: id={one.id} chat_id={one.chat_id} error={e}')
+
+    def flush(self):
+        """ 等待队列中的消息全部写入数据库 """
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.join()
+
+    def close(self):
+        """ 写入剩余的消息并停止后台线程 """
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+chat_message_writer = ChatMessageWriter()
+atexit.register(chat_message_writer.close)
@@ -3,7 +3,8 @@ from enum import Enum
 from typing import Optional, Dict, List, Tuple, Union
 
 from sqlalchemy import Enum as SQLEnum, Column, JSON, Text, DateTime, text, CHAR, ForeignKey, ColumnExpressionArgument, \
-    update
+    update, delete, func, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Field, select, col
 from bisheng.database.base import async_session_getter, uuid_hex
 from bisheng.database.models.base import SQLModelSerializable
@@ -39,6 +40,11 @@ class ExecuteTaskStatusEnum(str, Enum):
     TERMINATED = "terminated"
 
 
+# 任务结束的状态，任务结束时将步骤记录合并写入任务的history字段
+EXECUTE_TASK_FINISHED_STATUS = (ExecuteTaskStatusEnum.SUCCESS, ExecuteTaskStatusEnum.FAILED,
+                                ExecuteTaskStatusEnum.TERMINATED)
+
+
 class LinsightExecuteTaskBase(SQLModelSerializable):
     """
     灵思执行任务模型基类
@@ -82,6 +88,98 @@ class LinsightExecuteTask(LinsightExecuteTaskBase, table=True):
     __tablename__ = "linsight_execute_task"
 
 
+class LinsightExecuteTaskStep(SQLModelSerializable, table=True):
+    """
+    灵思执行任务步骤记录，执行过程中每个步骤追加一行，任务结束后合并到任务的history字段
+    """
+    id: Optional[int] = Field(default=None, primary_key=True, description='步骤ID')
+    task_id: str = Field(..., description='任务ID', sa_column=Column(CHAR(36), nullable=False, index=True))
+    step_key: str = Field(..., description='步骤唯一标识，重试写入时不会重复插入', sa_column=Column(CHAR(32), nullable=False))
+    step: Dict = Field(..., description='步骤内容', sa_type=JSON, nullable=False)
+    create_time: datetime = Field(default_factory=datetime.now, description='创建时间',
+                                  sa_column=Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP')))
+
+    __tablename__ = "linsight_execute_task_step"
+    __table_args__ = (UniqueConstraint('task_id', 'step_key', name='task_step_key_uniq'),)
+
+
+class LinsightExecuteTaskStepDao(object):
+    """
+    灵思执行任务步骤数据访问对象
+    """
+
+    @classmethod
+    async def add_step(cls, task_id: str, step_key: str, step: Dict) -> None:
+        """
+        追加一个执行步骤，step_key已存在时忽略，重试时不会重复插入
+        :param task_id: 任务ID
+        :param step_key: 步骤唯一标识
+        :param step: 步骤内容
+        """
+        async with async_session_getter() as session:
+            session.add(LinsightExecuteTaskStep(task_id=task_id, step_key=step_key, step=step))
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+
+    @classmethod
+    async def count_steps(cls, task_ids: List[str]) -> Dict[str, int]:
+        """
+        批量获取任务未合并的执行步骤数量
+        :param task_ids: 任务ID列表
+        :return: 任务ID: 步骤数量
+        """
+        if not task_ids:
+            return {}
+        async with async_session_getter() as session:
+            statement = select(LinsightExecuteTaskStep.task_id, func.count(LinsightExecuteTaskStep.id)).where(
+                col(LinsightExecuteTaskStep.task_id).in_(task_ids)).group_by(LinsightExecuteTaskStep.task_id)
+            result = await session.exec(statement)
+            return {task_id: count for task_id, count in result.all()}
+
+    @classmethod
+    async def get_steps(cls, task_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        批量获取任务未合并的执行步骤
+        :param task_ids: 任务ID列表
+        :return: 任务ID: 按执行顺序排列的步骤列表
+        """
+        if not task_ids:
+            return {}
+        async with async_session_getter() as session:
+            statement = select(LinsightExecuteTaskStep).where(
+                col(LinsightExecuteTaskStep.task_id).in_(task_ids)).order_by(col(LinsightExecuteTaskStep.id))
+            steps = await session.exec(statement)
+            result = {}
+            for one in steps.all():
+                result.setdefault(one.task_id, []).append(one.step)
+            return result
+
+    @classmethod
+    async def delete_steps(cls, task_id: str) -> None:
+        """
+        删除已经合并到任务history字段的步骤
+        :param task_id: 任务ID
+        """
+        async with async_session_getter() as session:
+            await session.exec(delete(LinsightExecuteTaskStep).where(col(LinsightExecuteTaskStep.task_id) == task_id))
+            await session.commit()
+
+    @classmethod
+    async def fill_history(cls, tasks: List["LinsightExecuteTask"]) -> List["LinsightExecuteTask"]:
+        """
+        将未合并的执行步骤追加到任务的history中，用于读取执行中的任务
+        :param tasks: 任务列表
+        :return: 任务列表
+        """
+        steps = await cls.get_steps([task.id for task in tasks])
+        for task in tasks:
+            if task.id in steps:
+                task.history = (task.history or []) + steps[task.id]
+        return tasks
+
+
 class LinsightExecuteTaskDao(object):
     """
     灵思执行任务数据访问对象
@@ -6,7 +6,7 @@ from bisheng.database.base import session_getter
 from bisheng.database.models.base import SQLModelSerializable
 from loguru import logger
 from pydantic import BaseModel
-from sqlmodel import (JSON, Column, DateTime, Field, String, Text, case, delete, func, not_, or_,
+from sqlmodel import (JSON, Column, DateTime, Field, String, Text, case, delete, func, insert, not_, or_,
                       select, text, update)
 
 
@@ -241,16 +241,49 @@ class ChatMessageDao(MessageBase):
             session.commit()
         return True
 
+    @classmethod
+    def get_max_id(cls) -> int:
+        with session_getter() as session:
+            return session.scalar(select(func.max(ChatMessage.id))) or 0
+
+    @classmethod
+    def _fill_ids(cls, messages: List[ChatMessage]):
+        """ 消息id统一预先分配，不使用数据库的自增id，避免和异步写入的消息id冲突 """
+        from bisheng.database.message_writer import allocate_message_ids
+        need_ids = [one for one in messages if one.id is None]
+        if not need_ids:
+            return
+        for one, message_id in zip(need_ids, allocate_message_ids(len(need_ids))):
+            one.id = message_id
+
     @classmethod
     def insert_one(cls, message: ChatMessage) -> ChatMessage:
+        cls._fill_ids([message])
         with session_getter() as session:
             session.add(message)
             session.commit()
             session.refresh(message)
         return message
 
+    @classmethod
+    def insert_rows(cls, messages: List[ChatMessage]):
+        """ 多行insert批量写入已分配好id的消息，不回查数据库 """
+        rows_group: Dict[Tuple, List[Dict]] = {}
+        for one in messages:
+            row = one.model_dump()
+            # 未赋值的时间字段使用数据库的默认值
+            for key in ('create_time', 'update_time'):
+                if row.get(key) is None:
+                    row.pop(key, None)
+            rows_group.setdefault(tuple(row.keys()), []).append(row)
+        with session_getter() as session:
+            for rows in rows_group.values():
+                session.exec(insert(ChatMessage).values(rows))
+            session.commit()
+
     @classmethod
     def insert_batch(cls, messages: List[ChatMessage]):
+        cls._fill_ids(messages)
         with session_getter() as session:
             session.add_all(messages)
             session.commit()
@@ -4,7 +4,7 @@ from typing import List, Optional
 from sqlalchemy import Column, DateTime, delete, text
 from sqlmodel import Field, select
 
-from bisheng.database.base import session_getter
+from bisheng.database.base import async_session_getter, session_getter
 from bisheng.database.models.base import SQLModelSerializable
 from bisheng.database.models.group import DefaultGroup
 
@@ -59,6 +59,16 @@ class UserGroupDao(UserGroupBase):
             statement = select(UserGroup).where(UserGroup.user_id == user_id).where(UserGroup.is_group_admin == 1)
             return session.exec(statement).all()
 
+    @classmethod
+    async def aget_user_admin_group(cls, user_id: int) -> List[UserGroup]:
+        """
+        异步获取用户是管理员的用户组
+        """
+        async with async_session_getter() as session:
+            statement = select(UserGroup).where(UserGroup.user_id == user_id).where(UserGroup.is_group_admin == 1)
+            result = await session.exec(statement)
+            return result.all()
+
     @classmethod
     def insert_user_group(cls, user_group: UserGroupCreate) -> UserGroup:
         with session_getter() as session:
@@ -0,0 +1,184 @@
+import abc
+import hashlib
+import json
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from bisheng.cache.flow import InMemoryCache
+
+
+class EmbeddingCacheBackend(abc.ABC):
+    """ embedding缓存的存储后端 """
+
+    @abc.abstractmethod
+    def mget(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """ 批量获取向量，未命中的位置返回None """
+
+    @abc.abstractmethod
+    def mset(self, mapping: Dict[str, List[float]]):
+        """ 批量写入向量 """
+
+
+class RedisEmbeddingCacheBackend(EmbeddingCacheBackend):
+    """ 使用redis存储向量，向量以float32的二进制格式存储，和milvus内的存储精度一致 """
+
+    def __init__(self, expiration: int = 7 * 24 * 3600):
+        self.expiration = expiration
+
+    @property
+    def redis(self):
+        from bisheng.cache.redis import redis_client
+        return redis_client
+
+    def mget(self, keys: List[str]) -> List[Optional[List[float]]]:
+        if not keys:
+            return []
+        # 使用pipeline逐个get，兼容集群模式下key分布在不同slot的情况
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        values = pipe.execute()
+        return [np.frombuffer(one, dtype=np.float32).tolist() if one else None for one in values]
+
+    def mset(self, mapping: Dict[str, List[float]]):
+        if not mapping:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key, vector in mapping.items():
+            pipe.set(key, np.asarray(vector, dtype=np.float32).tobytes(), ex=self.expiration)
+        pipe.execute()
+
+
+class EmbeddingCacheStats:
+    """ embedding缓存命中情况统计 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+
+    def record(self, local_hits: int = 0, remote_hits: int = 0, misses: int = 0):
+        with self._lock:
+            self.local_hits += local_hits
+            self.remote_hits += remote_hits
+            self.misses += misses
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.local_hits + self.remote_hits + self.misses
+        if total == 0:
+            return 0.0
+        return (self.local_hits + self.remote_hits) / total
+
+    def to_dict(self) -> dict:
+        return {
+            'local_hits': self.local_hits,
+            'remote_hits': self.remote_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hit_rate, 4),
+        }
+
+
+class EmbeddingCache:
+    """
+    embedding结果缓存，key为(模型及其配置的hash, 文档/查询, 归一化后文本的hash)
+    两级缓存：进程内LRU + 可插拔的共享存储（默认redis）
+    """
+    DOCUMENT = 'doc'
+    QUERY = 'query'
+
+    def __init__(self, backend: Optional[EmbeddingCacheBackend] = None, local_max_size: int = 10000,
+                 local_expiration: int = 3600):
+        self.backend = backend
+        self.local = InMemoryCache(max_size=local_max_size, expiration_time=local_expiration) \
+            if local_max_size > 0 else None
+        self.stats = EmbeddingCacheStats()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return unicodedata.normalize('NFC', text).strip()
+
+    @staticmethod
+    def make_model_key(model_id: int, class_name: str, params: Dict) -> str:
+        """ 模型的配置（模型名称、服务地址、调用参数等）改变后向量不再通用，key同时包含模型id和配置的hash """
+        data = json.dumps({'class_name': class_name, 'params': params}, sort_keys=True, default=str)
+        return f'{model_id}:{hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]}'
+
+    @classmethod
+    def make_key(cls, model_key: str, text: str, kind: str = DOCUMENT) -> str:
+        """ 部分模型对文档和查询使用不同的指令，二者的向量分开缓存 """
+        text_hash = hashlib.sha256(cls.normalize_text(text).encode('utf-8')).hexdigest()
+        return f'embedding:{model_key}:{kind}:{text_hash}'
+
+    def get_many(self, model_key: str, texts: List[str], kind: str = DOCUMENT) -> List[Optional[List[float]]]:
+        """ 批量查询缓存，未命中的位置返回None """
+        keys = [self.make_key(model_key, one, kind) for one in texts]
+        result: List[Optional[List[float]]] = [None] * len(keys)
+        local_hits = remote_hits = 0
+
+        remote_index = []
+        for index, key in enumerate(keys):
+            if self.local is not None and (vector := self.local.get(key)) is not None:
+                result[index] = vector
+                local_hits += 1
+            else:
+                remote_index.append(index)
+
+        if remote_index and self.backend is not None:
+            try:
+                values = self.backend.mget([keys[i] for i in remote_index])
+            except Exception as e:
+                logger.warning(f'embedding_cache_get_error: {e}')
+                values = [None] * len(remote_index)
+            for index, vector in zip(remote_index, values):
+                if vector is None:
+                    continue
+                result[index] = vector
+                remote_hits += 1
+                if self.local is not None:
+                    self.local.set(keys[index], vector)
+
+        self.stats.record(local_hits=local_hits,
+                          remote_hits=remote_hits,
+                          misses=len(keys) - local_hits - remote_hits)
+        return result
+
+    def set_many(self, model_key: str, texts: List[str], vectors: List[List[float]], kind: str = DOCUMENT):
+        """ 批量写入缓存 """
+        mapping = {}
+        for text, vector in zip(texts, vectors):
+            key = self.make_key(model_key, text, kind)
+            mapping[key] = vector
+            if self.local is not None:
+                self.local.set(key, vector)
+        if self.backend is not None:
+            try:
+                self.backend.mset(mapping)
+            except Exception as e:
+                logger.warning(f'embedding_cache_set_error: {e}')
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """ 获取进程内共享的embedding缓存，未开启缓存时返回None """
+    global _embedding_cache
+    from bisheng.settings import settings
+
+    conf = settings.get_embedding_cache_conf()
+    if not conf.enabled:
+        return None
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(backend=RedisEmbeddingCacheBackend(conf.expiration),
+                                                  local_max_size=conf.local_max_size,
+                                                  local_expiration=conf.local_expiration)
+    return _embedding_cache
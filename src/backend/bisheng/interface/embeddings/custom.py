@@ -8,7 +8,9 @@ from pydantic import ConfigDict, Field, BaseModel
 
 from bisheng.database.models.llm_server import (LLMDao, LLMModel, LLMModelType, LLMServer,
                                                 LLMServerType)
+from bisheng.interface.embeddings.cache import EmbeddingCache, get_embedding_cache
 from bisheng.interface.importing import import_by_type
+from bisheng.interface.model_registry import model_client_registry
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check
 
 BATCH_SIZE["text-embedding-v4"] = 10  # 设置DashScope的批处理大小为1
@@ -60,6 +62,8 @@ class BishengEmbedding(BaseModel, Embeddings):
     model_kwargs: dict = Field(default={}, description='embedding模型调用参数')
 
     embeddings: Optional[Embeddings] = Field(default=None)
+    cache: Optional[EmbeddingCache] = Field(default=None, description='向量化结果缓存')
+    cache_model_key: str = Field(default='', description='向量化结果缓存的模型key')
     llm_node_type: Dict = {
         # 开源推理框架
         LLMServerType.OLLAMA.value: 'OllamaEmbeddings',
@@ -83,6 +87,7 @@ class BishengEmbedding(BaseModel, Embeddings):
     # bisheng强相关的业务参数
     model_info: Optional[LLMModel] = Field(default=None)
     server_info: Optional[LLMServer] = Field(default=None)
+    status_synced: bool = Field(default=False, description='model_info中的模型状态是否已经写入数据库')
     model_config = ConfigDict(validate_by_name=True, arbitrary_types_allowed=True)
 
     def __init__(self, **kwargs):
@@ -94,10 +99,9 @@ class BishengEmbedding(BaseModel, Embeddings):
 
         if not self.model_id:
             raise Exception('没有找到embedding模型配置')
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_client_registry.get_model_info(self.model_id)
         if not model_info:
             raise Exception('embedding模型配置已被删除，请重新配置模型')
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise Exception('服务提供方配置已被删除，请重新配置embedding模型')
         if model_info.model_type != LLMModelType.EMBEDDING.value:
@@ -112,11 +116,22 @@ class BishengEmbedding(BaseModel, Embeddings):
 
         class_object = self._get_embedding_class(server_info.type)
         params = self._get_embedding_params(server_info, model_info)
+        # 客户端初始化可能会修改params，先计算缓存的模型key
+        cache_model_key = EmbeddingCache.make_model_key(self.model_id, class_object.__name__, params)
         try:
-            self.embeddings = instantiate_embedding(class_object, params)
+            # 相同配置的模型复用同一个客户端
+            self.embeddings = model_client_registry.get_client(self.model_id, class_object.__name__, params,
+                                                               lambda: instantiate_embedding(class_object, params))
         except Exception as e:
             logger.exception('init_bisheng_embedding error')
             raise Exception(f'初始化bisheng embedding组件失败，请检查配置或联系管理员。错误信息：{e}')
+        try:
+            # cache=False时不使用向量化结果缓存，比如检测模型是否可用时
+            if kwargs.get('cache', True):
+                self.cache = get_embedding_cache()
+                self.cache_model_key = cache_model_key
+        except Exception as e:
+            logger.warning(f'init_embedding_cache error: {e}')
 
     def _get_embedding_class(self, server_type: str) -> Embeddings:
         node_type = self.llm_node_type.get(server_type)
@@ -157,8 +172,47 @@ class BishengEmbedding(BaseModel, Embeddings):
             params['query_instruction'] = 'passage: '
         return params
 
-    @wrapper_bisheng_model_limit_check
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """embedding, 只把缓存未命中的文本发给模型"""
+        if not self.cache or not texts:
+            return self._embed_documents(texts)
+
+        ret = self.cache.get_many(self.cache_model_key, texts)
+        # 同一批次内重复的文本只请求一次
+        miss_texts: Dict[str, List[int]] = {}
+        for index, vector in enumerate(ret):
+            if vector is None:
+                miss_texts.setdefault(texts[index], []).append(index)
+        logger.debug(f'embedding_cache model={self.cache_model_key} total={len(texts)} '
+                     f'miss={len(miss_texts)} stats={self.cache.stats.to_dict()}')
+        if not miss_texts:
+            return ret
+
+        miss_list = list(miss_texts.keys())
+        vectors = self._embed_documents(miss_list)
+        if len(vectors) != len(miss_list):
+            # 模型返回的结果数量不对时不缓存，直接返回模型结果
+            logger.warning(f'embedding result size mismatch, expect={len(miss_list)} got={len(vectors)}')
+            return self._embed_documents(texts)
+        for text, vector in zip(miss_list, vectors):
+            for index in miss_texts[text]:
+                ret[index] = vector
+        self.cache.set_many(self.cache_model_key, miss_list, vectors)
+        return ret
+
+    def embed_query(self, text: str) -> List[float]:
+        """embedding, 命中缓存时不请求模型"""
+        if not self.cache:
+            return self._embed_query(text)
+        vector = self.cache.get_many(self.cache_model_key, [text], EmbeddingCache.QUERY)[0]
+        if vector is not None:
+            return vector
+        vector = self._embed_query(text)
+        self.cache.set_many(self.cache_model_key, [text], [vector], EmbeddingCache.QUERY)
+        return vector
+
+    @wrapper_bisheng_model_limit_check
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
         """embedding"""
         try:
             if self.server_info.limit_flag:
@@ -177,7 +231,7 @@ class BishengEmbedding(BaseModel, Embeddings):
             raise Exception(f'embedding error: {e}')
 
     @wrapper_bisheng_model_limit_check
-    def embed_query(self, text: str) -> List[float]:
+    def _embed_query(self, text: str) -> List[float]:
         """embedding"""
         try:
             ret = self.embeddings.embed_query(text)
@@ -193,9 +247,12 @@ class BishengEmbedding(BaseModel, Embeddings):
     def _update_model_status(self, status: int, remark: str = ''):
         """更新模型状态"""
         # todo 接入到异步任务模块 累计5分钟更新一次
-        if self.model_info.status != status:
-            self.model_info.status = status
-            LLMDao.update_model_status(self.model_id, status, remark)
+        # model_info来自进程内缓存，数据库中的状态可能已被其他进程修改，所以实例第一次上报时总是写库
+        if self.status_synced and self.model_info.status == status:
+            return
+        self.model_info.status = status
+        self.status_synced = True
+        LLMDao.update_model_status(self.model_id, status, remark)
 
 
 CUSTOM_EMBEDDING = {
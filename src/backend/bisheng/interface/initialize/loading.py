@@ -501,9 +501,13 @@ def instantiate_vectorstore(node_type: str, class_object: Type[VectorStore], par
             params[col_name] = []
             params['collection_embeddings'] = []
             params['partition_keys'] = []
+            # 使用相同embedding模型的知识库共用一个embedding对象
+            model_embeddings = {}
             for knowledge in knowledge_list:
                 params[col_name].append(knowledge.collection_name)
-                params['collection_embeddings'].append(decide_embeddings(knowledge.model))
+                if knowledge.model not in model_embeddings:
+                    model_embeddings[knowledge.model] = decide_embeddings(knowledge.model)
+                params['collection_embeddings'].append(model_embeddings[knowledge.model])
                 if knowledge.collection_name.startswith('partition'):
                     params['partition_keys'].append(knowledge.id)
                 else:
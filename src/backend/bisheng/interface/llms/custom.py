@@ -14,6 +14,7 @@ from pydantic import Field
 from bisheng.database.models.llm_server import LLMDao, LLMModelType, LLMServerType, LLMModel, LLMServer
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm
+from bisheng.interface.model_registry import model_client_registry
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check, wrapper_bisheng_model_limit_check_async, \
     wrapper_bisheng_model_generator, wrapper_bisheng_model_generator_async
 
@@ -156,6 +157,7 @@ class BishengLLM(BaseChatModel):
     # bisheng强相关的业务参数
     model_info: Optional[LLMModel] = Field(default=None)
     server_info: Optional[LLMServer] = Field(default=None)
+    status_synced: bool = Field(default=False, description='model_info中的模型状态是否已经写入数据库')
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -169,11 +171,10 @@ class BishengLLM(BaseChatModel):
 
         if not self.model_id:
             raise Exception('没有找到llm模型配置')
-        model_info = LLMDao.get_model_by_id(self.model_id)
+        model_info, server_info = model_client_registry.get_model_info(self.model_id)
         if not model_info:
             raise Exception('llm模型配置已被删除，请重新配置模型')
         self.model_name = model_info.model_name
-        server_info = LLMDao.get_server_by_id(model_info.server_id)
         if not server_info:
             raise Exception('服务提供方配置已被删除，请重新配置llm模型')
         if model_info.model_type != LLMModelType.LLM.value:
@@ -187,7 +188,9 @@ class BishengLLM(BaseChatModel):
         class_object, class_name = self._get_llm_class(server_info.type)
         params = self._get_llm_params(server_info, model_info)
         try:
-            self.llm = instantiate_llm(class_name, class_object, params)
+            # 相同配置的模型复用同一个客户端
+            self.llm = model_client_registry.get_client(self.model_id, class_name, params,
+                                                        lambda: instantiate_llm(class_name, class_object, params))
         except Exception as e:
             logger.exception('init bisheng llm error')
             raise Exception(f'初始化llm失败，请检查配置或联系管理员。错误信息：{e}')
@@ -399,10 +402,12 @@ class BishengLLM(BaseChatModel):
         return result
 
     def _update_model_status(self, status: int, remark: str = ''):
-        """更新模型状态"""
-        if self.model_info.status != status:
-            self.model_info.status = status
-            LLMDao.update_model_status(self.model_id, status, remark[-500:])  # 限制备注长度为500字符
+        """更新模型状态，model_info来自进程内缓存，数据库中的状态可能已被其他进程修改，所以实例第一次上报时总是写库"""
+        if self.status_synced and self.model_info.status == status:
+            return
+        self.model_info.status = status
+        self.status_synced = True
+        LLMDao.update_model_status(self.model_id, status, remark[-500:])  # 限制备注长度为500字符
 
     def bind_tools(
             self,
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import json
+import threading
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from bisheng.cache.flow import InMemoryCache
+from bisheng.database.models.llm_server import LLMDao, LLMModel, LLMServer
+
+# 模型配置的全局版本号，任意进程修改模型配置后更新，其他进程发现版本变化后清空本地缓存
+MODEL_REGISTRY_VERSION_KEY = 'llm:model_registry:version'
+
+
+class ModelClientRegistry:
+    """
+    进程内共享的模型客户端注册表
+    缓存模型和服务提供方的配置，以及各服务提供方的客户端实例（包含http连接池），
+    相同模型、相同初始化参数的BishengLLM/BishengEmbedding复用同一个客户端，避免每次初始化都查库和新建连接
+    客户端内的异步连接池绑定在首次使用的事件循环上，所以客户端按事件循环（没有运行中的事件循环时按线程）分别缓存
+    """
+
+    def __init__(self, max_size: int = 256, expiration_time: int = 3600):
+        # model_id: (LLMModel, LLMServer)
+        self._model_cache = InMemoryCache(max_size=max_size, expiration_time=expiration_time)
+        # 事件循环或线程:model_id:参数hash: (event loop, client)
+        self._client_cache = InMemoryCache(max_size=max_size, expiration_time=expiration_time)
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        from bisheng.cache.redis import redis_client
+        return redis_client
+
+    def _check_version(self):
+        """ 其他进程修改了模型配置后，清空本进程的缓存 """
+        version = self.redis.get(MODEL_REGISTRY_VERSION_KEY)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._model_cache.clear()
+                self._client_cache.clear()
+                self._version = version
+
+    def get_model_info(self, model_id: int) -> Tuple[Optional[LLMModel], Optional[LLMServer]]:
+        """
+        获取模型和服务提供方的配置，不存在时对应的位置返回None
+        每次返回缓存的副本，调用方修改配置（比如模型状态）不会影响其他实例
+        """
+        self._check_version()
+        cached = self._model_cache.get(model_id)
+        if cached is None:
+            model_info = LLMDao.get_model_by_id(model_id)
+            if not model_info:
+                return None, None
+            server_info = LLMDao.get_server_by_id(model_info.server_id)
+            if not server_info:
+                return model_info, None
+            cached = (model_info, server_info)
+            self._model_cache.set(model_id, cached)
+        model_info, server_info = cached
+        return LLMModel.model_validate(model_info.model_dump()), LLMServer.model_validate(server_info.model_dump())
+
+    @staticmethod
+    def _params_hash(class_name: str, params: Dict) -> str:
+        data = json.dumps({'class_name': class_name, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _client_scope() -> Tuple[str, Optional[asyncio.AbstractEventLoop]]:
+        """ 客户端的复用范围，有运行中的事件循环时按事件循环，否则按线程 """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return f'thread_{threading.get_ident()}', None
+        return f'loop_{id(loop)}', loop
+
+    def get_client(self, model_id: int, class_name: str, params: Dict, factory: Callable[[], Any]) -> Any:
+        """ 获取模型客户端，不存在时调用factory创建，factory可能会修改params，所以先计算参数的hash """
+        scope, loop = self._client_scope()
+        key = f'{scope}:{model_id}:{self._params_hash(class_name, params)}'
+        cached = self._client_cache.get(key)
+        # 缓存中持有事件循环的引用，事件循环的id不会被复用；事件循环关闭后客户端的连接池也不能再用
+        if cached is not None and cached[0] is loop and not (loop and loop.is_closed()):
+            return cached[1]
+        client = factory()
+        self._client_cache.set(key, (loop, client))
+        return client
+
+    def invalidate(self):
+        """ 模型配置发生变化，让所有进程的缓存失效 """
+        version = uuid.uuid4().hex
+        self.redis.set(MODEL_REGISTRY_VERSION_KEY, version, expiration=None)
+        with self._lock:
+            self._model_cache.clear()
+            self._client_cache.clear()
+            self._version = version
+        logger.debug(f'model client registry invalidated, version: {version}')
+
+
+model_client_registry = ModelClientRegistry()
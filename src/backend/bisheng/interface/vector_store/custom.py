@@ -1,5 +1,8 @@
+import contextvars
+import heapq
 from abc import ABC
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import jieba
@@ -13,7 +16,7 @@ from langchain_core.language_models import BaseLLM
 from langchain_core.prompts import PromptTemplate
 from loguru import logger
 
-from bisheng_langchain.vectorstores.elastic_keywords_search import DEFAULT_PROMPT
+from bisheng_langchain.vectorstores.elastic_keywords_search import DEFAULT_PROMPT, get_es_major_version
 from bisheng_langchain.vectorstores.milvus import DEFAULT_MILVUS_CONNECTION
 
 if TYPE_CHECKING:
@@ -27,6 +30,9 @@ class MilvusWithPermissionCheck(MilvusLangchain):
     not include create collection
     """
 
+    # 多collection并发检索的最大线程数
+    max_search_workers: int = 8
+
     def __init__(self,
                  embedding_function: Embeddings,
                  collection_name: list[str] = None,
@@ -355,10 +361,8 @@ class MilvusWithPermissionCheck(MilvusLangchain):
             logger.debug('No existing collection to search.')
             return []
 
-        # Embed the query text.
-        embedding = self.embedding_func.embed_query(query)
-
-        res = self.similarity_search_with_score_by_vector(embedding=embedding,
+        # 问题的向量在检索时按每个collection的embedding模型计算
+        res = self.similarity_search_with_score_by_vector(embedding=None,
                                                           k=k,
                                                           query=query,
                                                           param=param,
@@ -369,7 +373,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
     def similarity_search_with_score_by_vector(
             self,
-            embedding: List[float],
+            embedding: Optional[List[float]],
             k: int = 4,
             param: Optional[dict] = None,
             query: Optional[str] = None,
@@ -384,7 +388,8 @@ class MilvusWithPermissionCheck(MilvusLangchain):
         https://milvus.io/api-reference/pymilvus/v2.2.6/Collection/search().md
 
         Args:
-            embedding (List[float]): disabled.
+            embedding (List[float]): Query embedding of the embedding_function,
+                reused for collections with the same embedding model.
             k (int, optional): The amount of results to return. Defaults to 4.
             param (dict): The search params for the specified index.
                 Defaults to None.
@@ -414,11 +419,19 @@ class MilvusWithPermissionCheck(MilvusLangchain):
 
         finally_k = kwargs.pop('k', k)
 
-        ret = []
-
-        for index, one_col in enumerate(self.col):
+        # 相同的embedding模型只计算一次问题的向量
+        query_embeddings = {}
+        if embedding is not None:
+            query_embeddings[self._embedding_key(self.embedding_func)] = embedding
+        unique_embeddings = {}
+        for one in self.collection_embeddings[:len(self.col)]:
+            key = self._embedding_key(one)
+            if key not in query_embeddings:
+                unique_embeddings.setdefault(key, one)
+
+        def search_one(index: int) -> List[Tuple[Document, float]]:
+            one_col = self.col[index]
             search_expr = expr
-            embedding = self.collection_embeddings[index].embed_query(query)
             if self.col_partition_key[index]:
                 # add parttion
                 if expr:
@@ -427,7 +440,7 @@ class MilvusWithPermissionCheck(MilvusLangchain):
                     search_expr = f"{self._partition_field}==\"{self.col_partition_key[index]}\""
             # Perform the search.
             res = one_col.search(
-                data=[embedding],
+                data=[query_embeddings[self._embedding_key(self.collection_embeddings[index])]],
                 anns_field=self._vector_field,
                 param=param,
                 limit=k,
@@ -437,19 +450,42 @@ class MilvusWithPermissionCheck(MilvusLangchain):
                 **kwargs,
             )
             # Organize results.
+            one_ret = []
             for result in res[0]:
                 meta = {x: result.entity.get(x) for x in output_fields}
                 doc = Document(page_content=meta.pop(self._text_field), metadata=meta)
-                pair = (doc, result.score)
-                ret.append(pair)
+                one_ret.append((doc, result.score))
             logger.debug(f'MilvusWithPermissionCheck Search {one_col.name} query: {query} results: {res[0]}')
-        ret.sort(key=lambda x: x[1])
+            return one_ret
+
+        # 多个collection并发检索，耗时取决于最慢的collection
+        with ThreadPoolExecutor(max_workers=min(len(self.col), self.max_search_workers)) as executor:
+            embed_futures = {
+                key: executor.submit(contextvars.copy_context().run, one.embed_query, query)
+                for key, one in unique_embeddings.items()
+            }
+            for key, future in embed_futures.items():
+                query_embeddings[key] = future.result()
+            search_futures = [
+                executor.submit(contextvars.copy_context().run, search_one, index) for index in range(len(self.col))
+            ]
+            results = [future.result() for future in search_futures]
+
+        ret = [pair for one_ret in results for pair in one_ret]
         logger.debug(f'MilvusWithPermissionCheck Search all results: {len(ret)}')
         # milvus是分数越小越好，所以直接取前几位就行
-        ret = ret[:finally_k]
+        ret = heapq.nsmallest(finally_k, ret, key=lambda x: x[1])
         logger.debug(f'MilvusWithPermissionCheck Search finally results: {len(ret)}')
         return ret
 
+    @staticmethod
+    def _embedding_key(embedding: Embeddings) -> Any:
+        """ 用来判断两个collection是否使用同一个embedding模型 """
+        model_id = getattr(embedding, 'model_id', None)
+        if model_id:
+            return f'model_{model_id}'
+        return id(embedding)
+
     @staticmethod
     def _relevance_score_fn(distance: float) -> float:
         """Normalize the distance to a score on a scale [0, 1]."""
@@ -545,8 +581,12 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
             match_query['bool'][must_or_should].append({query_strategy: {'text': key}})
 
         ret = []
-        for one_index_name in self.index_name:
-            response = self.client_search(self.client, one_index_name, match_query, size=k)
+        # 所有知识库的检索合并为一次msearch请求
+        responses = self.client_msearch(self.client, self.index_name, match_query, size=k)
+        for one_index_name, response in zip(self.index_name, responses):
+            if 'error' in response:
+                logger.warning(f'ElasticsearchWithPermissionCheck Search {one_index_name} error: {response["error"]}')
+                continue
             hits = [hit for hit in response['hits']['hits']]
             for hit in hits:
                 ret.append((Document(page_content=hit['_source']['text'],
@@ -621,14 +661,28 @@ class ElasticsearchWithPermissionCheck(VectorStore, ABC):
         return vectorsearch
 
     def client_search(self, client: Any, index_name: str, script_query: Dict, size: int) -> Any:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = get_es_major_version(client, self.elasticsearch_url)
         if version_num >= 8:
             response = client.search(index=index_name, query=script_query, size=size)
         else:
             response = client.search(index=index_name, body={'query': script_query, 'size': size})
         return response
 
+    def client_msearch(self, client: Any, index_names: List[str], script_query: Dict, size: int) -> List[Dict]:
+        """ 同一个查询在多个索引上分别检索，返回和index_names一一对应的结果 """
+        if not index_names:
+            return []
+        searches = []
+        for one_index_name in index_names:
+            searches.append({'index': one_index_name})
+            searches.append({'query': script_query, 'size': size})
+        version_num = get_es_major_version(client, self.elasticsearch_url)
+        if version_num >= 8:
+            response = client.msearch(searches=searches)
+        else:
+            response = client.msearch(body=searches)
+        return response['responses']
+
     def delete(self, **kwargs: Any) -> None:
         # TODO: Check if this can be done in bulk
         self.client.indices.delete(index=self.index_name)
@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+from loguru import logger
+
+# 向量库缓存的全局版本号，任意进程删除或重建collection、索引后更新，其他进程发现版本变化后清空本地缓存的状态
+VECTOR_STORE_REGISTRY_VERSION_KEY = 'vector_store:registry:version'
+
+
+class _RegistryEntry:
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.checked_at = time.time()
+
+
+class VectorStoreRegistry:
+    """
+    进程内共享的向量库客户端注册表
+    es: 按(地址, 认证参数)缓存Elasticsearch客户端，所有索引共用同一个连接池，并记录已确认存在的索引
+    milvus: 按(连接参数, collection)缓存collection的schema、索引和加载状态，避免每次初始化都执行describe、load等请求
+    超过health_check_interval的缓存在下次使用前做一次健康检查，不可用时重新初始化
+    collection、索引被删除时通过redis中的版本号通知其他进程清理缓存
+    """
+
+    def __init__(self, max_size: int = 256, health_check_interval: int = 300):
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._es_clients: Dict[str, _RegistryEntry] = {}
+        self._es_indexes: OrderedDict[Tuple[str, str], _RegistryEntry] = OrderedDict()
+        self._milvus_states: OrderedDict[Tuple[str, str], _RegistryEntry] = OrderedDict()
+        self._version = None
+        self._lock = threading.RLock()
+
+    @property
+    def redis(self):
+        from bisheng.cache.redis import redis_client
+        return redis_client
+
+    def _check_version(self):
+        """ 其他进程删除或重建了collection、索引后，清空本进程缓存的状态，客户端连接不受影响 """
+        try:
+            version = self.redis.get(VECTOR_STORE_REGISTRY_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f'vector_store_registry_version error: {e}')
+            return
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._es_indexes.clear()
+                self._milvus_states.clear()
+                self._version = version
+
+    def _bump_version(self):
+        """ 通知其他进程清理缓存的状态 """
+        version = uuid.uuid4().hex
+        try:
+            self.redis.set(VECTOR_STORE_REGISTRY_VERSION_KEY, version, expiration=None)
+        except Exception as e:
+            logger.warning(f'vector_store_registry_invalidate error: {e}')
+            return
+        with self._lock:
+            self._version = version
+
+    @staticmethod
+    def _config_key(config: Any) -> str:
+        return json.dumps(config, sort_keys=True, default=str)
+
+    def _need_check(self, entry: _RegistryEntry) -> bool:
+        return time.time() - entry.checked_at > self.health_check_interval
+
+    def _put(self, cache: OrderedDict, key: Tuple[str, str], value: Any):
+        with self._lock:
+            cache[key] = _RegistryEntry(value)
+            cache.move_to_end(key)
+            while len(cache) > self.max_size:
+                cache.popitem(last=False)
+
+    def _get(self, cache: OrderedDict, key: Tuple[str, str]) -> Optional[_RegistryEntry]:
+        with self._lock:
+            entry = cache.get(key)
+            if entry is not None:
+                cache.move_to_end(key)
+            return entry
+
+    def get_es_client(self, elasticsearch_url: str, ssl_verify: Dict) -> Any:
+        """ 获取共享的Elasticsearch客户端 """
+        import elasticsearch
+
+        key = f'{elasticsearch_url}:{self._config_key(ssl_verify)}'
+        with self._lock:
+            entry = self._es_clients.get(key)
+            if entry is not None and self._need_check(entry):
+                try:
+                    healthy = entry.value.ping()
+                except Exception as e:
+                    logger.warning(f'es_client_health_check error: {e}')
+                    healthy = False
+                if healthy:
+                    entry.checked_at = time.time()
+                else:
+                    logger.warning(f'es_client_unhealthy url={elasticsearch_url}, recreate client')
+                    self._es_clients.pop(key, None)
+                    self._es_indexes.clear()
+                    entry = None
+            if entry is None:
+                try:
+                    client = elasticsearch.Elasticsearch(elasticsearch_url, **ssl_verify)
+                except ValueError as e:
+                    raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
+                entry = _RegistryEntry(client)
+                self._es_clients[key] = entry
+            return entry.value
+
+    def get_es_store(self, class_obj: Any, index_name: str, embedding: Embeddings, vector_config: Dict) -> Any:
+        """ 使用共享的客户端初始化ElasticKeywordsSearch，索引不存在时创建索引 """
+        elasticsearch_url = vector_config['elasticsearch_url']
+        ssl_verify = vector_config.get('ssl_verify') or {}
+        client = self.get_es_client(elasticsearch_url, ssl_verify)
+        self._check_version()
+        store = class_obj(elasticsearch_url, index_name, ssl_verify=ssl_verify, client=client)
+
+        key = (elasticsearch_url, index_name)
+        entry = self._get(self._es_indexes, key)
+        if entry is None or self._need_check(entry):
+            # 没有写入数据时只会检查索引是否存在，不存在则创建
+            store.add_texts([])
+            self._put(self._es_indexes, key, True)
+        return store
+
+    def get_milvus_store(self, class_obj: Any, collection_name: str, embedding: Embeddings,
+                         vector_config: Dict) -> Optional[Any]:
+        """ 使用缓存的collection状态初始化Milvus，无可用缓存时返回None """
+        from pymilvus import connections
+
+        self._check_version()
+        key = (self._config_key(vector_config.get('connection_args')), collection_name)
+        entry = self._get(self._milvus_states, key)
+        if entry is None:
+            return None
+        state = entry.value
+        if self._need_check(entry) or not connections.has_connection(state['alias']):
+            # 超过检查间隔或者连接已被关闭，重新初始化
+            self.evict_milvus(collection_name, broadcast=False)
+            return None
+        return class_obj(embedding_function=embedding,
+                         collection_name=collection_name,
+                         connection_args=vector_config.get('connection_args'),
+                         init_state=state)
+
+    def put_milvus_store(self, store: Any, vector_config: Dict):
+        """ 缓存已初始化完成的collection状态 """
+        state = store.export_state()
+        if state is None:
+            return
+        key = (self._config_key(vector_config.get('connection_args')), store.collection_name)
+        self._put(self._milvus_states, key, state)
+
+    def evict_milvus(self, collection_name: str, broadcast: bool = True):
+        """ collection被删除或者重建时清理缓存，broadcast为True时同时通知其他进程 """
+        with self._lock:
+            for key in [one for one in self._milvus_states.keys() if one[1] == collection_name]:
+                self._milvus_states.pop(key, None)
+        if broadcast:
+            self._bump_version()
+
+    def evict_es(self, index_name: str, broadcast: bool = True):
+        """ 索引被删除时清理缓存，broadcast为True时同时通知其他进程 """
+        with self._lock:
+            for key in [one for one in self._es_indexes.keys() if one[1] == index_name]:
+                self._es_indexes.pop(key, None)
+        if broadcast:
+            self._bump_version()
+
+
+vector_store_registry = VectorStoreRegistry()
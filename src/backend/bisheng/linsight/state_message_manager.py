@@ -1,5 +1,5 @@
 import asyncio
-import pickle
+import uuid
 from enum import Enum
 from loguru import logger
 from typing import List, Dict, Any, Optional
@@ -8,7 +8,8 @@ from pydantic import BaseModel, Field
 
 from bisheng.cache.redis import redis_client
 from bisheng.database.models import LinsightExecuteTask
-from bisheng.database.models.linsight_execute_task import ExecuteTaskStatusEnum, LinsightExecuteTaskDao
+from bisheng.database.models.linsight_execute_task import ExecuteTaskStatusEnum, LinsightExecuteTaskDao, \
+    LinsightExecuteTaskStepDao, EXECUTE_TASK_FINISHED_STATUS
 from bisheng.database.models.linsight_session_version import LinsightSessionVersion, LinsightSessionVersionDao
 from bisheng.utils.util import retry_async
 from bisheng_langchain.linsight.event import ExecStep
@@ -72,7 +73,9 @@ class LinsightStateMessageManager:
         self._keys = {
             'session_version_info': f"{self._key_prefix}session_version_info",
             'messages': f"{self._key_prefix}messages",
-            'execution_tasks': f"{self._key_prefix}execution_tasks:"
+            'execution_tasks': f"{self._key_prefix}execution_tasks:",
+            # 每个任务的执行步骤列表，只追加不重写
+            'task_steps': f"{self._key_prefix}task_steps:"
         }
 
     async def _handle_redis_operation(self, operation, *args, **kwargs):
@@ -150,7 +153,7 @@ class LinsightStateMessageManager:
                 # 再写入Redis
                 await pipe.set(
                     self._keys['session_version_info'],
-                    pickle.dumps(session_version_model.model_dump()),
+                    self._redis_client.codec.encode(session_version_model.model_dump()),
                     ex=self.DEFAULT_EXPIRATION
                 )
                 await pipe.execute()
@@ -232,6 +235,14 @@ class LinsightStateMessageManager:
             更新后的任务数据
         """
         try:
+            finished = status in EXECUTE_TASK_FINISHED_STATUS
+            if finished:
+                # 任务结束时才把执行步骤合并写入history字段，以数据库中的步骤为准，redis中的列表可能已过期重建
+                history = await LinsightExecuteTaskStepDao.get_steps([task_id])
+                if history.get(task_id):
+                    task_model = await LinsightExecuteTaskDao.get_by_id(task_id)
+                    kwargs["history"] = (task_model.history or []) + history[task_id]
+
             # 先更新数据库
             task_model = await LinsightExecuteTaskDao.update_by_id(
                 task_id,
@@ -239,6 +250,10 @@ class LinsightStateMessageManager:
                 **kwargs
             )
 
+            if finished and "history" in kwargs:
+                await LinsightExecuteTaskStepDao.delete_steps(task_id)
+                await self._redis_client.adelete(f"{self._keys['task_steps']}{task_id}")
+
             # 再更新Redis
             task_key = f"{self._keys['execution_tasks']}{task_id}"
             task_data = task_model.model_dump()
@@ -250,6 +265,9 @@ class LinsightStateMessageManager:
             )
 
             self._logger.info(f"Updated task {task_id} status to {status}")
+            if not finished:
+                await self._fill_history([task_model])
+                task_data = task_model.model_dump()
             return task_data
 
         except Exception as e:
@@ -269,7 +287,7 @@ class LinsightStateMessageManager:
 
         try:
 
-            task_model = await self.get_execution_task(task_id)
+            task_model = await self.get_execution_task(task_id, with_history=False)
 
             if not task_model:
                 raise ValueError(f"Task with ID {task_id} not found in Redis or database.")
@@ -279,7 +297,8 @@ class LinsightStateMessageManager:
 
             # 使用事务确保数据一致性
             async with self._redis_client.async_pipeline() as pipe:
-                await pipe.set(task_key, pickle.dumps(task_model.model_dump()), ex=self.DEFAULT_EXPIRATION)
+                await pipe.set(task_key, self._redis_client.codec.encode(task_model.model_dump()),
+                               ex=self.DEFAULT_EXPIRATION)
                 await pipe.execute()
 
             # 更新数据库
@@ -296,12 +315,13 @@ class LinsightStateMessageManager:
             raise
 
     @retry_async(num_retries=DEFAULT_RETRY_ATTEMPTS, delay=DEFAULT_RETRY_DELAY)
-    async def get_execution_task(self, task_id: str) -> Optional[LinsightExecuteTask]:
+    async def get_execution_task(self, task_id: str, with_history: bool = True) -> Optional[LinsightExecuteTask]:
         """
         获取执行任务信息
 
         Args:
             task_id: 任务ID
+            with_history: 是否合并未写入history字段的执行步骤
 
         Returns:
             执行任务模型或None
@@ -312,60 +332,102 @@ class LinsightStateMessageManager:
             task_data = await self._redis_client.aget(task_key)
 
             if task_data:
-                return LinsightExecuteTask.model_validate(task_data)
-
-            # 如果Redis中没有数据，从数据库获取
-            task_model = await LinsightExecuteTaskDao.get_by_id(task_id)
-            await self.set_execution_tasks([task_model])
+                task_model = LinsightExecuteTask.model_validate(task_data)
+            else:
+                # 如果Redis中没有数据，从数据库获取
+                task_model = await LinsightExecuteTaskDao.get_by_id(task_id)
+                await self.set_execution_tasks([task_model])
+
+            if with_history:
+                await self._fill_history([task_model])
             return task_model
 
         except Exception as e:
             self._logger.error(f"Failed to get execution task {task_id}: {e}")
             return None
 
-    @retry_async(num_retries=DEFAULT_RETRY_ATTEMPTS, delay=DEFAULT_RETRY_DELAY)
     async def add_execution_task_step(self, task_id: str, step: ExecStep) -> None:
         """
-        添加执行任务步骤
+        添加执行任务步骤，只追加当前步骤，不重写任务的完整历史记录
+        写库和写redis分别重试，步骤的唯一标识在重试之外生成，重试写库时不会重复插入
 
         Args:
             task_id: 任务ID
             step: 执行步骤
         """
-        task_key = f"{self._keys['execution_tasks']}{task_id}"
+        step_key = f"{self._keys['task_steps']}{task_id}"
+        step_data = step.model_dump()
+        step_id = uuid.uuid4().hex
 
         try:
-            task_data = await self.get_execution_task(task_id)
+            await retry_async(num_retries=self.DEFAULT_RETRY_ATTEMPTS, delay=self.DEFAULT_RETRY_DELAY)(
+                LinsightExecuteTaskStepDao.add_step)(task_id, step_id, step_data)
+            await retry_async(num_retries=self.DEFAULT_RETRY_ATTEMPTS, delay=self.DEFAULT_RETRY_DELAY)(
+                self._redis_client.arpush)(step_key, step_data, expiration=self.DEFAULT_EXPIRATION)
 
-            if not task_data:
-                raise ValueError(f"Task with ID {task_id} not found in Redis.")
+            self._logger.info(f"Added step to task {task_id}")
 
-            task_model = LinsightExecuteTask.model_validate(task_data)
+        except Exception as e:
+            self._logger.error(f"Failed to add step to task {task_id}: {e}")
+            raise
 
-            # 初始化历史记录
-            if task_model.history is None:
-                task_model.history = []
+    async def _get_pending_steps(self, task_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        获取还未合并到history字段的执行步骤，数据库中的步骤为准
+        Redis列表和数据库中的步骤数一致时从Redis读取并刷新过期时间，否则从数据库读取并重建Redis列表
 
-            # 添加新步骤
-            task_model.history.append(step.model_dump())
+        Args:
+            task_ids: 任务ID列表
 
-            # 更新Redis和数据库
-            await self._redis_client.aset(
-                task_key,
-                task_model.model_dump(),
-                expiration=self.DEFAULT_EXPIRATION
-            )
+        Returns:
+            任务ID: 步骤列表
+        """
+        result = {}
+        stale_ids = []
+        counts = await LinsightExecuteTaskStepDao.count_steps(task_ids)
+        for task_id, count in counts.items():
+            step_key = f"{self._keys['task_steps']}{task_id}"
+            steps = await self._redis_client.alrange(step_key)
+            if len(steps) == count:
+                result[task_id] = steps
+                await self._redis_client.aexpire_key(step_key, self.DEFAULT_EXPIRATION)
+            else:
+                stale_ids.append(task_id)
+        if stale_ids:
+            db_steps = await LinsightExecuteTaskStepDao.get_steps(stale_ids)
+            result.update(db_steps)
+            for task_id, steps in db_steps.items():
+                await self._rebuild_steps(task_id, steps)
+        return result
+
+    async def _rebuild_steps(self, task_id: str, steps: List[Dict]) -> None:
+        """ 用数据库中的完整步骤重建Redis列表 """
+        step_key = f"{self._keys['task_steps']}{task_id}"
+        try:
+            async with self._redis_client.async_pipeline() as pipe:
+                pipe.delete(step_key)
+                pipe.rpush(step_key, *[self._redis_client.codec.encode(one) for one in steps])
+                pipe.expire(step_key, self.DEFAULT_EXPIRATION)
+                await pipe.execute()
+        except Exception as e:
+            self._logger.warning(f"Failed to rebuild steps of task {task_id}: {e}")
 
-            await LinsightExecuteTaskDao.update_by_id(
-                task_id,
-                history=task_model.history
-            )
+    async def _fill_history(self, tasks: List[LinsightExecuteTask]) -> List[LinsightExecuteTask]:
+        """
+        读取任务时合并出完整的执行步骤记录
 
-            self._logger.info(f"Added step to task {task_id}")
+        Args:
+            tasks: 任务列表
 
-        except Exception as e:
-            self._logger.error(f"Failed to add step to task {task_id}: {e}")
-            raise
+        Returns:
+            任务列表
+        """
+        tasks = [task for task in tasks if task]
+        steps = await self._get_pending_steps([task.id for task in tasks])
+        for task in tasks:
+            if steps.get(task.id):
+                task.history = (task.history or []) + steps[task.id]
+        return tasks
 
     async def get_execution_tasks(self):
         """
@@ -387,7 +449,7 @@ class LinsightStateMessageManager:
             if not tasks:
                 tasks = await LinsightExecuteTaskDao.get_by_session_version_id(
                     session_version_id=self._session_version_id)
-            return tasks
+            return await self._fill_history(tasks)
 
         except Exception as e:
             self._logger.error(f"Failed to get execution tasks: {e}")
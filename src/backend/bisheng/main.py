@@ -14,6 +14,7 @@ from loguru import logger
 from bisheng.api import router, router_rpc
 from bisheng.core.app_context import init_app_context
 from bisheng.database.init_data import init_default_data
+from bisheng.database.message_writer import chat_message_writer
 from bisheng.interface.utils import setup_llm_caching
 from bisheng.services.utils import initialize_services, teardown_services
 from bisheng.settings import settings
@@ -57,6 +58,8 @@ async def lifespan(app: FastAPI):
     yield
     teardown_services()
     thread_pool.tear_down()
+    # 写入还未落库的聊天消息
+    chat_message_writer.close()
 
 
 def create_app():
@@ -1,6 +1,10 @@
+import copy
 import json
 import os
 import re
+import threading
+import time
+import uuid
 from typing import Dict, List, Optional, Union
 
 import yaml
@@ -93,6 +97,37 @@ class ObjectStore(BaseModel):
 class WorkflowConf(BaseModel):
     max_steps: int = Field(default=50, description="节点运行最大步数")
     timeout: int = Field(default=720, description="节点超时时间（min）")
+    memory_cache_size: int = Field(default=32, description="worker内存中保留的暂停workflow数量，超出的只能从快照恢复")
+
+
+class KnowledgeIngestConf(BaseModel):
+    parse_workers: int = Field(default=2, description="文件下载和解析阶段的并发数")
+    embed_workers: int = Field(default=2, description="向量化阶段的并发数")
+    insert_workers: int = Field(default=1, description="写入milvus和es阶段的并发数")
+    queue_size: int = Field(default=2, description="阶段之间缓冲队列的长度")
+    stream_threshold: int = Field(default=2000, description="文件chunk数超过该值时，边向量化边写入milvus，限制内存占用")
+    embed_batch_size: int = Field(default=100, description="边向量化边写入时每批向量化的chunk数")
+
+
+class EmbeddingCacheConf(BaseModel):
+    enabled: bool = Field(default=True, description="是否缓存embedding模型的向量化结果")
+    expiration: int = Field(default=7 * 24 * 3600, description="redis中缓存的过期时间（秒）")
+    local_max_size: int = Field(default=10000, description="进程内LRU缓存的最大条数，0表示不使用进程内缓存")
+    local_expiration: int = Field(default=3600, description="进程内缓存的过期时间（秒）")
+
+
+class KnowledgeChunkBrowseConf(BaseModel):
+    use_pit: bool = Field(default=False, description="翻页时是否使用point in time，保证翻页过程中数据视图一致")
+    pit_keep_alive: str = Field(default="5m", description="point in time的保留时间")
+    total_cache_expiration: int = Field(default=60, description="分块总数的缓存时间（秒）")
+
+
+class RedisCodecConf(BaseModel):
+    enabled: bool = Field(default=False, description="是否使用带版本头的编码写入，关闭时按旧版本的pickle格式写入。"
+                                                     "读取总是兼容两种格式，所有进程升级后再开启")
+    serializer: str = Field(default="pickle", description="缓存值的序列化方式：pickle 或 json")
+    compress_threshold: int = Field(default=16384, description="序列化后超过该字节数时使用zlib压缩，0表示不压缩")
+    compress_level: int = Field(default=1, description="zlib压缩级别")
 
 
 class CeleryConf(BaseModel):
@@ -119,6 +154,98 @@ class LinsightConf(BaseModel):
     waiting_list_url: str = Field(default=None, description='waiting list 跳转链接')
     default_temperature: float = Field(default=0, description='模型请求时的默认温度')
     retry_temperature: float = Field(default=1, description='react模式json解析失败后重试时模型温度')
+    max_concurrency: int = Field(default=3, description='同一会话中同时执行的任务数上限，1表示串行执行')
+    tool_concurrency: int = Field(default=3, description='同一会话中同一个工具同时执行的调用数上限')
+    tool_timeout: int = Field(default=300, description='单次工具调用的超时时间（秒），0表示不限制')
+
+
+# 系统配置的版本号，保存配置时更新，各进程发现版本变化后重新加载配置
+INITDB_CONFIG_VERSION_KEY = 'config:initdb_config:version'
+
+
+class InitDbConfigSnapshot:
+    """
+    进程内的系统配置快照
+    解析后的配置保存在内存中，最多每 check_interval 秒检查一次redis中的配置版本号，
+    版本变化或快照超过 max_age 秒后才重新从数据库加载，读取时返回快照的副本，避免调用方修改快照
+    """
+
+    def __init__(self, check_interval: int = 5, max_age: int = 300):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._config: Optional[dict] = None
+        self._version = None
+        self._loaded_at = 0
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _fresh_snapshot(self, now: float) -> Optional[dict]:
+        if self._config is not None and now - self._checked_at < self.check_interval:
+            return self._config
+        return None
+
+    def _update(self, value: str, version, now: float) -> dict:
+        self._config = yaml.safe_load(value)
+        self._version = version
+        self._loaded_at = now
+        self._checked_at = now
+        return self._config
+
+    def _check_version(self, version, now: float) -> Optional[dict]:
+        """ 版本没有变化并且快照没有超过最大存活时间，继续使用快照 """
+        if self._config is not None and version == self._version and now - self._loaded_at < self.max_age:
+            self._checked_at = now
+            return self._config
+        return None
+
+    def get(self) -> dict:
+        from bisheng.database.base import session_getter
+        from bisheng.cache.redis import redis_client
+        from bisheng.database.models.config import Config
+
+        now = time.monotonic()
+        config = self._fresh_snapshot(now)
+        if config is None:
+            version = redis_client.get(INITDB_CONFIG_VERSION_KEY)
+            config = self._check_version(version, now)
+            if config is None:
+                with self._lock:
+                    with session_getter() as session:
+                        initdb_config = session.exec(
+                            select(Config).where(Config.key == 'initdb_config')).first()
+                    if not initdb_config:
+                        raise Exception('initdb_config not found, please check your system config')
+                    config = self._update(initdb_config.value, version, now)
+        return copy.deepcopy(config)
+
+    async def aget(self) -> dict:
+        from bisheng.database.base import async_session_getter
+        from bisheng.cache.redis import redis_client
+        from bisheng.database.models.config import Config
+
+        now = time.monotonic()
+        config = self._fresh_snapshot(now)
+        if config is None:
+            version = await redis_client.aget(INITDB_CONFIG_VERSION_KEY)
+            config = self._check_version(version, now)
+            if config is None:
+                async with async_session_getter() as session:
+                    initdb_config = (await session.exec(select(Config).where(Config.key == 'initdb_config'))).first()
+                if not initdb_config:
+                    raise Exception('initdb_config not found, please check your system config')
+                config = self._update(initdb_config.value, version, now)
+        return copy.deepcopy(config)
+
+    def invalidate(self):
+        """ 系统配置发生变化，通知所有进程重新加载 """
+        from bisheng.cache.redis import redis_client
+
+        redis_client.set(INITDB_CONFIG_VERSION_KEY, uuid.uuid4().hex, expiration=None)
+        self._config = None
+        logger.debug('initdb config snapshot invalidated')
+
+
+initdb_config_snapshot = InitDbConfigSnapshot()
 
 
 class Settings(BaseModel):
@@ -148,6 +275,7 @@ class Settings(BaseModel):
     redis_url: Optional[Union[str, Dict]] = None
     celery_redis_url: Optional[Union[str, Dict]] = None
     redis: Optional[dict] = None
+    redis_codec: RedisCodecConf = RedisCodecConf()
     admin: dict = {}
     cache: str = 'InMemoryCache'
     remove_api_keys: bool = False
@@ -238,11 +366,26 @@ class Settings(BaseModel):
         return values
 
     def get_knowledge(self):
-        # 由于分布式的要求，可变更的配置存储于mysql，因此读取配置每次从mysql中读取
+        # 由于分布式的要求，可变更的配置存储于mysql，各进程缓存配置快照，配置变更后自动刷新
         all_config = self.get_all_config()
         ret = all_config.get('knowledges', {})
         return ret
 
+    def get_knowledge_ingest_conf(self) -> KnowledgeIngestConf:
+        # 获取知识库文件入库流水线的并发配置
+        ingest_conf = self.get_knowledge().get('ingest', {}) or {}
+        return KnowledgeIngestConf(**ingest_conf)
+
+    def get_embedding_cache_conf(self) -> EmbeddingCacheConf:
+        # 获取embedding缓存的配置
+        cache_conf = self.get_knowledge().get('embedding_cache', {}) or {}
+        return EmbeddingCacheConf(**cache_conf)
+
+    def get_knowledge_chunk_browse_conf(self) -> KnowledgeChunkBrowseConf:
+        # 获取知识库分块浏览的翻页配置
+        browse_conf = self.get_knowledge().get('chunk_browse', {}) or {}
+        return KnowledgeChunkBrowseConf(**browse_conf)
+
     def get_minio_conf(self) -> MinioConf:
         return self.object_storage.minio
 
@@ -250,7 +393,7 @@ class Settings(BaseModel):
         return self.vector_stores
 
     def get_default_llm(self):
-        # 由于分布式的要求，可变更的配置存储于mysql，因此读取配置每次从mysql中读取
+        # 由于分布式的要求，可变更的配置存储于mysql，各进程缓存配置快照，配置变更后自动刷新
         all_config = self.get_all_config()
         return all_config.get('default_llm', {})
 
@@ -286,41 +429,11 @@ class Settings(BaseModel):
         return all_config.get(key, {})
 
     def get_all_config(self):
-        from bisheng.database.base import session_getter
-        from bisheng.cache.redis import redis_client
-        from bisheng.database.models.config import Config
-
-        redis_key = 'config:initdb_config'
-        cache = redis_client.get(redis_key)
-        if cache:
-            return yaml.safe_load(cache)
-        else:
-            with session_getter() as session:
-                initdb_config = session.exec(
-                    select(Config).where(Config.key == 'initdb_config')).first()
-                if initdb_config:
-                    redis_client.set(redis_key, initdb_config.value, 100)
-                    return yaml.safe_load(initdb_config.value)
-                else:
-                    raise Exception('initdb_config not found, please check your system config')
+        # 读取进程内的配置快照，配置保存后由版本号通知各进程刷新
+        return initdb_config_snapshot.get()
 
     async def aget_all_config(self):
-        from bisheng.database.base import async_session_getter
-        from bisheng.cache.redis import redis_client
-        from bisheng.database.models.config import Config
-
-        redis_key = 'config:initdb_config'
-        cache = await redis_client.aget(redis_key)
-        if cache:
-            return yaml.safe_load(cache)
-        else:
-            async with async_session_getter() as session:
-                initdb_config = (await session.exec(select(Config).where(Config.key == 'initdb_config'))).first()
-                if initdb_config:
-                    await redis_client.aset(redis_key, initdb_config.value, 100)
-                    return yaml.safe_load(initdb_config.value)
-                else:
-                    raise Exception('initdb_config not found, please check your system config')
+        return await initdb_config_snapshot.aget()
 
     def update_from_yaml(self, file_path: str, dev: bool = False):
         new_settings = load_settings_from_yaml(file_path)
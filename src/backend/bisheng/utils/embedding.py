@@ -1,8 +1,8 @@
 from langchain.embeddings.base import Embeddings
 
 
-def decide_embeddings(model: str) -> Embeddings:
+def decide_embeddings(model: str, **kwargs) -> Embeddings:
     """ embed method """
     from bisheng.api.services.llm import LLMService
 
-    return LLMService.get_bisheng_embedding(model_id=model)
+    return LLMService.get_bisheng_embedding(model_id=model, **kwargs)
@@ -0,0 +1,110 @@
+import contextvars
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from loguru import logger
+
+# 阶段之间传递的结束标记
+_STOP = object()
+
+
+@dataclass
+class PipelineStage:
+    """ 流水线中的一个处理阶段 """
+    name: str
+    # 处理函数，入参为上一阶段的输出，返回值交给下一阶段
+    handler: Callable[[Any], Any]
+    # 该阶段并发处理的线程数
+    workers: int = 1
+
+
+@dataclass
+class PipelineResult:
+    """ 单个元素流经所有阶段后的结果 """
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+    # 出错的阶段名称
+    failed_stage: Optional[str] = None
+
+
+class StagePipeline:
+    """
+    多阶段流水线：每个阶段有独立的并发线程数，阶段之间通过有界队列衔接。
+    不同元素可以同时处于不同阶段，某个元素在某一阶段出错后会跳过后续阶段，直接输出结果。
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 2, name: str = 'pipeline'):
+        if not stages:
+            raise ValueError('pipeline stages is empty')
+        self.stages = stages
+        self.queue_size = max(queue_size, 1)
+        self.name = name
+
+    def run(self, items: Iterable[Any]) -> Iterator[PipelineResult]:
+        """ 启动流水线，按完成顺序依次返回每个元素的处理结果 """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # 最后一个阶段的输出由调用方消费，不做限制，避免调用方处理慢时阻塞流水线
+        queues.append(queue.Queue())
+
+        threads = [self._start_thread(f'{self.name}-feeder', self._feed, items, queues[0])]
+        for index, stage in enumerate(self.stages):
+            workers = max(stage.workers, 1)
+            next_workers = max(self.stages[index + 1].workers, 1) if index + 1 < len(self.stages) else 1
+            remain = {'count': workers}
+            lock = threading.Lock()
+            for i in range(workers):
+                threads.append(
+                    self._start_thread(f'{self.name}-{stage.name}-{i}', self._work, stage, queues[index],
+                                       queues[index + 1], remain, lock, next_workers))
+
+        while True:
+            result = queues[-1].get()
+            if result is _STOP:
+                break
+            yield result
+
+        for one in threads:
+            one.join()
+
+    @staticmethod
+    def _start_thread(name: str, target: Callable, *args) -> threading.Thread:
+        # 每个线程使用独立的上下文副本，保证trace_id等上下文信息在日志中延续
+        ctx = contextvars.copy_context()
+        thread = threading.Thread(target=ctx.run, args=(target, *args), name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _feed(self, items: Iterable[Any], out_queue: queue.Queue):
+        try:
+            for item in items:
+                out_queue.put(PipelineResult(item=item, value=item))
+        finally:
+            for _ in range(max(self.stages[0].workers, 1)):
+                out_queue.put(_STOP)
+
+    @staticmethod
+    def _work(stage: PipelineStage, in_queue: queue.Queue, out_queue: queue.Queue, remain: dict,
+              lock: threading.Lock, next_workers: int):
+        while True:
+            job = in_queue.get()
+            if job is _STOP:
+                break
+            if job.error is None:
+                try:
+                    job.value = stage.handler(job.value)
+                except Exception as e:
+                    logger.exception(f'pipeline_stage_error stage={stage.name}')
+                    job.error = e
+                    job.failed_stage = stage.name
+            out_queue.put(job)
+
+        # 本阶段最后一个退出的线程负责通知下一阶段结束
+        with lock:
+            remain['count'] -= 1
+            is_last = remain['count'] == 0
+        if is_last:
+            for _ in range(next_workers):
+                out_queue.put(_STOP)
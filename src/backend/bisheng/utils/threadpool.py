@@ -1,117 +1,206 @@
 import asyncio
+import bisect
 import concurrent.futures
 import threading
 import time
-from typing import Dict, List, Set, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 
 from loguru import logger
 
 
+class TaskHistogram:
+    """ 耗时直方图，桶的上界单位为秒 """
+    buckets = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        # 和prometheus一致，每个桶为小于等于上界的累计数量
+        buckets = {}
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return {'count': self.count, 'sum': round(self.sum, 4), 'buckets': buckets}
+
+
+class TaskStats:
+    """ 按key统计任务的排队耗时和执行耗时，只保留最近的max_keys个key """
+
+    def __init__(self, max_keys: int = 1024):
+        self.max_keys = max_keys
+        self._stats: OrderedDict[str, Dict[str, TaskHistogram]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, key: str, queue_wait: float, run_time: float):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = {'queue_wait': TaskHistogram(), 'run_time': TaskHistogram()}
+                self._stats[key] = stats
+                while len(self._stats) > self.max_keys:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(key)
+            stats['queue_wait'].observe(queue_wait)
+            stats['run_time'].observe(run_time)
+
+    def get(self, key: Optional[str] = None) -> Dict[str, dict]:
+        with self._lock:
+            keys = [key] if key is not None else list(self._stats.keys())
+            return {
+                one: {name: histogram.to_dict() for name, histogram in self._stats[one].items()}
+                for one in keys if one in self._stats
+            }
+
+
+class EventLoopThread:
+    """ 长期运行的事件循环线程 """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        # 正在执行的协程数，用来选择负载最小的事件循环
+        self.pending = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
 class ThreadPoolManager:
 
-    def __init__(self, max_workers, thread_name_prefix='pool'):
+    def __init__(self, max_workers, thread_name_prefix='pool', loop_workers: int = None):
         self.thread_group = thread_name_prefix
         self.executor = concurrent.futures.ThreadPoolExecutor(
             max_workers=max_workers, thread_name_prefix=thread_name_prefix)
-        # 设计每个同步线程配备一个协程
+        # 协程任务在固定数量的事件循环线程中执行，首次提交协程时创建
+        self.loop_workers = loop_workers or max_workers
+        self.loop_threads: List[EventLoopThread] = []
+        self.loop_lock = threading.Lock()
+
         self.future_dict: Dict[str, List[concurrent.futures.Future]] = {}
         self.async_task: Dict[str, List[concurrent.futures.Future]] = {}
         self.lock = threading.Lock()
-
-    def fake_task_for_skip_first_thread(self):
-        """因为异步函数提交会不占用线程时间，导致任务堆积到某个线程上"""
-        time.sleep(1)
+        self.task_stats = TaskStats()
 
     def submit(self, key: str, fn, *args, **kwargs):
+        submit_time = time.time()
         with self.lock:
             if key not in self.future_dict:
                 self.future_dict[key] = []
             if key not in self.async_task:
                 self.async_task[key] = []
             if asyncio.coroutines.iscoroutinefunction(fn):
-                self.executor.submit(self.fake_task_for_skip_first_thread)
-                future = self.executor.submit(self.run_in_event_loop, fn, *args, **kwargs)
+                future = self.submit_coroutine(key, submit_time, fn, *args, **kwargs)
                 self.async_task[key].append(future)
             else:
-                future = self.executor.submit(self.context_wrapper, fn, *args, **kwargs)
+                future = self.executor.submit(self.context_wrapper, key, submit_time, fn, *args, **kwargs)
                 self.future_dict[key].append(future)
             return future
 
-    def context_wrapper(self, func, *args, **kwargs):
+    def context_wrapper(self, key: str, submit_time: float, func, *args, **kwargs):
         trace_id = kwargs.pop('trace_id', '2')
-        start_wait = time.time()
+        start_time = time.time()
         with logger.contextualize(trace_id=trace_id):
-            result = func(*args, **kwargs)
-            end_wait = time.time()  # Time when the task actually started
-            logger.info(
-                f'Task_waited={end_wait - start_wait:.2f} seconds and executed={time.time() - end_wait:.2f} seconds',
-            )
-            return result
-
-    def run_in_event_loop(self, coro, *args, **kwargs) -> concurrent.futures.Future:
-        try:
-            loop = asyncio.get_running_loop()
-            logger.info('event loop {}', loop)
-        except Exception:
-            loop = asyncio.new_event_loop()
-            thread_event = threading.Thread(target=self.start_loop, args=(loop, ))
-            thread_event.start()
-            logger.info('Creating new event loop {}', loop)
-        asyncio.set_event_loop(loop)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record_task(key, submit_time, start_time)
+
+    def record_task(self, key: str, submit_time: float, start_time: float):
+        end_time = time.time()
+        self.task_stats.record(key, start_time - submit_time, end_time - start_time)
+        logger.info(f'Task_waited={start_time - submit_time:.2f} seconds and '
+                    f'executed={end_time - start_time:.2f} seconds')
+
+    def select_loop_thread(self) -> EventLoopThread:
+        """ 选择正在执行的协程数最少的事件循环 """
+        with self.loop_lock:
+            if not self.loop_threads:
+                self.loop_threads = [
+                    EventLoopThread(f'{self.thread_group}_loop_{i}') for i in range(self.loop_workers)
+                ]
+            loop_thread = min(self.loop_threads, key=lambda one: one.pending)
+            loop_thread.pending += 1
+            return loop_thread
+
+    def release_loop_thread(self, loop_thread: EventLoopThread):
+        with self.loop_lock:
+            loop_thread.pending -= 1
+
+    def submit_coroutine(self, key: str, submit_time: float, coro, *args, **kwargs) -> concurrent.futures.Future:
+        loop_thread = self.select_loop_thread()
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_coroutine(key, submit_time, coro, *args, **kwargs), loop_thread.loop)
+        future.add_done_callback(lambda _: self.release_loop_thread(loop_thread))
+        logger.info('async_task_added fun={} args={} loop={}', coro.__name__, args[0] if args else '',
+                    loop_thread.name)
+        return future
+
+    async def run_coroutine(self, key: str, submit_time: float, coro, *args, **kwargs):
         trace_id = kwargs.pop('trace_id', '2')
+        start_time = time.time()
         with logger.contextualize(trace_id=trace_id):
-            future = asyncio.run_coroutine_threadsafe(coro(*args, **kwargs), loop)
-            # result = loop.run_until_complete(coro(*args, **kwargs))
-            # 压力大的时候，会创建更多线程，从而更多事件队列
-            time.sleep(1)
-            logger.info('async_task_added fun={} args={}', coro.__name__, args[0] if args else '')
-            return future
+            try:
+                return await coro(*args, **kwargs)
+            finally:
+                self.record_task(key, submit_time, start_time)
 
-    def start_loop(self, loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
+    def get_task_stats(self, key: str = None) -> Dict[str, dict]:
+        """ 获取任务排队耗时和执行耗时的直方图，key为空时返回所有key """
+        return self.task_stats.get(key)
 
     async def as_completed(self,
                            key_list: Set[str]) -> List[Tuple[str, concurrent.futures.Future]]:
         with self.lock:
             completed_futures = []
             for k, lf in list(self.future_dict.items()):
-                for f in lf:
+                for f in list(lf):
                     if f.done():
                         if k in key_list:
                             completed_futures.append((k, f))
-                            self.future_dict[k].remove(f)
+                            lf.remove(f)
                 if len(lf) == 0:
                     self.future_dict.pop(k)
 
             pending_count = 0
             for k, lf in list(self.async_task.items()):
-                for f in lf:
+                for f in list(lf):
                     if f.done():
-                        # 获取task
-                        task = f.result()
-                        if task.done():
-                            if k in key_list:
-                                completed_futures.append((k, task))
-                                self.async_task[k].remove(f)
-                        else:
-                            pending_count += 1
+                        if k in key_list:
+                            completed_futures.append((k, f))
+                            lf.remove(f)
+                    else:
+                        pending_count += 1
                 if len(lf) == 0:
                     self.async_task.pop(k)
             if pending_count > 0:
                 logger.info('async_wait_count={}', pending_count)
             return completed_futures
 
-    # async def async_done_callback(self, future):
-    #     self.async_task_result.append(future)
-
     def cancel_task(self, key_list: List[str]):
         res = [False] * len(key_list)
         with self.lock:
             for index, key in enumerate(key_list):
                 if self.async_task.get(key):
                     for task in self.async_task.get(key):
-                        cancel_res = task.result().cancel()
+                        # 会同时取消事件循环中对应的协程
+                        cancel_res = task.cancel()
                         logger.info('clean_pending_task key={} task={} res={}', key, task,
                                     cancel_res)
                         res[index] = cancel_res
@@ -124,6 +213,10 @@ class ThreadPoolManager:
         key_list = list(self.async_task.keys())
         self.cancel_task(key_list)
         self.executor.shutdown(cancel_futures=True)
+        with self.loop_lock:
+            for one in self.loop_threads:
+                one.stop()
+            self.loop_threads = []
 
 
 # 创建一个线程池管理器
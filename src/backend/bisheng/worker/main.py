@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 from bisheng.core.app_context import app_ctx
 from bisheng.settings import settings
@@ -10,3 +11,10 @@ configure(settings.logger_conf)
 # loop = app_ctx.get_event_loop()
 bisheng_celery = Celery('bisheng', include=['bisheng.worker'])
 bisheng_celery.config_from_object('bisheng.worker.config')
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    # prefork的子进程退出时不会执行atexit，需要主动写入还未落库的聊天消息
+    from bisheng.database.message_writer import chat_message_writer
+    chat_message_writer.close()
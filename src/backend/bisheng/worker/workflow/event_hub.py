@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import uuid
+from typing import Dict, List
+
+from loguru import logger
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+
+from bisheng.cache.redis import redis_client
+
+
+class _LoopListener:
+    """ 单个事件循环内的监听状态，只在所属的事件循环中访问 """
+
+    def __init__(self, hub: 'WorkflowEventHub', loop: asyncio.AbstractEventLoop):
+        self.hub = hub
+        self.loop = loop
+        # 新的会话开始等待时，通过这个事件流打断正在阻塞的XREAD
+        self.wake_key = f'workflow:event_hub:{uuid.uuid4().hex}'
+        self.wake_id = '0-0'
+        # stream_key: [waiter]
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.has_waiter = asyncio.Event()
+        # 正在阻塞读取的事件流
+        self.reading_keys: set = set()
+        self.task = loop.create_task(self.listen())
+
+    async def wait(self, stream_key: str, timeout: float) -> bool:
+        waiter = self.loop.create_future()
+        self.waiters.setdefault(stream_key, []).append(waiter)
+        self.has_waiter.set()
+        if stream_key not in self.reading_keys and self.reading_keys:
+            try:
+                await redis_client.axadd(self.wake_key, {'key': stream_key}, maxlen=10, expiration=60)
+            except Exception as e:
+                logger.warning(f'workflow event hub wake error: {e}')
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self.waiters.get(stream_key)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    self.waiters.pop(stream_key, None)
+
+    def notify(self, stream_key: str):
+        for waiter in self.waiters.pop(stream_key, []):
+            if not waiter.done():
+                waiter.set_result(True)
+
+    async def listen(self):
+        while True:
+            if not self.waiters:
+                # 没有等待中的会话时不访问redis
+                self.has_waiter.clear()
+                await self.has_waiter.wait()
+                continue
+            streams = {key: '0-0' for key in self.waiters.keys()}
+            self.reading_keys = set(streams.keys())
+            streams[self.wake_key] = self.wake_id
+            try:
+                ret = await redis_client.axread(streams, count=1, block=self.hub.block_ms)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'workflow event hub xread error: {e}')
+                await asyncio.sleep(1)
+                continue
+            finally:
+                self.reading_keys = set()
+            for key, entries in ret or []:
+                key = self.hub.decode_key(key)
+                if key == self.wake_key:
+                    if entries:
+                        self.wake_id = entries[-1][0]
+                    continue
+                self.notify(key)
+
+
+class WorkflowEventHub:
+    """
+    进程内共享的workflow事件监听
+    每个事件循环一个监听任务，循环内所有等待中的会话共用一个 XREAD BLOCK 请求，
+    任意会话的事件流有未消费的数据时唤醒对应的会话。
+    等待方和监听任务在同一个事件循环中，唤醒时不跨线程操作future。
+    会话读取事件后会删除已消费的数据，所以对每个事件流都从 0-0 开始读，
+    有剩余数据就立即返回，不会漏掉唤醒。
+    """
+
+    def __init__(self, block_ms: int = 5000):
+        self.block_ms = block_ms
+        # event loop: listener
+        self._listeners: Dict[asyncio.AbstractEventLoop, _LoopListener] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_cluster() -> bool:
+        # 集群模式下不同的key分布在不同的slot，不能合并成一个XREAD请求
+        return isinstance(redis_client.async_block_connection, AsyncRedisCluster)
+
+    @staticmethod
+    def decode_key(key) -> str:
+        return key.decode('utf-8') if isinstance(key, bytes) else key
+
+    def _get_listener(self) -> _LoopListener:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # 清理已经关闭的事件循环的监听状态
+            for one in [one for one in self._listeners if one.is_closed()]:
+                self._listeners.pop(one, None)
+            listener = self._listeners.get(loop)
+            if listener is None or listener.task.done():
+                listener = _LoopListener(self, loop)
+                self._listeners[loop] = listener
+            return listener
+
+    async def wait(self, stream_key: str, timeout: float) -> bool:
+        """ 等待事件流有未消费的数据，返回是否被唤醒，超时返回False """
+        if self._is_cluster():
+            ret = await redis_client.axread({stream_key: '0-0'}, count=1, block=int(timeout * 1000))
+            return bool(ret)
+        return await self._get_listener().wait(stream_key, timeout)
+
+
+workflow_event_hub = WorkflowEventHub()
@@ -1,9 +1,8 @@
-import asyncio
 import json
 import os
 import time
 import uuid
-from typing import AsyncIterator
+from typing import AsyncIterator, List, Tuple
 
 from cachetools import TTLCache
 from langchain_core.documents import Document
@@ -15,10 +14,12 @@ from bisheng.api.v1.schema.workflow import WorkflowEventType
 from bisheng.api.v1.schemas import ChatResponse
 from bisheng.cache.redis import redis_client
 from bisheng.chat.utils import sync_judge_source, sync_process_source_document
+from bisheng.database.message_writer import chat_message_writer
 from bisheng.database.models.flow import FlowDao, FlowType
 from bisheng.database.models.message import ChatMessageDao, ChatMessage
 from bisheng.database.models.session import MessageSessionDao, MessageSession
 from bisheng.settings import settings
+from bisheng.worker.workflow.event_hub import workflow_event_hub
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeStartData, NodeEndData, UserInputData, GuideWordData, GuideQuestionData, \
     OutputMsgData, StreamMsgData, StreamMsgOverData, OutputMsgChooseData, OutputMsgInputData
@@ -44,12 +45,18 @@ class RedisCallback(BaseCallback):
         self.redis_client = redis_client
         self.workflow_data_key = f'workflow:{unique_id}:data'
         self.workflow_status_key = f'workflow:{unique_id}:status'
-        self.workflow_event_key = f'workflow:{unique_id}:event'
+        # 事件使用redis stream推送，消费方通过 XREAD BLOCK 等待新事件
+        self.workflow_event_key = f'workflow:{unique_id}:event_stream'
+        # 旧版本使用list存储事件，升级时已经在运行的会话仍会写入旧的key，兼容读取一个版本
+        self.legacy_workflow_event_key = f'workflow:{unique_id}:event'
+        self.has_legacy_event = False
         self.workflow_input_key = f'workflow:{unique_id}:input'
         self.workflow_stop_key = f'workflow:{unique_id}:stop'
         self.workflow_expire_time = settings.get_workflow_conf().timeout * 60 + 60
 
     def set_workflow_data(self, data: dict):
+        # 新的一次运行，清理上次运行残留的停止信号
+        self.redis_client.delete(self.workflow_stop_key)
         self.redis_client.set(self.workflow_data_key, data, expiration=self.workflow_expire_time)
 
     def get_workflow_data(self) -> dict:
@@ -60,10 +67,15 @@ class RedisCallback(BaseCallback):
                               {'status': status, 'reason': reason, 'time': time.time()},
                               expiration=None)
         self.workflow_cache.clear()
+        # 状态变化前确保产生的消息都已经写入数据库
+        chat_message_writer.flush()
+        # 通知等待中的消费方状态有变化
+        self.redis_client.xadd(self.workflow_event_key, {'type': 'status'}, expiration=self.workflow_expire_time)
         if status in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
             # 消息事件和状态key可能还需要消费
             self.redis_client.delete(self.workflow_data_key)
             self.redis_client.delete(self.workflow_input_key)
+            self.redis_client.delete(self.workflow_stop_key)
 
     def get_workflow_status(self, user_cache: bool = True) -> dict | None:
         # if user_cache and self.workflow_cache.get(self.workflow_status_key):
@@ -72,26 +84,65 @@ class RedisCallback(BaseCallback):
         self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
         return workflow_status
 
+    async def aget_workflow_status(self) -> dict | None:
+        workflow_status = await self.redis_client.aget(self.workflow_status_key)
+        self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
+        return workflow_status
+
     def clear_workflow_status(self):
         self.redis_client.delete(self.workflow_status_key)
         self.redis_client.delete(self.workflow_stop_key)
         self.redis_client.delete(self.workflow_data_key)
 
     def insert_workflow_response(self, event: dict):
-        self.redis_client.rpush(self.workflow_event_key, json.dumps(event), expiration=self.workflow_expire_time)
-
-    def get_workflow_response(self) -> ChatResponse | None:
-        response = self.redis_client.lpop(self.workflow_event_key)
-        if response:
-            response = ChatResponse(**json.loads(response))
-            if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
-                 and response.message and response.message.get('node_id', '').startswith('end_')) or
-                    (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
-                        , WorkflowEventType.OutputWithInput.value])):
-                # 如果是结束节点或者输入事件，清空状态缓存
-                self.workflow_cache.clear()
+        self.redis_client.xadd(self.workflow_event_key, {'type': 'event', 'data': json.dumps(event)},
+                               expiration=self.workflow_expire_time)
+
+    def parse_workflow_response(self, data) -> ChatResponse:
+        response = ChatResponse(**json.loads(data))
+        if ((response.category == WorkflowEventType.NodeRun.value and response.type == 'end'
+             and response.message and response.message.get('node_id', '').startswith('end_')) or
+                (response.category in [WorkflowEventType.UserInput.value, WorkflowEventType.OutputWithChoose.value
+                    , WorkflowEventType.OutputWithInput.value])):
+            # 如果是结束节点或者输入事件，清空状态缓存
+            self.workflow_cache.clear()
         return response
 
+    async def get_workflow_responses(self, count: int = 100) -> Tuple[bool, List[ChatResponse]]:
+        """
+        按顺序读取并删除未消费的事件，返回 (是否消费了数据, 事件列表)
+        状态变化的通知只用来唤醒，不返回，只有状态通知时事件列表为空但是消费标记为True
+        """
+        # 旧版本写入的事件一定早于新版本，先读取
+        async with self.redis_client.async_pipeline() as pipe:
+            pipe.lrange(self.legacy_workflow_event_key, 0, count - 1)
+            pipe.ltrim(self.legacy_workflow_event_key, count, -1)
+            legacy_events, _ = await pipe.execute()
+        if legacy_events:
+            self.has_legacy_event = True
+            return True, [self.parse_workflow_response(one) for one in legacy_events]
+
+        entries = await self.redis_client.axrange(self.workflow_event_key, count=count)
+        if not entries:
+            return False, []
+        await self.redis_client.axdel(self.workflow_event_key, *[entry_id for entry_id, _ in entries])
+        ret = []
+        for _, fields in entries:
+            data = fields.get(b'data', fields.get('data'))
+            if not data:
+                continue
+            ret.append(self.parse_workflow_response(data))
+        return True, ret
+
+    async def drain_workflow_responses(self) -> AsyncIterator[ChatResponse]:
+        """ 读取所有未消费的事件 """
+        while True:
+            consumed, responses = await self.get_workflow_responses()
+            if not consumed:
+                break
+            for one in responses:
+                yield one
+
     def build_chat_response(self, category, category_type, message, extra=None, files=None):
         return ChatResponse(
             user_id=self.user_id,
@@ -130,16 +181,13 @@ class RedisCallback(BaseCallback):
         """ 不断获取workflow的response，直到遇到运行结束或者待输入 """
         while True:
             # get workflow status
-            status_info = self.get_workflow_status()
+            status_info = await self.aget_workflow_status()
             if not status_info:
                 yield self.build_chat_response(WorkflowEventType.Error.value, 'over',
                                                {'code': 500, 'message': 'workflow status not found'})
                 break
             elif status_info['status'] in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
+                async for chat_response in self.drain_workflow_responses():
                     yield chat_response
                 if status_info['status'] == WorkflowStatus.FAILED.value:
                     error_resp = self.parse_workflow_failed(status_info)
@@ -147,10 +195,7 @@ class RedisCallback(BaseCallback):
                         yield error_resp
                 break
             elif status_info['status'] == WorkflowStatus.INPUT.value:
-                while True:
-                    chat_response = self.get_workflow_response()
-                    if not chat_response:
-                        break
+                async for chat_response in self.drain_workflow_responses():
                     yield chat_response
                 break
             elif status_info['status'] in [WorkflowStatus.WAITING.value,
@@ -168,11 +213,15 @@ class RedisCallback(BaseCallback):
                 self.set_workflow_stop()
                 break
             else:
-                chat_response = self.get_workflow_response()
-                if not chat_response:
-                    await asyncio.sleep(1)
+                consumed, chat_responses = await self.get_workflow_responses()
+                if not consumed:
+                    # 等待新的事件或者状态变化，超时后重新检查状态
+                    # 旧版本的worker写入事件时不会唤醒等待方，按旧版本的间隔轮询
+                    await workflow_event_hub.wait(self.workflow_event_key, timeout=1 if self.has_legacy_event else 5)
                     continue
-                yield chat_response
+                # 只消费了状态变化的通知时，事件列表为空，直接回到开头检查最新状态
+                for chat_response in chat_responses:
+                    yield chat_response
 
     def set_user_input(self, data: dict, message_id: int = None, message_content: str = None):
         if self.chat_id and message_id:
@@ -226,6 +275,13 @@ class RedisCallback(BaseCallback):
         from bisheng.worker.workflow.tasks import stop_workflow
         stop_workflow.delay(self.unique_id, self.workflow_id, self.chat_id, self.user_id)
 
+    def set_workflow_stop_signal(self):
+        """ 通知正在执行workflow的worker停止，执行方在发送事件时检查，停止后由执行方更新最终状态 """
+        self.redis_client.set(self.workflow_stop_key, 1, expiration=self.workflow_expire_time)
+
+    def clear_workflow_stop_signal(self):
+        self.redis_client.delete(self.workflow_stop_key)
+
     def get_workflow_stop(self) -> bool | None:
         """ 为了可以及时停止workflow，不做内存的缓存 """
         return self.redis_client.get(self.workflow_stop_key) == 1
@@ -258,7 +314,8 @@ class RedisCallback(BaseCallback):
             chat_response.source = source
             chat_response.extra = json.dumps(extra, ensure_ascii=False)
 
-        message = ChatMessageDao.insert_one(ChatMessage(
+        # 异步批量写入数据库，消息id预先分配
+        message = chat_message_writer.add(ChatMessage(
             user_id=self.user_id,
             chat_id=self.chat_id,
             flow_id=self.workflow_id,
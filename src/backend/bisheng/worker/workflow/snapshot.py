@@ -0,0 +1,57 @@
+import abc
+from typing import Optional
+
+from bisheng.cache.redis import redis_client
+
+
+class WorkflowSnapshotStore(abc.ABC):
+    """ 暂停等待用户输入的workflow快照存储 """
+
+    @abc.abstractmethod
+    def save(self, unique_id: str, version: str, snapshot: dict, expiration: int):
+        """ 保存快照，version 快照的版本号，expiration 过期时间（秒） """
+
+    @abc.abstractmethod
+    def load(self, unique_id: str) -> Optional[dict]:
+        """ 获取快照，返回 {'version': 版本号, 'snapshot': 快照}，不存在返回None """
+
+    @abc.abstractmethod
+    def get_version(self, unique_id: str) -> Optional[str]:
+        """ 获取最新快照的版本号，用来判断进程内缓存的对象是否过期，不存在返回None """
+
+    @abc.abstractmethod
+    def delete(self, unique_id: str):
+        """ 删除快照 """
+
+
+class RedisWorkflowSnapshotStore(WorkflowSnapshotStore):
+
+    def __init__(self):
+        self.redis_client = redis_client
+
+    @staticmethod
+    def _key(unique_id: str) -> str:
+        return f'workflow:{unique_id}:snapshot'
+
+    @staticmethod
+    def _version_key(unique_id: str) -> str:
+        return f'workflow:{unique_id}:snapshot_version'
+
+    def save(self, unique_id: str, version: str, snapshot: dict, expiration: int):
+        # 先写快照再写版本号，读到新版本号时快照一定已经写入
+        self.redis_client.set(self._key(unique_id), {'version': version, 'snapshot': snapshot},
+                              expiration=expiration)
+        self.redis_client.set(self._version_key(unique_id), version, expiration=expiration)
+
+    def load(self, unique_id: str) -> Optional[dict]:
+        return self.redis_client.get(self._key(unique_id))
+
+    def get_version(self, unique_id: str) -> Optional[str]:
+        return self.redis_client.get(self._version_key(unique_id))
+
+    def delete(self, unique_id: str):
+        self.redis_client.delete(self._version_key(unique_id))
+        self.redis_client.delete(self._key(unique_id))
+
+
+workflow_snapshot_store: WorkflowSnapshotStore = RedisWorkflowSnapshotStore()
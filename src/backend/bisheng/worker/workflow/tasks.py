@@ -1,23 +1,61 @@
+import uuid
+
+from cachetools import LRUCache
 from loguru import logger
 
 from bisheng.settings import settings
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.worker.main import bisheng_celery
 from bisheng.worker.workflow.redis_callback import RedisCallback
+from bisheng.worker.workflow.snapshot import workflow_snapshot_store
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.graph.workflow import Workflow
 
-# 存储全局的工作流对象
-_global_workflow: dict[str, Workflow] = {}
+# 暂停等待输入的工作流对象，只作为本进程内的快速路径，完整状态以快照为准
+# unique_id: (快照版本号, Workflow)
+_global_workflow: LRUCache = LRUCache(maxsize=max(settings.get_workflow_conf().memory_cache_size, 1))
 
 
 def _clear_workflow_obj(unique_id: str):
-    """ 清除全局工作流对象 """
+    """ 清除全局工作流对象和快照 """
+    workflow_snapshot_store.delete(unique_id)
     if unique_id in _global_workflow:
         del _global_workflow[unique_id]
         logger.debug(f'clear workflow object for unique_id: {unique_id}')
     else:
-        logger.warning(f'workflow object not found for unique_id: {unique_id}')
+        logger.debug(f'workflow object not in memory for unique_id: {unique_id}')
+
+
+def _save_workflow_obj(redis_callback: RedisCallback, workflow: Workflow):
+    """ 保存暂停的工作流快照，任意worker都可以从快照恢复执行 """
+    version = uuid.uuid4().hex
+    workflow_snapshot_store.save(redis_callback.unique_id, version, workflow.dump_snapshot(),
+                                 redis_callback.workflow_expire_time)
+    _global_workflow[redis_callback.unique_id] = (version, workflow)
+
+
+def _load_workflow_obj(redis_callback: RedisCallback) -> Workflow | None:
+    """ 优先使用内存中的工作流对象，不存在或者已经在其他进程继续执行过则根据快照重新构建 """
+    version = workflow_snapshot_store.get_version(redis_callback.unique_id)
+    if not version:
+        return None
+    cached = _global_workflow.get(redis_callback.unique_id, None)
+    if cached and cached[0] == version:
+        return cached[1]
+    snapshot = workflow_snapshot_store.load(redis_callback.unique_id)
+    if not snapshot:
+        return None
+    workflow_data = redis_callback.get_workflow_data()
+    if not workflow_data:
+        return None
+    workflow_conf = settings.get_workflow_conf()
+    workflow = Workflow(redis_callback.workflow_id, redis_callback.user_id, workflow_data, False,
+                        workflow_conf.max_steps,
+                        workflow_conf.timeout,
+                        redis_callback)
+    workflow.load_snapshot(snapshot['snapshot'])
+    logger.debug(f'restore workflow object from snapshot for unique_id: {redis_callback.unique_id}')
+    return workflow
 
 
 def _judge_workflow_status(redis_callback: RedisCallback, workflow: Workflow):
@@ -28,9 +66,8 @@ def _judge_workflow_status(redis_callback: RedisCallback, workflow: Workflow):
         _clear_workflow_obj(redis_callback.unique_id)
         return
     if workflow.status() == WorkflowStatus.INPUT.value:
-        # 如果是输入状态，将对象放到内存中
-        _global_workflow[redis_callback.unique_id] = workflow
-        # redis_callback.save_workflow_object(workflow)
+        # 如果是输入状态，保存快照，同时将对象放到内存中
+        _save_workflow_obj(redis_callback, workflow)
         redis_callback.set_workflow_status(status, reason)
         return
     logger.error(f'unexpected workflow status error: {status}')
@@ -56,6 +93,8 @@ def _execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: s
                             workflow_conf.timeout,
                             redis_callback)
         redis_callback.workflow = workflow
+        if redis_callback.get_workflow_stop():
+            raise IgnoreException('workflow stop by user')
         status, reason = workflow.run()
         _judge_workflow_status(redis_callback, workflow)
     except IgnoreException as e:
@@ -79,11 +118,14 @@ def _continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id:
     """ 继续执行workflow """
     redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
     try:
-        workflow = _global_workflow.get(redis_callback.unique_id, None)
+        workflow = _load_workflow_obj(redis_callback)
         if not workflow:
             raise Exception('workflow object not found maybe data is expired')
+        redis_callback.workflow = workflow
         if workflow.status() not in [WorkflowStatus.INPUT.value, WorkflowStatus.INPUT_OVER.value]:
             raise Exception(f'workflow status is {workflow.status()} not INPUT')
+        if redis_callback.get_workflow_stop():
+            raise IgnoreException('workflow stop by user')
         user_input = redis_callback.get_user_input()
         if not user_input:
             raise IgnoreException('workflow continue not found user input')
@@ -109,14 +151,28 @@ def continue_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: s
 
 @bisheng_celery.task
 def stop_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
-    """ 停止workflow """
+    """
+    停止workflow，执行stop的worker不一定是正在执行workflow的worker
+    先发布停止信号，正在执行或者排队中的任务消费信号后自行停止并更新状态
+    只有暂停等待输入的workflow没有执行方，在这里直接结束
+    """
     with logger.contextualize(trace_id=unique_id):
         redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
-        if unique_id not in _global_workflow:
-            logger.warning("stop_workflow called but workflow not found in global cache")
+        redis_callback.set_workflow_stop_signal()
+        status_info = redis_callback.get_workflow_status()
+        status = status_info['status'] if status_info else None
+        cached = _global_workflow.get(unique_id, None)
+        if status in [WorkflowStatus.RUNNING.value, WorkflowStatus.WAITING.value, WorkflowStatus.INPUT_OVER.value]:
+            # 执行在本进程时直接停止，不用等到下一次检查信号
+            if cached is not None:
+                cached[1].stop()
+            logger.info(f'workflow stop signal sent by user {user_id}, status: {status}')
+            return
+        if status != WorkflowStatus.INPUT.value or (
+                cached is None and not workflow_snapshot_store.get_version(unique_id)):
+            logger.warning(f"stop_workflow called but workflow is not running, status: {status}")
+            redis_callback.clear_workflow_stop_signal()
             return
-        workflow = _global_workflow[unique_id]
-        workflow.stop()
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow stop by user')
         _clear_workflow_obj(unique_id)
         logger.info(f'workflow stop by user {user_id}')
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import operator
+from typing import Annotated, Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.constants import END, START
+from langgraph.graph import StateGraph
+from loguru import logger
+from typing_extensions import TypedDict
+
+from bisheng.cache.flow import InMemoryCache
+from bisheng.workflow.common.node import BaseNodeData, NodeType
+from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph.topology import build_node_level, build_node_level_by_paths, has_exclusive_branch
+
+
+class TempState(TypedDict):
+    # not use, only for langgraph state graph
+    flag: Annotated[bool, operator.and_]
+
+
+def _get_node_instance(config: RunnableConfig, node_id: str):
+    """ 从本次运行的config中获取节点实例 """
+    return config['configurable']['nodes_map'][node_id]
+
+
+def _node_action(node_id: str, async_mode: bool):
+    """ 编译后的图中的节点执行函数，运行时转发给本次运行的节点实例 """
+    if async_mode:
+
+        async def arun(state: dict, config: RunnableConfig):
+            return await _get_node_instance(config, node_id).arun(state)
+
+        return arun
+
+    def run(state: dict, config: RunnableConfig):
+        return _get_node_instance(config, node_id).run(state)
+
+    return run
+
+
+def _node_route(node_id: str):
+    """ 编译后的图中的条件边函数，运行时转发给本次运行的节点实例 """
+
+    def route_node(state: dict, config: RunnableConfig):
+        return _get_node_instance(config, node_id).route_node(state)
+
+    return route_node
+
+
+def is_condition_node(node: Dict) -> bool:
+    """ 是否是互斥节点：condition节点和选择型交互的output节点，和节点实例的is_condition_node保持一致 """
+    node_type = node.get('type')
+    if node_type == NodeType.CONDITION.value:
+        return True
+    if node_type != NodeType.OUTPUT.value:
+        return False
+    for group in node.get('group_params') or []:
+        for param in group.get('params') or []:
+            if param.get('key') == 'output_result':
+                return (param.get('value') or {}).get('type') == 'choose'
+    return False
+
+
+class CompiledWorkflowGraph:
+    """ 编译后的workflow图骨架，只和节点、边的拓扑结构有关，不包含任何节点实例，可在多次运行间复用 """
+
+    def __init__(self, edges: EdgeManage, graph, recursion_limit: int,
+                 node_level: Dict[str, int], nodes_fan_in: Dict[str, List[str]],
+                 nodes_next_nodes: Dict[str, List[str]], condition_nodes: List[str]):
+        self.edges = edges
+        self.graph = graph
+        self.recursion_limit = recursion_limit
+        self.node_level = node_level
+        self.nodes_fan_in = nodes_fan_in
+        self.nodes_next_nodes = nodes_next_nodes
+        self.condition_nodes = condition_nodes
+
+    def new_graph(self):
+        """ 每次运行使用独立的checkpointer，避免不同运行之间的状态互相影响 """
+        return self.graph.copy(update={'checkpointer': MemorySaver()})
+
+
+class GraphCompiler:
+    """ 解析workflow的拓扑结构，并编译为langgraph的图 """
+
+    def __init__(self, workflow_data: Dict, async_mode: bool = False, max_steps: int = 0):
+        self.workflow_data = workflow_data
+        self.async_mode = async_mode
+        self.max_steps = max_steps
+
+        # node_id: BaseNodeData
+        self.nodes_map: Dict[str, BaseNodeData] = {}
+        # record how many nodes fan in this node
+        self.nodes_fan_in = {}  # node_id: [node_ids]
+        # record how many nodes next to this node
+        self.nodes_next_nodes = {}  # node_id: {node_ids}
+
+        # node_id: 1; 表示从start节点到此节点的最长路径
+        self.node_level = {}
+        # 互斥节点列表，包含condition节点和output节点（选择型交互）
+        self.condition_nodes = []
+
+        self.edges = EdgeManage(self.workflow_data.get('edges', []))
+        # init langgraph state graph
+        self.graph_builder = StateGraph(TempState)
+
+    def add_node(self, node_id: str):
+        self.graph_builder.add_node(node_id, _node_action(node_id, self.async_mode))
+
+    def add_node_edge(self, node_data: BaseNodeData):
+        """  把节点的边链接起来  """
+        if node_data.type == NodeType.END.value or node_data.type == NodeType.FAKE_OUTPUT.value:
+            return
+        # get target nodes
+        target_node_ids = self.edges.get_target_node(node_data.id)
+        source_node_ids = self.edges.get_source_node(node_data.id)
+        # 没有任何链接的节点报错
+        if not target_node_ids and not source_node_ids:
+            raise Exception(f'node {node_data.name} {node_data.id} must have at least one edge')
+
+        # output 节点后跟一个fake 节点用来处理中断
+        if node_data.type == NodeType.OUTPUT.value:
+            fake_node_id = f'{node_data.id}_fake'
+            self.add_node(fake_node_id)
+            self.graph_builder.add_edge(node_data.id, fake_node_id)
+            self.graph_builder.add_conditional_edges(fake_node_id, _node_route(node_data.id),
+                                                     {node_id: node_id
+                                                      for node_id in target_node_ids})
+            return
+
+        # condition 和 output 节点后面需要接 langgraph的 edge_condition
+        if node_data.type == NodeType.CONDITION.value:
+            self.graph_builder.add_conditional_edges(node_data.id, _node_route(node_data.id),
+                                                     {node_id: node_id
+                                                      for node_id in target_node_ids})
+            return
+
+        # 链接到target节点
+        for node_id in target_node_ids:
+            if node_id not in self.nodes_map:
+                raise Exception(f'target node {node_id} not found')
+            if self.nodes_fan_in.get(node_id) and len(self.nodes_fan_in.get(node_id)) > 1:
+                # need wait all fan in node exec over
+                continue
+            self.graph_builder.add_edge(node_data.id, node_id)
+
+    def build_more_fan_in_node(self):
+        for node_id, source_ids in self.nodes_fan_in.items():
+            if not source_ids or len(source_ids) <= 1:
+                continue
+            # 有多个扇入节点，判断此节点是否需要等待
+            wait_nodes, no_wait_nodes = self.parse_fan_in_node(node_id)
+            logger.debug(f'node {node_id} wait nodes {wait_nodes}, no wait nodes {no_wait_nodes}')
+            if wait_nodes:
+                self.graph_builder.add_edge(wait_nodes, node_id)
+            if no_wait_nodes:
+                for one in no_wait_nodes:
+                    self.graph_builder.add_edge(one, node_id)
+
+    def parse_fan_in_node(self, node_id: str):
+        source_ids = self.nodes_fan_in.get(node_id)
+
+        # 是否所有前驱节点的层级都小于等于此节点
+        all_source_node_prev = True
+        for one in source_ids:
+            if self.node_level[one] > self.node_level[node_id]:
+                all_source_node_prev = False
+                break
+
+        # 前驱节点中 包含 此节点的下游节点，则不需要等待，需要排除output和condition节点，因为这两个节点通过条件边已连接到此节点了
+        if not all_source_node_prev:
+            return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
+
+        # 判断是否存在从condition节点或者output节点（选择型交互）到此节点的 两条不重复的路径
+        # 说明是互斥收尾节点，不需要等待
+        if has_exclusive_branch(self.edges, self.condition_nodes, node_id):
+            return [], [one for one in source_ids if not one.startswith(('output_', 'condition_'))]
+
+        # 说明不是互斥收尾节点，需要等待所有前驱节点执行完毕再执行
+        wait_nodes = []
+        for one in source_ids:
+            if one.startswith('output_'):
+                one = f'{one}_fake'
+            wait_nodes.append(one)
+        return wait_nodes, []
+
+    def build_node_level(self, start_node: str):
+        """ 计算所有节点的层级 """
+        node_level = build_node_level(self.edges, start_node)
+        if node_level is None:
+            # 存在多入口的循环，只能枚举所有路径
+            logger.warning('workflow graph is irreducible, fallback to enumerate paths')
+            node_level = build_node_level_by_paths(self.edges, start_node)
+        self.node_level = node_level
+
+    def init_nodes(self, nodes):
+        """ return node id """
+        start_node = None
+        end_nodes = []
+        interrupt_nodes = []
+        for node in nodes:
+            node_data = BaseNodeData(**node.get('data', {}))
+            if not node_data.id:
+                raise Exception('node must have attribute id')
+            if node_data.type == NodeType.NOTE.value:
+                continue
+
+            if is_condition_node(node.get('data', {})):
+                self.condition_nodes.append(node_data.id)
+            self.nodes_map[node_data.id] = node_data
+            self.nodes_fan_in[node_data.id] = self.edges.get_source_node(node_data.id)
+            if node_data.type not in [NodeType.START.value]:
+                self.nodes_next_nodes[node_data.id] = self.edges.get_next_nodes(node_data.id)
+
+            # add node into langgraph
+            self.add_node(node_data.id)
+
+            # find special node
+            if node_data.type == NodeType.START.value:
+                start_node = node_data.id
+            elif node_data.type == NodeType.END.value:
+                end_nodes.append(node_data.id)
+            elif node_data.type == NodeType.INPUT.value:
+                # 需要中止接收用户输入的节点
+                interrupt_nodes.append(node_data.id)
+            elif node_data.type == NodeType.OUTPUT.value:
+                # 需要中止接收用户输入的节点
+                interrupt_nodes.append(f'{node_data.id}_fake')
+        return start_node, end_nodes, interrupt_nodes
+
+    def compile(self) -> CompiledWorkflowGraph:
+        nodes = self.workflow_data.get('nodes', [])
+        if not nodes:
+            raise Exception('workflow must have at least one node')
+
+        start_node, end_nodes, interrupt_nodes = self.init_nodes(nodes)
+
+        if not start_node:
+            raise Exception('workflow must have start node')
+        self.graph_builder.add_edge(START, start_node)
+        if end_nodes:
+            for end_node in end_nodes:
+                self.graph_builder.add_edge(end_node, END)
+
+        # 计算节点的层级
+        self.build_node_level(start_node)
+
+        # 将其他节点链接起来
+        for node_id, node_data in list(self.nodes_map.items()):
+            self.add_node_edge(node_data)
+
+        # 处理包含多个扇入节点的节点
+        self.build_more_fan_in_node()
+
+        # compile langgraph
+        graph = self.graph_builder.compile(checkpointer=MemorySaver(),
+                                           interrupt_before=interrupt_nodes)
+        recursion_limit = max(
+            (len(nodes) - len(end_nodes) - 1) * self.max_steps, 1) + len(end_nodes) + 1
+
+        # import datetime
+        # with open(f"./bisheng/data/graph/graph_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.png",
+        #           'wb') as f:
+        #     f.write(graph.get_graph().draw_mermaid_png())
+
+        return CompiledWorkflowGraph(edges=self.edges,
+                                     graph=graph,
+                                     recursion_limit=recursion_limit,
+                                     node_level=self.node_level,
+                                     nodes_fan_in=self.nodes_fan_in,
+                                     nodes_next_nodes=self.nodes_next_nodes,
+                                     condition_nodes=self.condition_nodes)
+
+
+def get_topology_hash(workflow_data: Dict) -> str:
+    """ 根据节点和边计算拓扑结构的hash，除了是否为互斥节点外，节点的参数不影响编译结果 """
+    topology = {
+        'nodes': [[
+            one.get('data', {}).get('id'),
+            one.get('data', {}).get('type'),
+            is_condition_node(one.get('data', {}))
+        ] for one in workflow_data.get('nodes', [])],
+        'edges': workflow_data.get('edges', []),
+    }
+    return hashlib.sha256(json.dumps(topology, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# (workflow_id, 拓扑hash, async_mode, max_steps): CompiledWorkflowGraph
+_compiled_graph_cache = InMemoryCache(max_size=200, expiration_time=24 * 3600)
+
+
+def get_compiled_graph(workflow_id: Optional[str], workflow_data: Dict, async_mode: bool = False,
+                       max_steps: int = 0) -> CompiledWorkflowGraph:
+    """ 获取编译后的workflow图，同一个workflow版本只编译一次 """
+    cache_key = f'{workflow_id}:{get_topology_hash(workflow_data)}:{async_mode}:{max_steps}'
+    compiled = _compiled_graph_cache.get(cache_key)
+    if compiled is not None:
+        return compiled
+    compiled = GraphCompiler(workflow_data, async_mode=async_mode, max_steps=max_steps).compile()
+    _compiled_graph_cache.set(cache_key, compiled)
+    return compiled
@@ -106,3 +106,16 @@ class GraphState(BaseModel):
                     for k, v in value.items():
                         ret[f'{node_id}.{key}#{k}'] = v
         return ret
+
+    def dump_snapshot(self) -> Dict[str, Any]:
+        """ 导出全局变量和聊天历史，用于暂停后的恢复 """
+        return {
+            'variables_pool': self.variables_pool,
+            'history_messages': self.history_memory.chat_memory.messages if self.history_memory else None,
+        }
+
+    def load_snapshot(self, snapshot: Dict[str, Any]):
+        self.variables_pool = snapshot['variables_pool']
+        # 聊天历史的窗口大小由start节点初始化，这里只恢复消息
+        if self.history_memory and snapshot['history_messages'] is not None:
+            self.history_memory.chat_memory.messages = snapshot['history_messages']
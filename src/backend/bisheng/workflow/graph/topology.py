@@ -0,0 +1,248 @@
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from bisheng.workflow.edges.edges import EdgeManage
+
+
+def _get_targets(edges: EdgeManage, node_id: str) -> List[str]:
+    return edges.get_target_node(node_id) or []
+
+
+def dfs_order(edges: EdgeManage, start_node: str) -> Tuple[List[str], Set[Tuple[str, str]]]:
+    """
+    从start节点开始深度优先遍历
+    :return: 可达节点的逆后序，回边集合（指向当前遍历路径上节点的边）
+    """
+    post_order = []
+    back_edges = set()
+    on_stack = {start_node}
+    visited = {start_node}
+    stack = [(start_node, iter(_get_targets(edges, start_node)))]
+    while stack:
+        node_id, targets = stack[-1]
+        for one in targets:
+            if one in on_stack:
+                back_edges.add((node_id, one))
+            elif one not in visited:
+                visited.add(one)
+                on_stack.add(one)
+                stack.append((one, iter(_get_targets(edges, one))))
+                break
+        else:
+            stack.pop()
+            on_stack.discard(node_id)
+            post_order.append(node_id)
+    post_order.reverse()
+    return post_order, back_edges
+
+
+def compute_idom(edges: EdgeManage, start_node: str, rpo: List[str]) -> Dict[str, str]:
+    """ 计算可达节点的直接支配节点（Cooper-Harvey-Kennedy 迭代算法） """
+    order = {node_id: index for index, node_id in enumerate(rpo)}
+    preds: Dict[str, List[str]] = {node_id: [] for node_id in rpo}
+    for node_id in rpo:
+        for one in _get_targets(edges, node_id):
+            preds[one].append(node_id)
+
+    idom = {start_node: start_node}
+
+    def intersect(a: str, b: str) -> str:
+        while a != b:
+            while order[a] > order[b]:
+                a = idom[a]
+            while order[b] > order[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for node_id in rpo[1:]:
+            new_idom = None
+            for one in preds[node_id]:
+                if one not in idom:
+                    continue
+                new_idom = one if new_idom is None else intersect(one, new_idom)
+            if new_idom is not None and idom.get(node_id) != new_idom:
+                idom[node_id] = new_idom
+                changed = True
+    return idom
+
+
+def _dominates(idom: Dict[str, str], a: str, b: str) -> bool:
+    """ a 是否支配 b """
+    while True:
+        if a == b:
+            return True
+        parent = idom[b]
+        if parent == b:
+            return False
+        b = parent
+
+
+def build_node_level(edges: EdgeManage, start_node: str) -> Optional[Dict[str, int]]:
+    """
+    计算从start节点到每个可达节点的最长简单路径长度
+    可归约图（所有回边都指向支配其起点的节点，即循环只有一个入口）中，简单路径不会经过回边，
+    去掉回边后在有向无环图上按拓扑序动态规划即可。不可归约时返回None，由调用方使用路径枚举的方式计算
+    """
+    rpo, back_edges = dfs_order(edges, start_node)
+    if back_edges:
+        idom = compute_idom(edges, start_node, rpo)
+        for source, target in back_edges:
+            if not _dominates(idom, target, source):
+                return None
+
+    # 逆后序是去掉回边后的拓扑序
+    node_level = {start_node: 0}
+    for node_id in rpo:
+        level = node_level[node_id]
+        for one in _get_targets(edges, node_id):
+            if (node_id, one) in back_edges:
+                continue
+            if node_level.get(one, -1) < level + 1:
+                node_level[one] = level + 1
+    return node_level
+
+
+def build_node_level_by_paths(edges: EdgeManage, start_node: str) -> Dict[str, int]:
+    """ 枚举从start节点出发的所有简单路径计算节点层级，复杂度随分支数指数增长 """
+    node_level = {}
+
+    # 标记节点的层级
+    def mark_node_level(node_id, node_map: dict, level: int):
+        # 已经遍历过的节点不再遍历，说明成环了
+        if node_id in node_map:
+            return
+        node_level[node_id] = max(node_level.get(node_id, 0), level)
+        node_map[node_id] = True
+        next_nodes = edges.get_target_node(node_id)
+        if not next_nodes:
+            return
+
+        for one_node in next_nodes:
+            tmp_node_map = node_map.copy()
+            mark_node_level(one_node, tmp_node_map, level + 1)
+        return
+
+    mark_node_level(start_node, {}, 0)
+    return node_level
+
+
+def _reachable(edges: EdgeManage, sources: List[str], end_node_id: str, exclude: Set[str]) -> bool:
+    """ 从sources出发，不经过exclude中的节点能否到达end节点 """
+    visited = set(exclude)
+    queue = deque()
+    for one in sources:
+        if one not in visited:
+            visited.add(one)
+            queue.append(one)
+    while queue:
+        node_id = queue.popleft()
+        if node_id == end_node_id:
+            return True
+        for one in _get_targets(edges, node_id):
+            if one not in visited:
+                visited.add(one)
+                queue.append(one)
+    return False
+
+
+def _has_two_disjoint_paths(edges: EdgeManage, sources: List[str], end_node_id: str) -> bool:
+    """
+    是否存在两条从sources中的节点到end节点、中间节点互不相同的路径
+    把每个节点拆成入点和出点，入点到出点的容量为1，求最大流是否能达到2
+    """
+    source, sink = ('source', ''), ('in', end_node_id)
+    capacity: Dict[Tuple[str, str], Dict[Tuple[str, str], int]] = {source: {}}
+
+    def add_edge(u, v, cap):
+        capacity.setdefault(u, {})
+        capacity.setdefault(v, {})
+        capacity[u][v] = capacity[u].get(v, 0) + cap
+        capacity[v].setdefault(u, 0)
+
+    visited = set()
+    queue = deque(sources)
+    for one in sources:
+        add_edge(source, ('out', one), 2)
+        visited.add(one)
+    # 只需要构建从sources可达的部分，end节点的出边不需要
+    while queue:
+        node_id = queue.popleft()
+        for one in _get_targets(edges, node_id):
+            add_edge(('out', node_id), ('in', one), 1)
+            if one not in visited and one != end_node_id:
+                visited.add(one)
+                add_edge(('in', one), ('out', one), 1)
+                queue.append(one)
+    for one in sources:
+        # 互斥节点也可能出现在另一条路径的中间
+        add_edge(('in', one), ('out', one), 1)
+    if sink not in capacity:
+        return False
+
+    flow = 0
+    while flow < 2:
+        parent = {source: None}
+        queue = deque([source])
+        while queue and sink not in parent:
+            u = queue.popleft()
+            for v, cap in capacity[u].items():
+                if cap > 0 and v not in parent:
+                    parent[v] = u
+                    queue.append(v)
+        if sink not in parent:
+            break
+        v = sink
+        while parent[v] is not None:
+            u = parent[v]
+            capacity[u][v] -= 1
+            capacity[v][u] += 1
+            v = u
+        flow += 1
+    return flow >= 2
+
+
+def has_exclusive_branch(edges: EdgeManage, condition_nodes: List[str], node_id: str) -> bool:
+    """
+    判断是否存在从互斥节点到此节点的两条中间节点不重复的路径，与has_exclusive_branch_by_paths的结果一致
+    直连的边没有中间节点，和其他任意一条路径都不重复；否则转化为两条点不相交路径的最大流问题
+    """
+    sources = [one for one in condition_nodes if one != node_id]
+    direct_nodes = []
+    for one in sources:
+        direct_nodes.extend([one for target in _get_targets(edges, one) if target == node_id])
+    if len(direct_nodes) >= 2:
+        return True
+    if len(direct_nodes) == 1:
+        # 是否还存在其他任意一条路径
+        direct_node = direct_nodes[0]
+        others = [one for one in sources if one != direct_node]
+        if _reachable(edges, others, node_id, exclude=set()):
+            return True
+        next_nodes = [one for one in _get_targets(edges, direct_node) if one != node_id]
+        return _reachable(edges, next_nodes, node_id, exclude={direct_node})
+    return _has_two_disjoint_paths(edges, sources, node_id)
+
+
+def has_exclusive_branch_by_paths(edges: EdgeManage, condition_nodes: List[str], node_id: str) -> bool:
+    """ 枚举从互斥节点到此节点的所有路径，两两比较是否存在不重复的路径，复杂度随分支数指数增长 """
+    all_branches = []
+    for one in condition_nodes:
+        if node_id == one:
+            continue
+        branches = edges.get_all_edges_nodes(one, node_id)
+        for branch in branches:
+            if node_id not in branch:
+                continue
+            branch.remove(node_id)
+            branch.remove(one)
+            all_branches.append(branch)
+
+    # 判断所有边中是否存在两条不重复的路径
+    for i in range(len(all_branches)):
+        for j in range(i + 1, len(all_branches)):
+            if not (set(all_branches[i]) & set(all_branches[j])):
+                return True
+    return False
@@ -82,6 +82,17 @@ class Workflow:
     def stop(self):
         self.graph_engine.stop()
 
+    def dump_snapshot(self) -> dict:
+        """ 导出暂停时的运行状态，用于在其他进程恢复 """
+        return {
+            'current_time': self.current_time,
+            'graph_engine': self.graph_engine.dump_snapshot(),
+        }
+
+    def load_snapshot(self, snapshot: dict):
+        self.current_time = snapshot['current_time']
+        self.graph_engine.load_snapshot(snapshot['graph_engine'])
+
     def status(self):
         return self.graph_engine.status
 
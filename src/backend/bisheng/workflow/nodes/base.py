@@ -16,6 +16,8 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
 class BaseNode(ABC):
+    # workflow暂停等待用户输入时需要保存到快照里的节点属性，子类有运行时状态时追加
+    _snapshot_fields = ['current_step', 'exec_unique_id', 'node_params', 'other_node_variable']
 
     def __init__(self, node_data: BaseNodeData, workflow_id: str, user_id: str,
                  graph_state: GraphState, target_edges: List[EdgeBase], max_steps: int,
@@ -213,3 +215,12 @@ class BaseNode(ABC):
 
     def stop(self):
         self.stop_flag = True
+
+    def dump_snapshot(self) -> Dict[str, Any]:
+        """ 导出节点的运行时状态 """
+        return {key: getattr(self, key) for key in self._snapshot_fields}
+
+    def load_snapshot(self, snapshot: Dict[str, Any]):
+        """ 从快照恢复节点的运行时状态 """
+        for key, value in snapshot.items():
+            setattr(self, key, value)
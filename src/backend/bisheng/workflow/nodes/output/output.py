@@ -8,6 +8,9 @@ from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 
 
 class OutputNode(BaseNode):
+    _snapshot_fields = BaseNode._snapshot_fields + [
+        '_handled_output_result', '_parsed_output_msg', '_parsed_files', '_source_documents'
+    ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -155,7 +155,10 @@ class LinsightAgent(BaseModel):
         file_list_str = await self.parse_file_list_str(file_list)
         # Add main functionality logic here
         if not self.task_manager:
-            self.task_manager = TaskManage(tasks=tasks, tools=self.tools, task_mode=self.task_mode)
+            self.task_manager = TaskManage(tasks=tasks, tools=self.tools, task_mode=self.task_mode,
+                                           max_concurrency=self.exec_config.max_concurrency,
+                                           tool_concurrency=self.exec_config.tool_concurrency,
+                                           tool_timeout=self.exec_config.tool_timeout)
             self.task_manager.rebuild_tasks(query=self.query, llm=self.llm, file_dir=self.file_dir, sop=sop,
                                             exec_config=self.exec_config, file_list_str=file_list_str)
 
@@ -13,10 +13,19 @@ class ExecConfig(BaseModel):
     retry_sleep: int = Field(default=5, description='灵思任务执行过程中模型调用重试间隔时间（秒）')
     max_file_num: int = Field(default=5, description='生成SOP时，prompt里放的用户上传文件信息的数量')
     retry_temperature: float = Field(default=1, description='重试时的模型温度')
+    max_concurrency: int = Field(default=3, description='同时执行的任务数上限，依赖的前置任务完成后才会执行，1表示串行执行')
+    tool_concurrency: int = Field(default=3, description='同一个工具同时执行的调用数上限')
+    tool_timeout: int = Field(default=300, description='单次工具调用的超时时间（秒），0表示不限制')
 
 
 CallUserInputToolName = "call_user_input"
 
+# 只读的工具，同一步骤中连续的只读工具调用可以并发执行；其他工具可能修改文件等状态，按模型返回的顺序串行执行
+ReadOnlyToolNames = {
+    "list_files", "get_file_details", "search_files", "read_text_file", "search_text_in_file",
+    "search_knowledge_base", "web_search", "bing_search",
+}
+
 
 class TaskStatus(Enum):
     WAITING = 'waiting'  # 待执行
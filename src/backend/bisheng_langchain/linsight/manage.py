@@ -1,14 +1,14 @@
 import asyncio
 import json
 import traceback
-from asyncio.queues import Queue
+from collections import deque
 from functools import cached_property
-from typing import Optional, AsyncIterator
+from typing import AsyncIterator
 
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.tools import BaseTool
 from langchain_core.utils.function_calling import convert_to_openai_tool
-from pydantic import Field, BaseModel, model_validator, ConfigDict
+from pydantic import Field, BaseModel, model_validator, ConfigDict, PrivateAttr
 
 from bisheng_langchain.linsight.const import TaskStatus, TaskMode, CallUserInputToolName, ExecConfig
 from bisheng_langchain.linsight.event import BaseEvent
@@ -17,6 +17,15 @@ from bisheng_langchain.linsight.task import Task
 from bisheng_langchain.linsight.utils import generate_uuid_str
 
 
+class _EventChannel:
+    """ 任务的事件缓冲区，items中按产生的顺序存放事件和子任务的channel """
+    __slots__ = ('items', 'closed')
+
+    def __init__(self):
+        self.items = deque()
+        self.closed = False
+
+
 class TaskManage(BaseModel):
     """
     Task manager for handling tasks and workflows.
@@ -31,14 +40,23 @@ class TaskManage(BaseModel):
     task_step_map: dict[str, Task] = Field(default_factory=dict, description='Map of step ID to Task instances')
     tools: list[BaseTool] = Field(default_factory=list, description='List of tools managed by the tool manager')
     tool_map: dict[str, BaseTool] = Field(default_factory=dict, description='Map of tool names to tool instances')
-    aqueue: Optional[Queue] = Field(default=None, description='Asynchronous queue for task processing')
     task_mode: str = Field(default=TaskMode.FUNCTION.value,
                            description='Mode of the task execution, can be FUNCTION or REACT')
+    max_concurrency: int = Field(default=3, description='Maximum number of tasks executed at the same time')
+    tool_concurrency: int = Field(default=3, description='Maximum number of concurrent calls of the same tool')
+    tool_timeout: int = Field(default=300, description='Timeout in seconds of one tool call, 0 means no timeout')
+
+    # event channels in plan order, events are yielded in the same order as serial execution
+    _root_channel: _EventChannel = PrivateAttr(default_factory=_EventChannel)
+    _channels: dict[str, _EventChannel] = PrivateAttr(default_factory=dict)
+    _signal: asyncio.Event = PrivateAttr(default_factory=asyncio.Event)
+    _semaphore: asyncio.Semaphore = PrivateAttr(default=None)
+    _tool_semaphores: dict[str, asyncio.Semaphore] = PrivateAttr(default_factory=dict)
 
     @model_validator(mode="after")
     def validate_tasks(self) -> "TaskManage":
-        self.aqueue = Queue(maxsize=50)
         self.tool_map = {tool.name: tool for tool in self.tools}
+        self._semaphore = asyncio.Semaphore(max(self.max_concurrency, 1))
         return self
 
     def rebuild_tasks(self, query: str, llm: BaseLanguageModel, file_dir: str, sop: str,
@@ -161,11 +179,17 @@ class TaskManage(BaseModel):
         if not params.get("call_reason"):
             return f"tool {name} exec error, because call_reason field is required.", False
         params.pop("call_reason")
+        if name not in self._tool_semaphores:
+            self._tool_semaphores[name] = asyncio.Semaphore(max(self.tool_concurrency, 1))
         try:
-            res = await self.tool_map[name].ainvoke(input=params)
+            async with self._tool_semaphores[name]:
+                res = await asyncio.wait_for(self.tool_map[name].ainvoke(input=params),
+                                             timeout=self.tool_timeout or None)
             if not isinstance(res, str):
                 res = str(res)
             return res, True
+        except asyncio.TimeoutError:
+            return f"tool {name} exec error, because timeout after {self.tool_timeout} seconds", False
         except Exception as e:
             traceback.print_exc()
             return f"tool {name} exec error, something went wrong: {str(e)[:50]}", False
@@ -259,29 +283,155 @@ class TaskManage(BaseModel):
             })
         return res
 
+    def put_event(self, event: BaseEvent) -> None:
+        """ Put the event into the channel of the task which triggered it. """
+        channel = self._channels.get(event.task_id)
+        if channel is None:
+            # 不在调度中的任务，按产生的顺序输出
+            self._root_channel.items.append(event)
+        else:
+            channel.items.append(event)
+        self._signal.set()
+
+    def _open_channel(self, parent: _EventChannel, task_id: str) -> None:
+        channel = _EventChannel()
+        self._channels[task_id] = channel
+        parent.items.append(channel)
+
+    def _close_channel(self, task_id: str) -> None:
+        if task_id in self._channels:
+            self._channels[task_id].closed = True
+        self._signal.set()
+
+    def _drain_channel(self, channel: _EventChannel, out: list[BaseEvent], force: bool) -> bool:
+        """
+        按顺序取出channel中可以输出的事件，返回channel是否已经全部输出
+        遇到还未结束的子channel时停止；force为True时跳过未结束的子channel，继续输出后面子channel中已有的事件
+        """
+        remain = deque()
+        while channel.items:
+            item = channel.items.popleft()
+            if isinstance(item, _EventChannel):
+                if self._drain_channel(item, out, force):
+                    continue
+                remain.append(item)
+                if not force:
+                    break
+            elif remain:
+                # 排在未结束的子channel后面的事件，需要等子channel结束后输出
+                remain.append(item)
+            else:
+                out.append(item)
+        remain.extend(channel.items)
+        channel.items = remain
+        return channel.closed and not channel.items
+
+    def _drain_events(self) -> list[BaseEvent]:
+        # 有任务在等待用户输入时，需要立即把问题推给用户，不再等待排在前面的任务结束
+        force = any(one.status == TaskStatus.INPUT.value for one in self.task_map.values())
+        out = []
+        self._drain_channel(self._root_channel, out, force)
+        return out
+
+    def _build_depends(self) -> dict[str, set[str]]:
+        """ 根据任务的input和next_id，计算每个一级任务依赖的前置任务id """
+        depends = {task.id: set() for task in self.tasks}
+        for task in self.tasks:
+            for step_id in task.input or []:
+                pre_task = self.task_step_map.get(step_id)
+                if pre_task and pre_task.id != task.id:
+                    depends[task.id].add(pre_task.id)
+            for next_id in task.next_id or []:
+                if next_id in depends and next_id != task.id:
+                    depends[next_id].add(task.id)
+        return depends
+
+    async def _run_task(self, task: Task) -> None:
+        """ 执行任务，循环任务本身不占用并发数，由它的子任务占用 """
+        try:
+            if task.node_loop and not task.parent_id:
+                await task.ainvoke()
+            else:
+                async with self._semaphore:
+                    await task.ainvoke()
+        finally:
+            self._close_channel(task.id)
+
+    async def ainvoke_sub_tasks(self, parent: Task, children: list[Task]) -> None:
+        """
+        Execute the subtasks of loop task concurrently, events of subtasks are yielded in order
+        after the events of parent task. Raise the first exception after all subtasks finished.
+        """
+        parent_channel = self._channels.get(parent.id, self._root_channel)
+        for child in children:
+            self._open_channel(parent_channel, child.id)
+        results = await asyncio.gather(*[self._run_task(one) for one in children], return_exceptions=True)
+        for one in results:
+            if isinstance(one, BaseException):
+                raise one
+
     async def catch_task_exception(self, task: Task) -> None:
         try:
-            await task.ainvoke()
+            await self._run_task(task)
         except Exception as e:
             task.status = TaskStatus.FAILED.value
             task.answer.append(str(e)[:-100])
             raise e
 
     async def ainvoke_task(self) -> AsyncIterator[BaseEvent]:
+        """
+        Execute tasks as soon as their depend tasks finished, at most max_concurrency tasks at the same time.
+        Events are yielded in plan order, same as serial execution, except when some task is waiting for user input.
+        """
+        depends = self._build_depends()
+        pending = list(self.tasks)
+        running: dict[str, asyncio.Task] = {}
+        finished = set()
+        error = None
         for task in self.tasks:
-            async_task = asyncio.create_task(self.catch_task_exception(task))
-            while not async_task.done():
-                while not self.aqueue.empty():
-                    res = await self.aqueue.get()
-                    yield res
-                await asyncio.sleep(0.1)
-            while not self.aqueue.empty():
-                res = await self.aqueue.get()
-                yield res
-            if task_exception := async_task.exception():
-                raise task_exception
-            if task.status == TaskStatus.FAILED.value:
-                raise Exception(f"Task {task.step_id} failed with error: {task.get_finally_answer()}")
+            self._open_channel(self._root_channel, task.id)
+        try:
+            while True:
+                if error is None:
+                    ready = [one for one in pending if depends[one.id] <= finished]
+                    if not ready and not running and pending:
+                        # 依赖关系有环，按计划中的顺序执行
+                        ready = pending[:1]
+                    for task in ready:
+                        pending.remove(task)
+                        running[task.id] = asyncio.create_task(self.catch_task_exception(task))
+                        running[task.id].add_done_callback(lambda _: self._signal.set())
+
+                for event in self._drain_events():
+                    yield event
+                if not running and (error is not None or not pending):
+                    break
+
+                await self._signal.wait()
+                self._signal.clear()
+                for task_id, async_task in list(running.items()):
+                    if not async_task.done():
+                        continue
+                    running.pop(task_id)
+                    if async_task.cancelled():
+                        continue
+                    task = self.task_map[task_id]
+                    if task_exception := async_task.exception():
+                        error = error or task_exception
+                    elif task.status == TaskStatus.FAILED.value:
+                        error = error or Exception(
+                            f"Task {task.step_id} failed with error: {task.get_finally_answer()}")
+                    else:
+                        finished.add(task_id)
+                if error is not None:
+                    # 有任务失败，停止其他正在执行的任务
+                    for async_task in running.values():
+                        async_task.cancel()
+        finally:
+            for async_task in running.values():
+                async_task.cancel()
+        if error is not None:
+            raise error
 
     async def continue_task(self, task_id: str, user_input: str) -> None:
         """
@@ -18,19 +18,10 @@ class ReactTask(BaseTask):
 
     async def get_history_str(self) -> str:
         """Get the history string for the history."""
-        history_str = ""
-        tool_messages = []
-        remain_messages = []
-        for one in self.history:
-            history_str += "\n" + one.content
-            if isinstance(one, ToolMessage) or "tool_calls" in one.additional_kwargs:
-                tool_messages.append(one)
-            else:
-                remain_messages.append(one)
+        history_str = "".join("\n" + one.content for one in self.history)
 
-        all_tool_messages_str = json.dumps([json.loads(one.content) for one in tool_messages], ensure_ascii=False,
-                                           indent=2)
-        if len(encode_str_tokens(all_tool_messages_str)) > self.exec_config.tool_buffer:
+        if self.get_tool_tokens() > self.exec_config.tool_buffer:
+            remain_messages = [one for one in self.history if not self.is_tool_message(one)]
             messages_str = ''
             for one in self.history:
                 messages_str += "\n" + one.content + ","
@@ -45,6 +36,10 @@ class ReactTask(BaseTask):
 
         return history_str
 
+    def count_message_tokens(self, message: BaseMessage) -> int:
+        """ react模式的工具消息内容是json字符串 """
+        return len(encode_str_tokens(json.dumps(json.loads(message.content), ensure_ascii=False, indent=2)))
+
     async def build_messages_with_history(self) -> list[BaseMessage]:
         """Build messages with history for the React task."""
         # It should return a prompt that will be used in the React task.
@@ -9,9 +9,9 @@ from typing import List, Optional, Any
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.messages import BaseMessage, ToolMessage, HumanMessage, AIMessage
 from langchain_openai.chat_models.base import _convert_message_to_dict
-from pydantic import BaseModel, Field, ConfigDict, model_validator
+from pydantic import BaseModel, Field, ConfigDict, model_validator, PrivateAttr
 
-from bisheng_langchain.linsight.const import TaskStatus, CallUserInputToolName, ExecConfig
+from bisheng_langchain.linsight.const import TaskStatus, CallUserInputToolName, ExecConfig, ReadOnlyToolNames
 from bisheng_langchain.linsight.event import ExecStep, GenerateSubTask, BaseEvent, NeedUserInput, TaskStart, TaskEnd
 from bisheng_langchain.linsight.prompt import SingleAgentPrompt, SummarizeHistoryPrompt, LoopAgentSplitPrompt, \
     LoopAgentPrompt, SummarizeAnswerPrompt
@@ -62,6 +62,11 @@ class BaseTask(BaseModel):
     original_done: Optional[str] = Field(default='', description='已完成的内容')
     last_answer: Optional[str] = Field(default='', description='上一步骤的答案，暂无用处')
 
+    # 已经统计过token数的历史记录，以及其中工具消息的token总数
+    _counted_history: Optional[list] = PrivateAttr(default=None)
+    _counted_num: int = PrivateAttr(default=0)
+    _tool_tokens: int = PrivateAttr(default=0)
+
     @model_validator(mode="before")
     @classmethod
     def validate_task(cls, values: dict) -> dict:
@@ -94,6 +99,29 @@ class BaseTask(BaseModel):
             values["original_done"] = str(values["original_done"])
         return values
 
+    @staticmethod
+    def is_tool_message(message: BaseMessage) -> bool:
+        return 'tool_calls' in message.additional_kwargs or isinstance(message, ToolMessage)
+
+    def count_message_tokens(self, message: BaseMessage) -> int:
+        """ 单条消息在历史记录中占用的token数 """
+        return len(encode_str_tokens(json.dumps(message.model_dump(), ensure_ascii=False, indent=2)))
+
+    def get_tool_tokens(self) -> int:
+        """
+        历史记录中工具消息的token总数
+        历史记录只会追加，每条消息只在第一次统计时计算token数；历史记录被总结替换后重新统计
+        """
+        if self.history is not self._counted_history or len(self.history) < self._counted_num:
+            self._counted_history = self.history
+            self._counted_num = 0
+            self._tool_tokens = 0
+        for one in self.history[self._counted_num:]:
+            if self.is_tool_message(one):
+                self._tool_tokens += self.count_message_tokens(one)
+        self._counted_num = len(self.history)
+        return self._tool_tokens
+
     def get_task_info(self) -> dict:
         return self.model_dump(exclude={"task_manager", "llm", "file_dir", "finally_sop", "children", "exec_config"})
 
@@ -205,10 +233,9 @@ class BaseTask(BaseModel):
         all_failed = True
         answer = []
         error = ""
-        # _ = await asyncio.gather(*[one.ainvoke() for one in self.children])
+        await self.task_manager.ainvoke_sub_tasks(self, self.children)
 
         for one in self.children:
-            await one.ainvoke()
             if one.status == TaskStatus.SUCCESS.value:
                 all_failed = False
                 answer.append(one.get_finally_answer())
@@ -279,9 +306,7 @@ class BaseTask(BaseModel):
     async def put_event(self, event: BaseEvent) -> None:
         if not self.task_manager:
             raise RuntimeError('Task manager not initialized.')
-        if not self.task_manager.aqueue:
-            raise RuntimeError('Task manager queue not initialized.')
-        self.task_manager.aqueue.put_nowait(event)
+        self.task_manager.put_event(event)
 
     @abstractmethod
     async def _ainvoke(self):
@@ -295,6 +320,11 @@ class BaseTask(BaseModel):
             self.status = TaskStatus.FAILED.value
             self.answer.append(f"task exec failed: {str(e)[-100:]}")
             raise e
+        except asyncio.CancelledError:
+            # 其他任务失败或者用户终止时被取消
+            self.status = TaskStatus.FAILED.value
+            self.answer.append("task exec cancelled")
+            raise
         finally:
             await self.put_event(
                 TaskEnd(task_id=self.id, status=self.status, name=self.profile, answer=self.get_finally_answer(),
@@ -391,17 +421,9 @@ class Task(BaseTask):
 
         messages.extend(self.history)
 
-        # 如果有聊天历史记录, 需要对工具消息做精简
-        all_tool_messages = []
-        all_remain_messages = []
-        for one in messages:
-            if 'tool_calls' in one.additional_kwargs or isinstance(one, ToolMessage):
-                all_tool_messages.append(one)
-            else:
-                all_remain_messages.append(one)
-        all_tool_messages_str = json.dumps([one.model_dump() for one in all_tool_messages], ensure_ascii=False,
-                                           indent=2)
-        if len(encode_str_tokens(all_tool_messages_str)) > self.exec_config.tool_buffer:
+        # 如果有聊天历史记录, 工具消息超过token限制时需要对工具消息做精简
+        if self.get_tool_tokens() > self.exec_config.tool_buffer:
+            all_remain_messages = [one for one in messages if not self.is_tool_message(one)]
             messages_str = json.dumps([one.model_dump() for one in messages], ensure_ascii=False, indent=2)
             history_summary = await self.summarize_history(messages_str)
             # 将总结后的历史记录插入到system_message后面
@@ -425,43 +447,37 @@ class Task(BaseTask):
             self.history.append(res)
             print(res)
             if "tool_calls" in res.additional_kwargs and res.tool_calls:
-                for one in res.tool_calls:
-                    tool_name = one.get("name")
-                    tool_args = one.get("args")
-                    call_reason = tool_args.get("call_reason") if "call_reason" in tool_args else ""
-
-                    # 等待用户输入的特殊工具调用
-                    if tool_name == CallUserInputToolName:
-                        # 等待用户输入
-                        self.status = TaskStatus.INPUT.value
-                        await self.put_event(NeedUserInput(task_id=self.id, call_reason=call_reason))
-                        # 等待用户输入
-                        while self.status != TaskStatus.INPUT_OVER.value:
-                            await asyncio.sleep(0.5)
-
-                        # 用户输入结束继续执行
-                        self.status = TaskStatus.PROCESSING.value
-                        self.history.append(
-                            ToolMessage(name=tool_name, content=self.user_input, tool_call_id=one.get("id")))
-                        self.user_input = None
+                tool_calls = res.tool_calls
+                user_input_call = None
+                for index, one in enumerate(tool_calls):
+                    if one.get("name") == CallUserInputToolName:
+                        # 等待用户输入之后的工具调用不再执行
+                        user_input_call = one
+                        tool_calls = tool_calls[:index]
                         break
 
-                    # 正常工具调用
-                    await self.put_event(ExecStep(task_id=self.id,
-                                                  call_id=one.get('id'),
-                                                  call_reason=call_reason,
-                                                  name=tool_name,
-                                                  params=tool_args,
-                                                  status="start"))
-                    tool_result, _ = await self.task_manager.ainvoke_tool(tool_name, copy.deepcopy(tool_args))
-                    await self.put_event(ExecStep(task_id=self.id,
-                                                  call_id=one.get('id'),
-                                                  call_reason=call_reason,
-                                                  name=tool_name,
-                                                  params=tool_args,
-                                                  output=tool_result,
-                                                  status="end"))
-                    self.history.append(ToolMessage(name=tool_name, content=tool_result, tool_call_id=one.get("id")))
+                # 结果按调用的顺序写入历史记录
+                tool_results = await self._ainvoke_tool_calls(tool_calls)
+                for one, tool_result in zip(tool_calls, tool_results):
+                    self.history.append(
+                        ToolMessage(name=one.get("name"), content=tool_result, tool_call_id=one.get("id")))
+
+                # 等待用户输入的特殊工具调用
+                if user_input_call:
+                    tool_args = user_input_call.get("args")
+                    call_reason = tool_args.get("call_reason") if "call_reason" in tool_args else ""
+                    # 等待用户输入
+                    self.status = TaskStatus.INPUT.value
+                    await self.put_event(NeedUserInput(task_id=self.id, call_reason=call_reason))
+                    # 等待用户输入
+                    while self.status != TaskStatus.INPUT_OVER.value:
+                        await asyncio.sleep(0.5)
+
+                    # 用户输入结束继续执行
+                    self.status = TaskStatus.PROCESSING.value
+                    self.history.append(ToolMessage(name=CallUserInputToolName, content=self.user_input,
+                                                    tool_call_id=user_input_call.get("id")))
+                    self.user_input = None
             else:  # 不需要工具调用说明输出了最终答案，执行结束
                 break
         if isinstance(self.history[-1], AIMessage):
@@ -472,6 +488,47 @@ class Task(BaseTask):
             self.answer.append("task exec over max steps and not generate answer")
         return None
 
+    async def _ainvoke_tool_calls(self, tool_calls: list[dict]) -> list[str]:
+        """
+        执行同一步骤中的多个工具调用，按调用的顺序返回结果
+        连续的只读工具调用并发执行；其他工具调用可能修改文件等状态，等前面的调用结束后再单独执行，
+        保证对同一个文件的写入、读取按模型返回的顺序进行
+        """
+        results = []
+        read_only_calls = []
+        for one in tool_calls:
+            if one.get("name") in ReadOnlyToolNames:
+                read_only_calls.append(one)
+                continue
+            if read_only_calls:
+                results.extend(await asyncio.gather(*[self._ainvoke_tool_call(call) for call in read_only_calls]))
+                read_only_calls = []
+            results.append(await self._ainvoke_tool_call(one))
+        if read_only_calls:
+            results.extend(await asyncio.gather(*[self._ainvoke_tool_call(call) for call in read_only_calls]))
+        return results
+
+    async def _ainvoke_tool_call(self, tool_call: dict) -> str:
+        """ 执行模型返回的一个工具调用，返回工具的执行结果 """
+        tool_name = tool_call.get("name")
+        tool_args = tool_call.get("args")
+        call_reason = tool_args.get("call_reason") if "call_reason" in tool_args else ""
+        await self.put_event(ExecStep(task_id=self.id,
+                                      call_id=tool_call.get('id'),
+                                      call_reason=call_reason,
+                                      name=tool_name,
+                                      params=tool_args,
+                                      status="start"))
+        tool_result, _ = await self.task_manager.ainvoke_tool(tool_name, copy.deepcopy(tool_args))
+        await self.put_event(ExecStep(task_id=self.id,
+                                      call_id=tool_call.get('id'),
+                                      call_reason=call_reason,
+                                      name=tool_name,
+                                      params=tool_args,
+                                      output=tool_result,
+                                      status="end"))
+        return tool_result
+
     async def generate_sub_tasks(self) -> list['Task']:
         sub_tasks_info = await self._get_sub_tasks()
         return [Task(**one) for one in sub_tasks_info]
@@ -3,7 +3,11 @@ Ensemble retriever that ensemble the results of
 multiple retrievers by using weighted  Reciprocal Rank Fusion
 """
 
-from typing import Any, Dict, List
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
@@ -12,6 +16,7 @@ from langchain.callbacks.manager import (
     AsyncCallbackManagerForRetrieverRun,
     CallbackManagerForRetrieverRun,
 )
+from loguru import logger
 from pydantic import model_validator
 
 
@@ -27,11 +32,14 @@ class EnsembleRetriever(BaseRetriever):
         c: A constant added to the rank, controlling the balance between the importance
             of high-ranked items and the consideration given to lower-ranked items.
             Default is 60.
+        id_key: The metadata key used to identify the same document returned by
+            different retrievers. Defaults to None, use the page_content.
     """
 
     retrievers: List[BaseRetriever]
     weights: List[float]
     c: int = 60
+    id_key: Optional[str] = None
 
     @model_validator(mode='before')
     @classmethod
@@ -93,7 +101,7 @@ class EnsembleRetriever(BaseRetriever):
     ) -> List[Document]:
         """
         Retrieve the results of the retrievers and use rank_fusion_func to get
-        the final result.
+        the final result. Retrievers are called concurrently in a thread pool.
 
         Args:
             query: The query to search for.
@@ -102,15 +110,26 @@ class EnsembleRetriever(BaseRetriever):
             A list of reranked documents.
         """
 
-        # Get the results of all retrievers.
-        retriever_docs = [
-            retriever.get_relevant_documents(
+        def retrieve(i: int, retriever: BaseRetriever) -> List[Document]:
+            start = time.perf_counter()
+            docs = retriever.get_relevant_documents(
                 query,
                 callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
                 **kwagrs,
             )
-            for i, retriever in enumerate(self.retrievers)
-        ]
+            self._report_cost(run_manager, i, time.perf_counter() - start, docs)
+            return docs
+
+        # Get the results of all retrievers.
+        if len(self.retrievers) <= 1:
+            retriever_docs = [retrieve(i, retriever) for i, retriever in enumerate(self.retrievers)]
+        else:
+            with ThreadPoolExecutor(max_workers=len(self.retrievers)) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, retrieve, i, retriever)
+                    for i, retriever in enumerate(self.retrievers)
+                ]
+                retriever_docs = [future.result() for future in futures]
 
         # apply rank fusion
         fused_documents = self.weighted_reciprocal_rank(retriever_docs)
@@ -126,6 +145,7 @@ class EnsembleRetriever(BaseRetriever):
         """
         Asynchronously retrieve the results of the retrievers
         and use rank_fusion_func to get the final result.
+        Retrievers are awaited concurrently.
 
         Args:
             query: The query to search for.
@@ -134,21 +154,49 @@ class EnsembleRetriever(BaseRetriever):
             A list of reranked documents.
         """
 
-        # Get the results of all retrievers.
-        retriever_docs = [
-            await retriever.aget_relevant_documents(
+        async def aretrieve(i: int, retriever: BaseRetriever) -> List[Document]:
+            start = time.perf_counter()
+            docs = await retriever.aget_relevant_documents(
                 query,
                 callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
                 **kwagrs,
             )
-            for i, retriever in enumerate(self.retrievers)
-        ]
+            await self._areport_cost(run_manager, i, time.perf_counter() - start, docs)
+            return docs
+
+        # Get the results of all retrievers.
+        retriever_docs = await asyncio.gather(
+            *[aretrieve(i, retriever) for i, retriever in enumerate(self.retrievers)])
 
         # apply rank fusion
-        fused_documents = self.weighted_reciprocal_rank(retriever_docs)
+        fused_documents = self.weighted_reciprocal_rank(list(retriever_docs))
 
         return fused_documents
 
+    @staticmethod
+    def _cost_text(index: int, cost: float, docs: List[Document]) -> str:
+        return f"retriever_{index+1} cost={cost:.3f}s docs={len(docs)}"
+
+    def _report_cost(self, run_manager: CallbackManagerForRetrieverRun, index: int, cost: float,
+                     docs: List[Document]) -> None:
+        """Report the time cost of one retriever to the callbacks."""
+        text = self._cost_text(index, cost, docs)
+        logger.debug(text)
+        run_manager.on_text(text, retriever_index=index, cost=cost)
+
+    async def _areport_cost(self, run_manager: AsyncCallbackManagerForRetrieverRun, index: int,
+                            cost: float, docs: List[Document]) -> None:
+        """Report the time cost of one retriever to the callbacks."""
+        text = self._cost_text(index, cost, docs)
+        logger.debug(text)
+        await run_manager.on_text(text, retriever_index=index, cost=cost)
+
+    def _doc_key(self, doc: Document) -> Any:
+        """The key used to identify the same document in different rank lists."""
+        if self.id_key and doc.metadata.get(self.id_key) is not None:
+            return doc.metadata[self.id_key]
+        return doc.page_content
+
     def weighted_reciprocal_rank(self, doc_lists: List[List[Document]]) -> List[Document]:
         """
         Perform weighted Reciprocal Rank Fusion on multiple rank lists.
@@ -165,26 +213,16 @@ class EnsembleRetriever(BaseRetriever):
         if len(doc_lists) != len(self.weights):
             raise ValueError("Number of rank lists must be equal to the number of weights.")
 
-        # Create a union of all unique documents in the input doc_lists
-        all_documents = set()
-        for doc_list in doc_lists:
-            for doc in doc_list:
-                all_documents.add(doc.page_content)
-
-        # Initialize the RRF score dictionary for each document
-        rrf_score_dic = {doc: 0.0 for doc in all_documents}
-
-        # Calculate RRF scores for each document
+        # Accumulate the RRF score of each document in one pass
+        rrf_score_dic: Dict[Any, float] = {}
+        key_to_doc_map: Dict[Any, Document] = {}
         for doc_list, weight in zip(doc_lists, self.weights):
             for rank, doc in enumerate(doc_list, start=1):
-                rrf_score = weight * (1 / (rank + self.c))
-                rrf_score_dic[doc.page_content] += rrf_score
+                key = self._doc_key(doc)
+                rrf_score_dic[key] = rrf_score_dic.get(key, 0.0) + weight / (rank + self.c)
+                # the last seen document object is returned for the same key
+                key_to_doc_map[key] = doc
 
         # Sort documents by their RRF scores in descending order
-        sorted_documents = sorted(rrf_score_dic.keys(), key=lambda x: rrf_score_dic[x], reverse=True)
-
-        # Map the sorted page_content back to the original document objects
-        page_content_to_doc_map = {doc.page_content: doc for doc_list in doc_lists for doc in doc_list}
-        sorted_docs = [page_content_to_doc_map[page_content] for page_content in sorted_documents]
-
-        return sorted_docs
+        sorted_keys = sorted(rrf_score_dic, key=rrf_score_dic.__getitem__, reverse=True)
+        return [key_to_doc_map[key] for key in sorted_keys]
@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 import bisect
-import copy
 import logging
 import re
 from abc import ABC, abstractmethod
@@ -44,6 +43,10 @@ def _split_text_with_regex(
     return [s for s in splits if s != '']
 
 
+# per element positional arrays produced by etl4lm, sliced per chunk instead of copied
+_POSITIONAL_KEYS = ('bboxes', 'indexes', 'pages', 'types')
+
+
 class IntervalSearch(object):
     def __init__(self, inters):
         arrs = []
@@ -164,58 +167,52 @@ class ElemCharacterTextSplitter(RecursiveCharacterTextSplitter):
     def create_documents(
             self, texts: List[str], metadatas: Optional[List[dict]] = None
     ) -> List[Document]:
-        """Create documents from a list of texts."""
+        """Create documents from a list of texts.
+
+        Document level metadata is shared by all chunks of the document, only the
+        positional arrays (bboxes, indexes, pages, types) are sliced per chunk.
+        """
+        _metadatas = metadatas or [{}] * len(texts)
         documents = []
         for i, text in enumerate(texts):
+            metadata = _metadatas[i]
+            indexes = metadata.get('indexes', [])
+            pages = metadata.get('pages', [])
+            types = metadata.get('types', [])
+            bboxes = metadata.get('bboxes', [])
+            searcher = IntervalSearch(indexes) if indexes and bboxes else None
+            if searcher is not None:
+                shared_metadata = {k: v for k, v in metadata.items() if k not in _POSITIONAL_KEYS}
+            else:
+                shared_metadata = metadata
+            # chunks are emitted in order, so the search for the next chunk
+            # starts right after the start of the previous one
             index = -1
-            indexes = metadatas[i].get('indexes', [])
-            pages = metadatas[i].get('pages', [])
-            types = metadatas[i].get('types', [])
-            bboxes = metadatas[i].get('bboxes', [])
-            searcher = IntervalSearch(indexes)
-            split_texts = self.split_text(text)
-            for chunk in split_texts:
-                new_metadata = copy.deepcopy(metadatas[i])
-                if indexes and bboxes:
-                    index = text.find(chunk, index + 1)
+            for chunk in self.split_text(text):
+                new_metadata = dict(shared_metadata)
+                if searcher is not None:
+                    found = text.find(chunk, index + 1)
+                    if found != -1:
+                        index = found
+                    else:
+                        # chunk is not a verbatim substring (e.g. whitespace stripped),
+                        # keep the previous offset instead of rescanning from the start
+                        index = max(index, 0)
                     inter0 = [index, index + len(chunk) - 1]
-                    norm_inter = searcher.find(inter0)
-                    new_metadata['chunk_bboxes'] = []
-                    for j in range(norm_inter[0], norm_inter[1] + 1):
-                        new_metadata['chunk_bboxes'].append(
-                            {'page': pages[j], 'bbox': bboxes[j]})
-
-                    c = Counter([types[j] for j in norm_inter])
-                    chunk_type = c.most_common(1)[0][0]
-                    new_metadata['chunk_type'] = chunk_type
-                    new_metadata['source'] = metadatas[i].get('source', '')
-
-                # for chunk in split_texts:
-                #     new_metadata = {}
-                #     new_metadata['chunk_type'] = metadata.get('chunk_type', 'paragraph')
-                #     new_metadata['bboxes'] = metadata.get('bboxes', [])
-                #     new_metadata['source'] = metadata.get('source', '')
-                #     # chunk's start index in text
-                #     index = text.find(chunk, index + 1)
-                #     new_metadata['start'] = metadata.get('start', 0) + index
-                #     new_metadata['end'] = metadata.get('start', 0) + index + len(chunk) - 1
-
-                #     if 'page' in metadata:
-                #         new_metadata['page'] = metadata['page'][new_metadata['start']:new_metadata['end']+1]
-                #     if 'token_to_bbox' in metadata:
-                #         new_metadata['token_to_bbox'] = metadata['token_to_bbox'][new_metadata['start']:new_metadata['end']+1]
-
-                #     if 'page' in new_metadata and 'token_to_bbox' in new_metadata:
-                #         box_no_duplicates = set()
-                #         for index in range(len(new_metadata['page'])):
-                #             box_no_duplicates.add(
-                #                 (new_metadata['page'][index], new_metadata['token_to_bbox'][index]))
-
-                #         new_metadata['chunk_bboxes'] = []
-                #         for elem in box_no_duplicates:
-                #             new_metadata['chunk_bboxes'].append(
-                #                 {'page': elem[0], 'bbox': new_metadata['bboxes'][elem[1]]})
-                new_doc = Document(page_content=chunk, metadata=new_metadata)
-                prev_document = new_doc
-                documents.append(new_doc)
+                    lo, hi = searcher.find(inter0)
+                    hi += 1
+                    chunk_pages = pages[lo:hi]
+                    chunk_bboxes = bboxes[lo:hi]
+                    chunk_types = types[lo:hi]
+                    new_metadata['indexes'] = indexes[lo:hi]
+                    new_metadata['pages'] = chunk_pages
+                    new_metadata['bboxes'] = chunk_bboxes
+                    new_metadata['types'] = chunk_types
+                    new_metadata['chunk_bboxes'] = [
+                        {'page': page, 'bbox': bbox} for page, bbox in zip(chunk_pages, chunk_bboxes)
+                    ]
+                    if chunk_types:
+                        new_metadata['chunk_type'] = Counter(chunk_types).most_common(1)[0][0]
+                    new_metadata['source'] = metadata.get('source', '')
+                documents.append(Document(page_content=chunk, metadata=new_metadata))
         return documents
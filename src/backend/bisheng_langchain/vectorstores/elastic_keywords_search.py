@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import ast
+import threading
 import uuid
 from abc import ABC
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
@@ -24,6 +25,22 @@ def _default_text_mapping() -> Dict:
     return {'properties': {'text': {'type': 'text'}}}
 
 
+# elasticsearch服务的主版本号缓存, key为服务地址, 避免每次检索前都请求一次info接口
+_es_version_cache: Dict[str, int] = {}
+_es_version_lock = threading.Lock()
+
+
+def get_es_major_version(client: Any, cache_key: Optional[str] = None) -> int:
+    """Return the major version of the elasticsearch server, cached per server."""
+    if cache_key is not None and cache_key in _es_version_cache:
+        return _es_version_cache[cache_key]
+    version_num = int(client.info()['version']['number'].split('.')[0])
+    if cache_key is not None:
+        with _es_version_lock:
+            _es_version_cache[cache_key] = version_num
+    return version_num
+
+
 DEFAULT_PROMPT = PromptTemplate(
     input_variables=['question'],
     template="""分析给定Question，提取Question中包含的KeyWords，输出列表形式
@@ -112,8 +129,12 @@ class ElasticKeywordsSearch(VectorStore, ABC):
         *,
         ssl_verify: Optional[Dict[str, Any]] = None,
         llm_chain: Optional[LLMChain] = None,
+        client: Optional[Elasticsearch] = None,
     ):
-        """Initialize with necessary components."""
+        """Initialize with necessary components.
+
+        Pass an existing `client` to share its connection pool between instances.
+        """
         try:
             import elasticsearch
         except ImportError:
@@ -126,10 +147,13 @@ class ElasticKeywordsSearch(VectorStore, ABC):
         _ssl_verify = ssl_verify or {}
         self.elasticsearch_url = elasticsearch_url
         self.ssl_verify = _ssl_verify
-        try:
-            self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
-        except ValueError as e:
-            raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
+        if client is not None:
+            self.client = client
+        else:
+            try:
+                self.client = elasticsearch.Elasticsearch(elasticsearch_url, **_ssl_verify)
+            except ValueError as e:
+                raise ValueError(f'Your elasticsearch client string is mis-formatted. Got error: {e} ')
 
         if drop_old:
             try:
@@ -314,16 +338,14 @@ class ElasticKeywordsSearch(VectorStore, ABC):
         return vectorsearch
 
     def create_index(self, client: Any, index_name: str, mapping: Dict) -> None:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = get_es_major_version(client, self.elasticsearch_url)
         if version_num >= 8:
             client.indices.create(index=index_name, mappings=mapping)
         else:
             client.indices.create(index=index_name, body={'mappings': mapping})
 
     def client_search(self, client: Any, index_name: str, script_query: Dict, size: int) -> Any:
-        version_num = client.info()['version']['number'][0]
-        version_num = int(version_num)
+        version_num = get_es_major_version(client, self.elasticsearch_url)
         if version_num >= 8:
             params = {
                 "index": index_name,
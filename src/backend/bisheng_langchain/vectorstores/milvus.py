@@ -1,7 +1,9 @@
 """Wrapper around the Milvus vector database."""
 from __future__ import annotations
 
+import copy
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
 from uuid import uuid4
 
@@ -112,8 +114,13 @@ class Milvus(MilvusLangchain):
                  primary_field: str = 'pk',
                  text_field: str = 'text',
                  vector_field: str = 'vector',
-                 partition_field: str = 'knowledge_id'):
-        """Initialize the Milvus vector store."""
+                 partition_field: str = 'knowledge_id',
+                 init_state: Optional[dict[str, Any]] = None):
+        """Initialize the Milvus vector store.
+
+        init_state is the result of `export_state` of another instance on the
+        same collection, reuse it to skip the collection describe/index/load RPCs.
+        """
         try:
             from pymilvus import Collection, utility
         except ImportError:
@@ -203,6 +210,10 @@ class Milvus(MilvusLangchain):
         self.metadata_expr = metadata_expr
 
         self.fields: list[str] = []
+        if init_state is not None:
+            self._apply_state(init_state)
+            return
+
         # Create the connection to the server
         if connection_args is None:
             connection_args = DEFAULT_MILVUS_CONNECTION
@@ -235,6 +246,28 @@ class Milvus(MilvusLangchain):
         from pymilvus import connections
         connections.remove_connection(using)
 
+    def export_state(self) -> Optional[dict[str, Any]]:
+        """Export the loaded collection state, which can be passed to another
+        instance as `init_state`. Return None if the collection is not ready."""
+        from pymilvus import Collection
+
+        if not isinstance(self.col, Collection) or self.search_params is None:
+            return None
+        return {
+            'alias': self.alias,
+            'col': self.col,
+            'fields': list(self.fields),
+            'index_params': copy.deepcopy(self.index_params),
+            'search_params': copy.deepcopy(self.search_params),
+        }
+
+    def _apply_state(self, state: dict[str, Any]) -> None:
+        self.alias = state['alias']
+        self.col = state['col']
+        self.fields = list(state['fields'])
+        self.index_params = copy.deepcopy(state['index_params'])
+        self.search_params = copy.deepcopy(state['search_params'])
+
     def _create_connection_alias(self, connection_args: dict, personal_alias: str = None) -> str:
         """Create the connection to the Milvus server."""
         from pymilvus import MilvusException, connections
@@ -453,6 +486,9 @@ class Milvus(MilvusLangchain):
         timeout: Optional[int] = None,
         batch_size: int = 1000,
         no_embedding: bool = False,
+        embeddings: Optional[List[List[float]]] = None,
+        embed_batch_size: Optional[int] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
         **kwargs: Any,
     ) -> List[str]:
         """Insert text data into Milvus.
@@ -473,6 +509,14 @@ class Milvus(MilvusLangchain):
                 to None.
             batch_size (int, optional): Batch size to use for insertion.
                 Defaults to 1000.
+            embeddings (Optional[List[List[float]]]): Precomputed vectors of the
+                texts, skip calling the embedding function if given.
+            embed_batch_size (Optional[int]): Enable streaming mode. Texts are
+                embedded in micro-batches of this size and every batch is
+                inserted as soon as it is embedded, while the next batch is
+                being embedded. Defaults to None, embed everything first.
+            progress_callback (Optional[Callable[[int, int], None]]): Called
+                after every insert with (inserted_count, total_count).
 
         Raises:
             MilvusException: Failure to add texts
@@ -480,28 +524,67 @@ class Milvus(MilvusLangchain):
         Returns:
             List[str]: The resulting keys for each inserted element.
         """
-        from pymilvus import Collection, MilvusException
+        from pymilvus import Collection
 
         texts = list(texts)
-        if not no_embedding:
-            try:
-                embeddings = self.embedding_func.embed_documents(texts)
-            except NotImplementedError:
-                embeddings = [self.embedding_func.embed_query(x) for x in texts]
+        if embeddings is None and not no_embedding and embed_batch_size:
+            return self._stream_add_texts(texts,
+                                          metadatas=metadatas,
+                                          timeout=timeout,
+                                          embed_batch_size=embed_batch_size,
+                                          progress_callback=progress_callback,
+                                          **kwargs)
 
-            if len(embeddings) == 0:
-                logger.debug('Nothing to insert, skipping.')
-                return []
+        if embeddings is not None:
+            if len(embeddings) != len(texts):
+                raise ValueError('the number of embeddings does not match the number of texts')
+        elif not no_embedding:
+            embeddings = self._embed_texts(texts)
         else:
             embeddings = [[0.0]] * len(texts)
-            if len(embeddings) == 0:
-                logger.debug('Nothing to insert, skipping.')
-                return []
+        if len(embeddings) == 0:
+            logger.debug('Nothing to insert, skipping.')
+            return []
 
         # If the collection hasn't been initialized yet, perform all steps to do so
         if not isinstance(self.col, Collection):
             self._init(embeddings, metadatas)
 
+        total_count = len(embeddings)
+        pks: list[str] = []
+        for i in range(0, total_count, batch_size):
+            # Grab end index
+            end = min(i + batch_size, total_count)
+            pks.extend(
+                self._insert_batch(texts[i:end],
+                                   embeddings[i:end],
+                                   metadatas[i:end] if metadatas is not None else None,
+                                   timeout=timeout,
+                                   offset=i,
+                                   total_count=total_count,
+                                   **kwargs))
+            if progress_callback:
+                progress_callback(len(pks), total_count)
+        return pks
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with the embedding function."""
+        try:
+            return self.embedding_func.embed_documents(texts)
+        except NotImplementedError:
+            return [self.embedding_func.embed_query(x) for x in texts]
+
+    def _insert_batch(self,
+                      texts: List[str],
+                      embeddings: List[List[float]],
+                      metadatas: Optional[List[dict]] = None,
+                      timeout: Optional[int] = None,
+                      offset: int = 0,
+                      total_count: int = 0,
+                      **kwargs: Any) -> List[str]:
+        """Insert one batch of texts with their vectors into the collection."""
+        from pymilvus import Collection, MilvusException
+
         # Dict to hold all insert columns
         insert_dict: dict[str, list] = {
             self._text_field: texts,
@@ -515,33 +598,75 @@ class Milvus(MilvusLangchain):
                     if key in self.fields:
                         insert_dict.setdefault(key, []).append(value)
 
-        # Total insert count
-        vectors: list = insert_dict[self._vector_field]
-        total_count = len(vectors)
-
-        pks: list[str] = []
+        # Convert dict to list of lists batch for insertion
+        insert_list = [insert_dict[x] for x in self.fields if x in insert_dict]
 
         assert isinstance(self.col, Collection)
-        for i in range(0, total_count, batch_size):
-            # Grab end index
-            end = min(i + batch_size, total_count)
-            # Convert dict to list of lists batch for insertion
-            insert_list = [insert_dict[x][i:end] for x in self.fields if x in insert_dict]
-            # Insert into the collection.
-            try:
-                res = self.col.insert(insert_list, timeout=timeout, **kwargs)
-                pks.extend(res.primary_keys)
-            except ConnectionNotExistException as e:
-                logger.warning(f'retrying connection to milvus {e}')
-                # reconnect to milvus
-                self._create_connection_alias(self.connection_args, self.alias)
-
-                # insert data
-                res = self.col.insert(insert_list, timeout=timeout, **kwargs)
-                pks.extend(res.primary_keys)
-            except MilvusException as e:
-                logger.error('Failed to insert batch starting at entity: %s/%s', i, total_count)
-                raise e
+        # Insert into the collection.
+        try:
+            res = self.col.insert(insert_list, timeout=timeout, **kwargs)
+        except ConnectionNotExistException as e:
+            logger.warning(f'retrying connection to milvus {e}')
+            # reconnect to milvus
+            self._create_connection_alias(self.connection_args, self.alias)
+
+            # insert data
+            res = self.col.insert(insert_list, timeout=timeout, **kwargs)
+        except MilvusException as e:
+            logger.error('Failed to insert batch starting at entity: %s/%s', offset, total_count)
+            raise e
+        return res.primary_keys
+
+    def _stream_add_texts(self,
+                          texts: List[str],
+                          metadatas: Optional[List[dict]] = None,
+                          timeout: Optional[int] = None,
+                          embed_batch_size: int = 100,
+                          progress_callback: Optional[Callable[[int, int], None]] = None,
+                          **kwargs: Any) -> List[str]:
+        """Embed texts in micro-batches and insert every batch once it is embedded.
+
+        One embedding request is kept in flight while the previous batch is
+        inserted, so only two batches of vectors are held in memory at a time.
+        """
+        from pymilvus import Collection
+
+        total_count = len(texts)
+        if total_count == 0:
+            logger.debug('Nothing to insert, skipping.')
+            return []
+
+        def embed_batch(start: int) -> List[List[float]]:
+            return self._embed_texts(texts[start:start + embed_batch_size])
+
+        pks: list[str] = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(embed_batch, 0)
+            for start in range(0, total_count, embed_batch_size):
+                embeddings = future.result()
+                if start + embed_batch_size < total_count:
+                    future = executor.submit(embed_batch, start + embed_batch_size)
+                if len(embeddings) == 0:
+                    logger.debug('Nothing to insert, skipping.')
+                    continue
+                end = start + len(embeddings)
+                batch_metadatas = metadatas[start:end] if metadatas is not None else None
+
+                # If the collection hasn't been initialized yet, perform all steps to do so
+                if not isinstance(self.col, Collection):
+                    self._init(embeddings, batch_metadatas)
+
+                pks.extend(
+                    self._insert_batch(texts[start:end],
+                                       embeddings,
+                                       batch_metadatas,
+                                       timeout=timeout,
+                                       offset=start,
+                                       total_count=total_count,
+                                       **kwargs))
+                logger.debug('Streaming insert progress: %s/%s', len(pks), total_count)
+                if progress_callback:
+                    progress_callback(len(pks), total_count)
         return pks
 
     def similarity_search(
@@ -0,0 +1,51 @@
+"""
+灵思任务历史记录token统计的性能对比：每一步全量序列化并统计 vs 每条消息只统计一次
+模拟一个任务不断追加工具调用和工具结果，输出不同历史记录长度下单步判断是否需要总结的耗时
+python test/benchmark_linsight_history_tokens.py
+"""
+import json
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+
+from bisheng_langchain.linsight.task import Task
+from bisheng_langchain.linsight.utils import encode_str_tokens
+
+
+def legacy_tool_tokens(task: Task) -> int:
+    tool_messages = [one for one in task.history if task.is_tool_message(one)]
+    return len(encode_str_tokens(json.dumps([one.model_dump() for one in tool_messages], ensure_ascii=False, indent=2)))
+
+
+def append_step(task: Task, index: int):
+    tool_call = {'name': 'web_search', 'args': {'query': f'搜索关键词 {index}', 'call_reason': '查找相关资料'},
+                 'id': f'call_{index}', 'type': 'tool_call'}
+    task.history.append(AIMessage(content='', tool_calls=[tool_call], additional_kwargs={'tool_calls': [tool_call]}))
+    task.history.append(ToolMessage(name='web_search', tool_call_id=f'call_{index}',
+                                    content=f'第{index}条搜索结果：这是一段比较长的网页内容摘要。' * 20))
+
+
+def timeit(func, number: int = 5) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1000
+
+
+if __name__ == '__main__':
+    task = Task(id='benchmark', query='benchmark', llm=FakeListChatModel(responses=['']))
+    steps = 0
+    for history_steps in [10, 50, 100, 200, 400]:
+        while steps < history_steps:
+            append_step(task, steps)
+            steps += 1
+            # 每一步都会判断一次是否需要总结
+            task.get_tool_tokens()
+        new_tokens, legacy_tokens = task.get_tool_tokens(), legacy_tool_tokens(task)
+        append_step(task, steps)
+        steps += 1
+        new_cost = timeit(lambda: task.get_tool_tokens(), number=1)
+        legacy_cost = timeit(lambda: legacy_tool_tokens(task))
+        print(f'history steps={history_steps:<5} tokens new={new_tokens:<8} legacy={legacy_tokens:<8} '
+              f'per step new={new_cost:>8.2f}ms legacy={legacy_cost:>8.2f}ms')
@@ -0,0 +1,99 @@
+"""
+redis缓存值编码的性能对比：直接pickle vs RedisCodec（带版本头、大值压缩）
+传入redis地址时，额外对比 setnx+expire、mset+expire 等多次请求和 set nx ex、pipeline 单次请求的耗时
+python test/benchmark_redis_codec.py [redis://127.0.0.1:6379/0]
+"""
+import os
+import pickle
+import sys
+import time
+
+from bisheng.cache.codec import RedisCodec
+
+
+def gen_payloads():
+    message = {'id': 1, 'chat_id': 'c' * 32, 'flow_id': 'f' * 32, 'category': 'answer', 'is_bot': True,
+               'message': '这是一条机器人的回复消息，包含一些中文内容。' * 4, 'extra': {'source': 1}}
+    return {
+        'small dict': {'user_id': 1, 'role_ids': [1, 2, 3], 'admin_group_ids': [2]},
+        'chat message': message,
+        'history 100': [dict(message, id=i) for i in range(100)],
+        'config text 64KB': 'knowledges:\n  etl4lm:\n    url: http://127.0.0.1\n' * 1300,
+        'random bytes 64KB': os.urandom(65536),
+    }
+
+
+def timeit(func, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def compare_codec(number: int = 2000):
+    codecs = {
+        'pickle(legacy)': (pickle.dumps, pickle.loads),
+        'codec pickle': (RedisCodec().encode, RedisCodec.decode),
+        'codec json': (RedisCodec(serializer='json').encode, RedisCodec.decode),
+    }
+    for name, payload in gen_payloads().items():
+        print(name)
+        for codec_name, (dumps, loads) in codecs.items():
+            data = dumps(payload)
+            assert loads(data) == payload or codec_name == 'codec json', f'{name} {codec_name} not equal'
+            encode_cost = timeit(lambda: dumps(payload), number)
+            decode_cost = timeit(lambda: loads(data), number)
+            print(f'    {codec_name:<16} size={len(data):<8} encode={encode_cost:>8.2f}us '
+                  f'decode={decode_cost:>8.2f}us')
+
+
+def compare_round_trip(url: str, number: int = 1000):
+    import redis
+    connection = redis.StrictRedis.from_url(url)
+    codec = RedisCodec()
+    value = codec.encode({'user_id': 1})
+    keys = [f'benchmark:codec:{i}' for i in range(20)]
+
+    def setnx_expire():
+        connection.setnx(keys[0], value)
+        connection.expire(keys[0], 60)
+
+    def set_nx_ex():
+        connection.set(keys[0], value, nx=True, ex=60)
+
+    def mset_expire():
+        connection.mset({key: value for key in keys})
+        pipe = connection.pipeline()
+        for key in keys:
+            pipe.expire(key, 60)
+        pipe.execute()
+
+    def pipeline_set_ex():
+        pipe = connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(key, value, ex=60)
+        pipe.execute()
+
+    def incr_expire():
+        connection.incr(keys[1])
+        connection.expire(keys[1], 60)
+
+    def pipeline_incr_expire():
+        pipe = connection.pipeline()
+        pipe.incr(keys[1])
+        pipe.expire(keys[1], 60)
+        pipe.execute()
+
+    for name, legacy, new in [('setNx', setnx_expire, set_nx_ex),
+                              ('mset 20 keys', mset_expire, pipeline_set_ex),
+                              ('incr', incr_expire, pipeline_incr_expire)]:
+        legacy_cost = timeit(legacy, number)
+        new_cost = timeit(new, number)
+        print(f'{name:<16} new={new_cost:>8.2f}us legacy={legacy_cost:>8.2f}us')
+    connection.delete(*keys)
+
+
+if __name__ == '__main__':
+    compare_codec()
+    if len(sys.argv) > 1:
+        compare_round_trip(sys.argv[1])
@@ -0,0 +1,104 @@
+"""
+workflow拓扑分析的性能对比：路径枚举 vs 动态规划+最大流
+生成类似审批流的大图：多级条件节点，每级分成多个分支再汇合，最后有一条回到开头的循环边
+python test/benchmark_workflow_topology.py
+"""
+import random
+import time
+
+from bisheng.workflow.edges.edges import EdgeManage
+from bisheng.workflow.graph.topology import (build_node_level, build_node_level_by_paths,
+                                             has_exclusive_branch, has_exclusive_branch_by_paths)
+
+
+def gen_approval_workflow(stages: int, branches: int = 2, loop: bool = True):
+    """ 生成 start -> (condition -> 多个分支 -> 汇合节点) * stages -> end 的工作流 """
+    edges = []
+    condition_nodes = []
+
+    def add_edge(source, target):
+        edges.append({
+            'id': f'{source}-{target}-{len(edges)}',
+            'source': source,
+            'sourceHandle': 'right',
+            'target': target,
+            'targetHandle': 'left'
+        })
+
+    prev = 'start_1'
+    for i in range(stages):
+        condition = f'condition_{i}'
+        condition_nodes.append(condition)
+        add_edge(prev, condition)
+        join = f'llm_join_{i}'
+        for j in range(branches):
+            branch = f'llm_{i}_{j}'
+            add_edge(condition, branch)
+            add_edge(branch, join)
+        prev = join
+    add_edge(prev, 'input_1')
+    add_edge('input_1', 'end_1')
+    if loop:
+        # 用户输入后回到第一个条件节点重新审批
+        add_edge('input_1', 'condition_0')
+    return EdgeManage(edges), condition_nodes
+
+
+def gen_random_workflow(node_num: int, edge_num: int, condition_num: int, seed: int):
+    """ 生成随机的工作流，大部分边从前往后连接，少量回边 """
+    rnd = random.Random(seed)
+    ids = ['start_1'] + [f'node_{i}' for i in range(1, node_num)]
+    edges = []
+    for i in range(1, node_num):
+        source = ids[rnd.randrange(0, i)]
+        edges.append({'id': str(len(edges)), 'source': source, 'sourceHandle': 'a', 'target': ids[i],
+                      'targetHandle': 'b'})
+    while len(edges) < edge_num:
+        a, b = rnd.randrange(0, node_num), rnd.randrange(1, node_num)
+        if a > b and rnd.random() < 0.9:
+            a, b = b, a
+        edges.append({'id': str(len(edges)), 'source': ids[a], 'sourceHandle': 'a', 'target': ids[b],
+                      'targetHandle': 'b'})
+    return EdgeManage(edges), rnd.sample(ids[1:], condition_num)
+
+
+def analysis(edges: EdgeManage, condition_nodes, fast: bool):
+    start = time.perf_counter()
+    if fast:
+        node_level = build_node_level(edges, 'start_1')
+        if node_level is None:
+            node_level = build_node_level_by_paths(edges, 'start_1')
+        judge = has_exclusive_branch
+    else:
+        node_level = build_node_level_by_paths(edges, 'start_1')
+        judge = has_exclusive_branch_by_paths
+    exclusive = {}
+    for node_id, source_ids in edges.target_map.items():
+        if len(source_ids) > 1:
+            exclusive[node_id] = judge(edges, condition_nodes, node_id)
+    return node_level, exclusive, time.perf_counter() - start
+
+
+def compare(name: str, edges: EdgeManage, condition_nodes, run_legacy: bool = True):
+    new_level, new_exclusive, new_cost = analysis(edges, condition_nodes, fast=True)
+    if not run_legacy:
+        print(f'{name:<32} nodes={len(new_level):<5} new={new_cost * 1000:>10.2f}ms legacy=skip')
+        return
+    old_level, old_exclusive, old_cost = analysis(edges, condition_nodes, fast=False)
+    assert new_level == old_level, f'{name} node level not equal'
+    assert new_exclusive == old_exclusive, f'{name} exclusive branch not equal'
+    print(f'{name:<32} nodes={len(new_level):<5} new={new_cost * 1000:>10.2f}ms legacy={old_cost * 1000:>10.2f}ms')
+
+
+if __name__ == '__main__':
+    for stages in [2, 4, 6, 8, 10]:
+        compare(f'approval stages={stages}', *gen_approval_workflow(stages))
+    for stages in [12, 20, 60, 200]:
+        compare(f'approval stages={stages}', *gen_approval_workflow(stages), run_legacy=False)
+    for stages in [3, 5]:
+        compare(f'approval stages={stages} branch=3', *gen_approval_workflow(stages, branches=3))
+
+    for seed in range(200):
+        compare(f'random seed={seed}', *gen_random_workflow(12, 18, 3, seed))
+    for node_num in [60, 200, 1000]:
+        compare(f'random nodes={node_num}', *gen_random_workflow(node_num, node_num * 2, 10, 0), run_legacy=False)
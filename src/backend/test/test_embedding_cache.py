@@ -0,0 +1,71 @@
+from bisheng.interface.embeddings.cache import EmbeddingCache, EmbeddingCacheBackend
+
+PARAMS = {'model': 'bge-m3', 'openai_api_base': 'http://127.0.0.1:9997/v1', 'chunk_size': 1}
+
+
+class DictBackend(EmbeddingCacheBackend):
+
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def mset(self, mapping):
+        self.data.update(mapping)
+
+
+def new_cache():
+    return EmbeddingCache(backend=DictBackend(), local_max_size=0)
+
+
+def test_miss_then_hit():
+    cache = new_cache()
+    model_key = EmbeddingCache.make_model_key(1, 'OpenAIEmbeddings', PARAMS)
+    assert cache.get_many(model_key, ['a', 'b']) == [None, None]
+    cache.set_many(model_key, ['a'], [[0.5, 0.5]])
+    # 文本归一化后相同的视为同一条
+    assert cache.get_many(model_key, [' a ', 'b']) == [[0.5, 0.5], None]
+    assert cache.stats.to_dict()['misses'] == 3
+    assert cache.stats.remote_hits == 1
+
+
+def test_local_cache_hit():
+    cache = EmbeddingCache(backend=DictBackend(), local_max_size=10)
+    cache.set_many('1:x', ['a'], [[1.0]])
+    cache.backend.data.clear()
+    assert cache.get_many('1:x', ['a']) == [[1.0]]
+    assert cache.stats.local_hits == 1
+
+
+def test_document_and_query_are_separated():
+    cache = new_cache()
+    cache.set_many('1:x', ['a'], [[1.0]])
+    assert cache.get_many('1:x', ['a'], EmbeddingCache.QUERY) == [None]
+    cache.set_many('1:x', ['a'], [[2.0]], EmbeddingCache.QUERY)
+    assert cache.get_many('1:x', ['a'], EmbeddingCache.QUERY) == [[2.0]]
+    assert cache.get_many('1:x', ['a']) == [[1.0]]
+
+
+def test_config_change_invalidates():
+    cache = new_cache()
+    model_key = EmbeddingCache.make_model_key(1, 'OpenAIEmbeddings', PARAMS)
+    cache.set_many(model_key, ['a'], [[1.0]])
+    assert EmbeddingCache.make_model_key(1, 'OpenAIEmbeddings', dict(PARAMS)) == model_key
+
+    for changed in [EmbeddingCache.make_model_key(1, 'OpenAIEmbeddings', dict(PARAMS, model='bge-large')),
+                    EmbeddingCache.make_model_key(1, 'OpenAIEmbeddings',
+                                                  dict(PARAMS, openai_api_base='http://10.0.0.1/v1')),
+                    EmbeddingCache.make_model_key(1, 'OllamaEmbeddings', PARAMS),
+                    EmbeddingCache.make_model_key(2, 'OpenAIEmbeddings', PARAMS)]:
+        assert changed != model_key
+        assert cache.get_many(changed, ['a']) == [None]
+
+
+def test_backend_error_is_miss():
+    class BrokenBackend(DictBackend):
+        def mget(self, keys):
+            raise ConnectionError('redis down')
+
+    cache = EmbeddingCache(backend=BrokenBackend(), local_max_size=0)
+    assert cache.get_many('1:x', ['a']) == [None]
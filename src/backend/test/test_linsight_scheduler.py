@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel, FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+
+from bisheng_langchain.linsight.const import TaskStatus
+from bisheng_langchain.linsight.event import TaskEnd, TaskStart
+from bisheng_langchain.linsight.manage import TaskManage
+from bisheng_langchain.linsight.task import Task
+
+
+class FakeTask(Task):
+    """ 不调用模型，按target模拟任务的耗时和结果：slow 耗时更长，fail 执行失败 """
+
+    async def _ainvoke(self):
+        recorder = self.task_manager.recorder
+        recorder['active'] += 1
+        recorder['peak'] = max(recorder['peak'], recorder['active'])
+        recorder['log'].append(('start', self.step_id))
+        try:
+            await asyncio.sleep(0.2 if 'slow' in self.target else 0.02)
+        finally:
+            recorder['active'] -= 1
+        recorder['log'].append(('end', self.step_id))
+        if 'fail' in self.target:
+            self.status = TaskStatus.FAILED.value
+            self.answer.append('failed')
+            return
+        self.status = TaskStatus.SUCCESS.value
+        self.answer.append(self.step_id)
+
+
+class RecordTaskManage(TaskManage):
+    recorder: dict = {}
+
+
+def build_manage(specs: list, max_concurrency: int = 3) -> TaskManage:
+    """ specs: [(target, input)]，input为依赖的step_id """
+    plan = TaskManage.completion_task_tree_info([
+        dict(step_id=f'step_{index}', target=target, input=inputs, profile=f'step_{index}')
+        for index, (target, inputs) in enumerate(specs)
+    ])
+    manage = RecordTaskManage(max_concurrency=max_concurrency,
+                              recorder={'active': 0, 'peak': 0, 'log': []})
+    llm = FakeListChatModel(responses=['ok'])
+    manage.tasks = [FakeTask(**one, query='query', task_manager=manage, llm=llm) for one in plan]
+    manage.task_map = {one.id: one for one in manage.tasks}
+    manage.task_step_map = {one.step_id: one for one in manage.tasks}
+    return manage
+
+
+def run_manage(manage: TaskManage) -> list:
+    async def collect():
+        return [event async for event in manage.ainvoke_task()]
+
+    return asyncio.run(collect())
+
+
+def step_of(manage: TaskManage, event) -> str:
+    return manage.task_map[event.task_id].step_id
+
+
+def test_tasks_start_after_depends_finished():
+    manage = build_manage([('slow', ['query']), ('', ['step_0']), ('', ['query']), ('', ['step_1', 'step_2'])])
+    run_manage(manage)
+    log = manage.recorder['log']
+    for step_id, depends in [('step_1', ['step_0']), ('step_3', ['step_1', 'step_2'])]:
+        started = log.index(('start', step_id))
+        assert all(log.index(('end', one)) < started for one in depends)
+    # 没有依赖关系的任务不等待前面的慢任务
+    assert log.index(('end', 'step_2')) < log.index(('end', 'step_0'))
+    assert all(one.status == TaskStatus.SUCCESS.value for one in manage.tasks)
+
+
+def test_events_in_plan_order():
+    manage = build_manage([('slow', ['query']), ('', ['query']), ('', ['query'])])
+    events = run_manage(manage)
+    assert [step_of(manage, one) for one in events if isinstance(one, TaskStart)] == ['step_0', 'step_1', 'step_2']
+    # 每个任务的事件是连续的，和串行执行的输出一致
+    assert [(type(one).__name__, step_of(manage, one)) for one in events] == [
+        (name, f'step_{index}') for index in range(3) for name in ['TaskStart', 'TaskEnd']]
+
+
+def test_concurrency_bounded_by_semaphore():
+    manage = build_manage([('', ['query'])] * 6, max_concurrency=2)
+    run_manage(manage)
+    assert manage.recorder['peak'] == 2
+
+    manage = build_manage([('', ['query'])] * 6, max_concurrency=10)
+    run_manage(manage)
+    assert manage.recorder['peak'] == 6
+
+
+def test_failure_stops_dependents_and_cancels_running():
+    manage = build_manage([('slow', ['query']), ('fail', ['query']), ('', ['step_1'])])
+    events = []
+
+    async def collect():
+        async for event in manage.ainvoke_task():
+            events.append(event)
+
+    with pytest.raises(Exception, match='step_1'):
+        asyncio.run(collect())
+    log = manage.recorder['log']
+    # 依赖失败任务的任务不会执行，正在执行的任务被取消
+    assert ('start', 'step_2') not in log
+    assert ('end', 'step_0') not in log
+    assert manage.task_step_map['step_0'].status == TaskStatus.FAILED.value
+    assert manage.task_step_map['step_0'].answer == ['task exec cancelled']
+    assert manage.task_step_map['step_2'].status == TaskStatus.WAITING.value
+    assert any(isinstance(one, TaskEnd) and step_of(manage, one) == 'step_1' for one in events)
+
+
+def build_tool_task(tool_calls: list, files: dict, log: list) -> Task:
+    """ 模型第一步返回tool_calls，第二步返回最终答案；工具读写内存中的files """
+
+    async def add_text_to_file(file_path: str, content: str) -> str:
+        log.append(('start', 'add_text_to_file', content))
+        old = files.get(file_path, '')
+        # 模拟读写文件的耗时，先写入的内容耗时更长，并发执行时后一次写入会被覆盖
+        await asyncio.sleep(0.1 if content == 'first' else 0.01)
+        files[file_path] = old + content
+        log.append(('end', 'add_text_to_file', content))
+        return 'ok'
+
+    async def read_text_file(file_path: str) -> str:
+        log.append(('start', 'read_text_file', file_path))
+        await asyncio.sleep(0.05)
+        log.append(('end', 'read_text_file', file_path))
+        return files.get(file_path, '')
+
+    tools = [StructuredTool.from_function(coroutine=one, name=one.__name__, description=one.__name__)
+             for one in [add_text_to_file, read_text_file]]
+    calls = [dict(name=name, args=dict(args, call_reason='test'), id=f'call_{index}', type='tool_call')
+             for index, (name, args) in enumerate(tool_calls)]
+    llm = FakeMessagesListChatModel(responses=[
+        AIMessage(content='', tool_calls=calls, additional_kwargs={'tool_calls': calls}),
+        AIMessage(content='done'),
+    ])
+    manage = TaskManage(tools=tools)
+    plan = TaskManage.completion_task_tree_info([dict(step_id='step_0', target='', input=['query'], profile='step_0')])
+    task = Task(**plan[0], query='query', task_manager=manage, llm=llm)
+    manage.tasks = [task]
+    manage.task_map = {task.id: task}
+    manage.task_step_map = {task.step_id: task}
+    return task
+
+
+def test_writes_to_same_file_run_in_order():
+    files, log = {}, []
+    task = build_tool_task([('add_text_to_file', {'file_path': 'a.md', 'content': 'first'}),
+                            ('add_text_to_file', {'file_path': 'a.md', 'content': 'second'}),
+                            ('read_text_file', {'file_path': 'a.md'})], files, log)
+    asyncio.run(task._ainvoke())
+
+    assert files['a.md'] == 'firstsecond'
+    assert task.status == TaskStatus.SUCCESS.value
+    # 读取在写入完成后执行，结果按调用顺序写入历史记录
+    assert [one.content for one in task.history[1:4]] == ['ok', 'ok', 'firstsecond']
+    assert log.index(('end', 'add_text_to_file', 'second')) < log.index(('start', 'read_text_file', 'a.md'))
+
+
+def test_read_only_calls_run_concurrently():
+    files, log = {'a.md': 'a', 'b.md': 'b'}, []
+    task = build_tool_task([('read_text_file', {'file_path': 'a.md'}),
+                            ('read_text_file', {'file_path': 'b.md'})], files, log)
+    asyncio.run(task._ainvoke())
+
+    assert log[:2] == [('start', 'read_text_file', 'a.md'), ('start', 'read_text_file', 'b.md')]
+    assert [one.content for one in task.history[1:3]] == ['a', 'b']
@@ -0,0 +1,67 @@
+import openpyxl
+
+from bisheng.api.services.md_from_excel import iter_csv_markdown, iter_excel_markdown, iter_markdown_tables
+
+
+def table_rows(markdown: str) -> list:
+    """ 解析markdown表格，去掉分隔符行 """
+    return [[cell.strip() for cell in line.strip('|').split('|')] for line in markdown.split('\n')
+            if not line.startswith('|---')]
+
+
+def save_workbook(path, rows, merged=None):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    for one in merged or []:
+        sheet.merge_cells(one)
+    workbook.save(path)
+    return str(path)
+
+
+def test_rows_before_header_respect_slice_size():
+    rows = [['p1'], ['p2'], ['H'], ['d1'], ['d2'], ['d3']]
+    tables = list(iter_markdown_tables(rows, [2, 2], 1))
+    assert [table_rows(one) for one in tables] == [[['H'], [value]] for value in ['p1', 'p2', 'd1', 'd2', 'd3']]
+
+
+def test_slice_data_rows_with_header():
+    rows = [['h1', 'h2']] + [[f'a{i}', f'b{i}'] for i in range(5)]
+    tables = [table_rows(one) for one in iter_markdown_tables(rows, [0, 0], 2)]
+    assert [len(one) - 1 for one in tables] == [2, 2, 1]
+    assert all(one[0] == ['h1', 'h2'] for one in tables)
+    assert tables[-1][1] == ['a4', 'b4']
+
+
+def test_without_header_uses_first_row_of_each_slice():
+    rows = [[str(i)] for i in range(4)]
+    tables = list(iter_markdown_tables(rows, [0, 0], 2, append_header=False))
+    assert tables == ['| 0 |\n|---|\n| 1 |', '| 2 |\n|---|\n| 3 |']
+
+
+def test_only_header():
+    assert [table_rows(one) for one in iter_markdown_tables([['h1', 'h2']], [0, 0], 10)] == [[['h1', 'h2']]]
+
+
+def test_excel_merged_cells(tmp_path):
+    path = save_workbook(tmp_path / 'merged.xlsx', [['name', 'score'], ['a', 1], [None, 2], ['b', 3]],
+                         merged=['A2:A3'])
+    tables = [table_rows(one) for one in iter_excel_markdown(path, [0, 0], 10)]
+    assert tables == [[['name', 'score'], ['a', '1'], ['a', '2'], ['b', '3']]]
+
+
+def test_excel_chunks_share_sheet_width(tmp_path):
+    # 只有第一行数据有第三列，所有分片的列数都和整个工作表一致
+    path = save_workbook(tmp_path / 'width.xlsx', [['h1', 'h2'], ['a', 'b', 'c'], ['d'], ['e', None, None]])
+    tables = [table_rows(one) for one in iter_excel_markdown(path, [0, 0], 1)]
+    assert len(tables) == 3
+    assert all(len(row) == 3 for one in tables for row in one)
+    assert tables[1] == [['h1', 'h2', ''], ['d', '', '']]
+
+
+def test_csv_chunks_share_file_width(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('h1,h2\na,b,c\n\nd\n', encoding='utf-8')
+    tables = [table_rows(one) for one in iter_csv_markdown(str(path), [0, 0], 1)]
+    assert tables == [[['h1', 'h2', ''], ['a', 'b', 'c']], [['h1', 'h2', ''], ['d', '', '']]]
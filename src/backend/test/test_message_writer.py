@@ -0,0 +1,156 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from bisheng.database import message_writer
+from bisheng.database.message_writer import (CHAT_MESSAGE_ID_GAP, CHAT_MESSAGE_ID_KEY, ChatMessageWriter,
+                                             allocate_message_ids)
+
+
+class FakeRedisClient:
+    """ 用fakeredis执行真实的lua脚本 """
+
+    def __init__(self):
+        self.connection = fakeredis.FakeStrictRedis()
+
+    def eval(self, script, keys, args=None):
+        return self.connection.eval(script, len(keys), *keys, *(args or []))
+
+
+class FakeChatMessageDao:
+
+    def __init__(self, max_id: int = 41, insert_delay: float = 0):
+        self.max_id = max_id
+        self.insert_delay = insert_delay
+        self.batches = []
+        self.bad_ids = set()
+
+    def get_max_id(self) -> int:
+        return self.max_id
+
+    def insert_rows(self, messages):
+        time.sleep(self.insert_delay)
+        if any(one.id in self.bad_ids for one in messages):
+            raise ValueError('bad message')
+        self.batches.append([one.id for one in messages])
+
+    @property
+    def written(self):
+        return [one for batch in self.batches for one in batch]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedisClient()
+    monkeypatch.setattr(message_writer, 'redis_client', client)
+    return client
+
+
+@pytest.fixture
+def fake_dao(monkeypatch):
+    dao = FakeChatMessageDao()
+    monkeypatch.setattr(message_writer, 'ChatMessageDao', dao)
+    return dao
+
+
+def new_message():
+    return SimpleNamespace(id=None, chat_id='chat')
+
+
+def test_init_sequence_after_max_id(fake_redis, fake_dao):
+    assert allocate_message_ids(1) == [42 + CHAT_MESSAGE_ID_GAP]
+    assert allocate_message_ids(3) == [43 + CHAT_MESSAGE_ID_GAP + i for i in range(3)]
+
+
+def test_ids_monotonic_across_threads(fake_redis, fake_dao):
+    results = []
+    lock = threading.Lock()
+
+    def allocate():
+        local = [allocate_message_ids(2) for _ in range(50)]
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for one in threads:
+        one.start()
+    for one in threads:
+        one.join()
+    ids = [one for ids in results for one in ids]
+    assert len(set(ids)) == len(ids) == 800
+    # 每次分配的id连续，并且单个线程内的分配结果递增
+    assert all(ids[1] == ids[0] + 1 for ids in results)
+    assert sorted(ids) == list(range(min(ids), min(ids) + 800))
+
+
+def test_sequence_lost_restarts_after_max_id(fake_redis, fake_dao):
+    first = allocate_message_ids(1)[0]
+    fake_redis.connection.delete(CHAT_MESSAGE_ID_KEY)
+    fake_dao.max_id = first
+    assert allocate_message_ids(1) == [first + CHAT_MESSAGE_ID_GAP + 1]
+
+
+def test_flush_waits_for_pending_messages(fake_redis, fake_dao):
+    # 状态变化前会调用flush，flush返回时之前加入的消息都已经写入数据库
+    fake_dao.insert_delay = 0.1
+    writer = ChatMessageWriter(batch_size=100, flush_interval=0.5)
+    try:
+        messages = [writer.add(new_message()) for _ in range(5)]
+        writer.flush()
+        assert fake_dao.written == [one.id for one in messages]
+    finally:
+        writer.close()
+
+
+def test_batches_keep_id_order(fake_redis, fake_dao):
+    writer = ChatMessageWriter(batch_size=3, flush_interval=0.05)
+    try:
+        messages = [writer.add(new_message()) for _ in range(10)]
+        writer.flush()
+    finally:
+        writer.close()
+    assert all(len(one) <= 3 for one in fake_dao.batches)
+    assert fake_dao.written == sorted(one.id for one in messages)
+
+
+def test_bad_message_does_not_drop_batch(fake_redis, fake_dao):
+    writer = ChatMessageWriter(batch_size=10, flush_interval=0.5)
+    messages = [writer.add(new_message()) for _ in range(3)]
+    fake_dao.bad_ids.add(messages[1].id)
+    writer.close()
+    assert fake_dao.written == [messages[0].id, messages[2].id]
+
+
+def test_workflow_status_published_after_flush(monkeypatch):
+    from bisheng.worker.workflow import redis_callback
+    from bisheng.workflow.common.workflow import WorkflowStatus
+
+    calls = []
+
+    class FakeCallbackRedis:
+        def set(self, key, value, expiration=None):
+            calls.append(('set', key))
+
+        def xadd(self, key, fields, expiration=None):
+            calls.append(('xadd', key))
+
+        def delete(self, key):
+            calls.append(('delete', key))
+
+    monkeypatch.setattr(redis_callback.chat_message_writer, 'flush', lambda: calls.append(('flush', None)))
+    callback = redis_callback.RedisCallback.__new__(redis_callback.RedisCallback)
+    callback.redis_client = FakeCallbackRedis()
+    callback.workflow_cache = {}
+    callback.workflow_status_key = 'status'
+    callback.workflow_event_key = 'event'
+    callback.workflow_data_key = 'data'
+    callback.workflow_input_key = 'input'
+    callback.workflow_stop_key = 'stop'
+    callback.workflow_expire_time = 60
+
+    callback.set_workflow_status(WorkflowStatus.SUCCESS.value)
+    # 等待方收到状态变化的通知时，消息已经全部写入数据库
+    assert calls.index(('flush', None)) < calls.index(('xadd', 'event'))
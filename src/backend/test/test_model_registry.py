@@ -0,0 +1,61 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from bisheng.interface.model_registry import ModelClientRegistry
+
+
+def _registry() -> ModelClientRegistry:
+    registry = ModelClientRegistry()
+    registry._check_version = lambda: None
+    return registry
+
+
+def test_client_reused_in_same_scope():
+    registry = _registry()
+    factory = MagicMock(side_effect=lambda: object())
+
+    first = registry.get_client(1, 'ChatOpenAI', {'model': 'a'}, factory)
+    second = registry.get_client(1, 'ChatOpenAI', {'model': 'a'}, factory)
+    other = registry.get_client(1, 'ChatOpenAI', {'model': 'b'}, factory)
+
+    assert first is second
+    assert other is not first
+    assert factory.call_count == 2
+
+
+def test_client_not_shared_across_event_loops():
+    registry = _registry()
+
+    async def get_twice():
+        first = registry.get_client(1, 'ChatOpenAI', {'model': 'a'}, lambda: object())
+        await asyncio.sleep(0)
+        return first, registry.get_client(1, 'ChatOpenAI', {'model': 'a'}, lambda: object())
+
+    # 每次asyncio.run都是新的事件循环，客户端的异步连接池不能跨事件循环复用
+    first_a, first_b = asyncio.run(get_twice())
+    second_a, second_b = asyncio.run(get_twice())
+
+    assert first_a is first_b
+    assert second_a is second_b
+    assert first_a is not second_a
+
+
+def test_model_info_copied_per_caller():
+    registry = _registry()
+    model_info = MagicMock(server_id=2)
+    server_info = MagicMock()
+    with patch('bisheng.interface.model_registry.LLMDao') as dao, \
+            patch('bisheng.interface.model_registry.LLMModel') as model_cls, \
+            patch('bisheng.interface.model_registry.LLMServer') as server_cls:
+        dao.get_model_by_id.return_value = model_info
+        dao.get_server_by_id.return_value = server_info
+        model_cls.model_validate.side_effect = lambda data: MagicMock()
+        server_cls.model_validate.side_effect = lambda data: MagicMock()
+
+        first, _ = registry.get_model_info(1)
+        second, _ = registry.get_model_info(1)
+
+    # 只查一次库，但每个调用方拿到各自的副本
+    assert dao.get_model_by_id.call_count == 1
+    assert first is not second
+    assert first is not model_info
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from bisheng.utils.pipeline import PipelineStage, StagePipeline
+
+
+class Recorder:
+    """ 记录每个元素经过各阶段的顺序 """
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def stage(self, name: str, fail_on=(), delay: float = 0):
+        def handler(value):
+            with self.lock:
+                self.calls.append((name, value['id']))
+            if callable(delay):
+                time.sleep(delay(value))
+            elif delay:
+                time.sleep(delay)
+            if value['id'] in fail_on:
+                raise ValueError(f'{name} failed {value["id"]}')
+            return dict(value, path=value['path'] + [name])
+
+        return handler
+
+    def stages_of(self, item_id: int) -> list:
+        return [name for name, one in self.calls if one == item_id]
+
+
+def build_items(count: int) -> list:
+    return [{'id': i, 'path': []} for i in range(count)]
+
+
+def test_single_worker_keeps_input_order():
+    recorder = Recorder()
+    pipeline = StagePipeline([PipelineStage('parse', recorder.stage('parse')),
+                              PipelineStage('embed', recorder.stage('embed')),
+                              PipelineStage('insert', recorder.stage('insert'))])
+    results = list(pipeline.run(build_items(5)))
+    assert [one.item['id'] for one in results] == list(range(5))
+    assert all(one.error is None and one.value['path'] == ['parse', 'embed', 'insert'] for one in results)
+
+
+def test_stages_overlap_between_items():
+    # 前一个元素在写入阶段时，后一个元素已经开始解析
+    recorder = Recorder()
+    pipeline = StagePipeline([PipelineStage('parse', recorder.stage('parse', delay=0.05)),
+                              PipelineStage('insert', recorder.stage('insert', delay=0.1))])
+    start = time.monotonic()
+    results = list(pipeline.run(build_items(4)))
+    assert len(results) == 4
+    # 串行执行需要 (0.05 + 0.1) * 4 秒
+    assert time.monotonic() - start < (0.05 + 0.1) * 4
+
+
+def test_error_skips_later_stages():
+    recorder = Recorder()
+    pipeline = StagePipeline([PipelineStage('parse', recorder.stage('parse')),
+                              PipelineStage('embed', recorder.stage('embed', fail_on={1}), workers=2),
+                              PipelineStage('insert', recorder.stage('insert'))])
+    results = {one.item['id']: one for one in pipeline.run(build_items(3))}
+    assert sorted(results) == [0, 1, 2]
+    failed = results[1]
+    assert isinstance(failed.error, ValueError)
+    assert failed.failed_stage == 'embed'
+    assert recorder.stages_of(1) == ['parse', 'embed']
+    # 其他元素不受影响
+    for item_id in [0, 2]:
+        assert results[item_id].error is None
+        assert recorder.stages_of(item_id) == ['parse', 'embed', 'insert']
+
+
+def test_multiple_workers_yield_each_item_once():
+    recorder = Recorder()
+    # 偶数元素解析更慢，结果按完成顺序输出
+    parse = recorder.stage('parse', delay=lambda v: 0.05 if v['id'] % 2 == 0 else 0)
+    pipeline = StagePipeline([PipelineStage('parse', parse, workers=3),
+                              PipelineStage('insert', recorder.stage('insert'), workers=2)], queue_size=1)
+    results = list(pipeline.run(build_items(9)))
+    assert sorted(one.item['id'] for one in results) == list(range(9))
+    assert [one.item['id'] for one in results] != list(range(9))
+    for one in results:
+        assert recorder.stages_of(one.item['id']) == ['parse', 'insert']
+
+
+def test_empty_input_and_stages():
+    pipeline = StagePipeline([PipelineStage('parse', lambda v: v, workers=2)])
+    assert list(pipeline.run([])) == []
+    with pytest.raises(ValueError):
+        StagePipeline([])
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bisheng.utils.threadpool import ThreadPoolManager
+
+
+def wait_until(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+async def hold(gate: threading.Event, started: list):
+    """ 阻塞到gate被设置，返回执行所在的线程名 """
+    started.append(threading.current_thread().name)
+    while not gate.is_set():
+        await asyncio.sleep(0.01)
+    return threading.current_thread().name
+
+
+def pending_counts(pool: ThreadPoolManager) -> list:
+    return sorted(one.pending for one in pool.loop_threads)
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolManager(2, thread_name_prefix='test', loop_workers=3)
+    yield pool
+    pool.tear_down()
+
+
+def test_coroutines_dispatched_to_least_pending_loop(pool):
+    gates = [threading.Event() for _ in range(4)]
+    started = []
+    futures = [pool.submit('key', hold, gates[i], started) for i in range(3)]
+    assert wait_until(lambda: len(started) == 3)
+    # 三个协程分别在三个事件循环线程中执行
+    assert len(set(started)) == 3
+    assert pending_counts(pool) == [1, 1, 1]
+
+    # 结束其中一个协程后，新提交的协程分配到空闲的事件循环
+    gates[1].set()
+    idle_thread = futures[1].result(timeout=2)
+    assert wait_until(lambda: pending_counts(pool) == [0, 1, 1])
+    future = pool.submit('key', hold, gates[3], started)
+    assert wait_until(lambda: len(started) == 4)
+    assert started[3] == idle_thread
+
+    for gate in gates:
+        gate.set()
+    for one in futures + [future]:
+        one.result(timeout=2)
+    assert wait_until(lambda: pending_counts(pool) == [0, 0, 0])
+    assert pool.get_task_stats('key')['key']['run_time']['count'] == 4
+
+
+def test_loop_threads_are_reused(pool):
+    gate = threading.Event()
+    gate.set()
+    names = {pool.submit('key', hold, gate, []).result(timeout=2) for _ in range(10)}
+    assert len(pool.loop_threads) == 3
+    assert names <= {one.name for one in pool.loop_threads}
+
+
+def test_cancel_task_cancels_coroutine(pool):
+    cancelled = threading.Event()
+
+    async def sleep_forever():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    future = pool.submit('key', sleep_forever)
+    assert wait_until(lambda: pending_counts(pool) == [0, 0, 1])
+    assert pool.cancel_task(['key']) == [True]
+    assert cancelled.wait(2)
+    assert future.cancelled()
+    assert wait_until(lambda: pending_counts(pool) == [0, 0, 0])
+
+
+def test_tear_down_stops_loops_and_executor():
+    pool = ThreadPoolManager(1, thread_name_prefix='test', loop_workers=2)
+    gate = threading.Event()
+    running = pool.submit('key', hold, gate, [])
+    assert pool.submit('key', lambda: 'ok').result(timeout=2) == 'ok'
+    loop_threads = list(pool.loop_threads)
+
+    pool.tear_down()
+    for one in loop_threads:
+        one.thread.join(timeout=2)
+        assert not one.thread.is_alive()
+    assert running.cancelled()
+    assert pool.loop_threads == []
+    with pytest.raises(RuntimeError):
+        pool.submit('key', lambda: 'ok')
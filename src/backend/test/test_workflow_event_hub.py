@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+
+from bisheng.worker.workflow import event_hub
+from bisheng.worker.workflow.event_hub import WorkflowEventHub
+
+
+class FakeRedisClient:
+    """ 所有事件循环共用一个fakeredis服务，每个线程使用自己的异步连接 """
+
+    def __init__(self):
+        self.server = fakeredis.FakeServer()
+        self.sync_connection = fakeredis.FakeRedis(server=self.server)
+        self._local = threading.local()
+
+    @property
+    def async_block_connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = fakeredis.FakeAsyncRedis(server=self.server)
+        return self._local.connection
+
+    async def axread(self, streams, count=None, block=None):
+        return await self.async_block_connection.xread(streams, count=count, block=block)
+
+    async def axadd(self, key, fields, maxlen=None, expiration=3600):
+        return await self.async_block_connection.xadd(key, fields, maxlen=maxlen)
+
+
+def test_waiters_on_different_loops_are_woken(monkeypatch):
+    client = FakeRedisClient()
+    monkeypatch.setattr(event_hub, 'redis_client', client)
+    hub = WorkflowEventHub(block_ms=200)
+    started = threading.Barrier(3)
+    results = {}
+
+    def wait_in_new_loop(name: str, stream_key: str):
+        async def main():
+            # 每个线程的事件循环各自注册等待，互不影响
+            waiting = asyncio.ensure_future(hub.wait(stream_key, timeout=5))
+            await asyncio.sleep(0.1)
+            started.wait()
+            begin = time.monotonic()
+            results[name] = (await waiting, time.monotonic() - begin)
+
+        asyncio.run(main())
+
+    threads = [threading.Thread(target=wait_in_new_loop, args=(name, 'workflow:test:event_stream'))
+               for name in ['loop_a', 'loop_b']]
+    for one in threads:
+        one.start()
+    started.wait()
+    client.sync_connection.xadd('workflow:test:event_stream', {'type': 'status'})
+    for one in threads:
+        one.join(timeout=10)
+
+    assert set(results) == {'loop_a', 'loop_b'}
+    for woken, cost in results.values():
+        assert woken is True
+        assert cost < 2
+    # 每个事件循环有自己的监听状态，已关闭的事件循环在下次使用时清理
+    assert len(hub._listeners) == 2
+
+    async def wait_timeout():
+        return await hub.wait('workflow:other:event_stream', timeout=0.2)
+
+    assert asyncio.run(wait_timeout()) is False
+    assert len(hub._listeners) == 1
+
+
+def test_status_marker_rechecks_status_without_waiting(monkeypatch):
+    from bisheng.worker.workflow import redis_callback
+    from bisheng.workflow.common.workflow import WorkflowStatus
+
+    class FakePipeline:
+        def __init__(self):
+            self.commands = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+        def lrange(self, *args):
+            self.commands.append([])
+
+        def ltrim(self, *args):
+            self.commands.append(True)
+
+        async def execute(self):
+            return self.commands
+
+    class FakeCallbackRedis:
+        def __init__(self):
+            self.statuses = [WorkflowStatus.RUNNING.value, WorkflowStatus.SUCCESS.value]
+            self.entries = [(b'1-0', {b'type': b'status'})]
+
+        async def aget(self, key):
+            status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+            return {'status': status, 'reason': None, 'time': time.time()}
+
+        def async_pipeline(self):
+            return FakePipeline()
+
+        async def axrange(self, key, count=None):
+            entries, self.entries = self.entries, []
+            return entries
+
+        async def axdel(self, key, *ids):
+            return len(ids)
+
+    waits = []
+
+    async def fake_wait(stream_key, timeout):
+        waits.append(stream_key)
+        await asyncio.sleep(timeout)
+        return False
+
+    monkeypatch.setattr(redis_callback.workflow_event_hub, 'wait', fake_wait)
+    callback = redis_callback.RedisCallback.__new__(redis_callback.RedisCallback)
+    callback.redis_client = FakeCallbackRedis()
+    callback.workflow_cache = {}
+    callback.workflow_status_key = 'status'
+    callback.workflow_event_key = 'event'
+    callback.legacy_workflow_event_key = 'legacy_event'
+    callback.has_legacy_event = False
+
+    async def collect():
+        return [one async for one in callback.get_response_until_break()]
+
+    begin = time.monotonic()
+    assert asyncio.run(collect()) == []
+    # 只读到状态变化的通知时立即重新检查状态，不进入等待
+    assert waits == []
+    assert time.monotonic() - begin < 1